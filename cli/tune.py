@@ -0,0 +1,4 @@
+from src.cli.tune import main
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+from src.cli.update_results import main
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from eval.backtest import PERIODS, Split, expanding_window_splits
+from eval.accumulators import StreamingMetrics
+from models.backends import optional_import
+from models.budget import DEFAULT_MLP_PATIENCE, DEFAULT_PATIENCE, parse_time_budgets
+from models.calibrate import CalibrationResult, choose_best_calibrator
+from models.ensemble import ContextGatedEnsemble, predict_member
+from models.stacking import MEMBER_NAMES, RANKING_MEMBERS, SharedArray, fit_member, inner_split, make_member
+from models.tuning import SINGLE_THREAD_PARAMS
+
+from .train import load_dataset, load_params
+
+_WORKER: Dict[str, Any] = {}
+
+
+def _set_worker(
+    X: Any,
+    y: np.ndarray,
+    groups: np.ndarray,
+    dates: np.ndarray,
+    contexts: List[Dict[str, object]],
+    keys: Optional[np.ndarray],
+    implied: Optional[np.ndarray],
+    config: Dict[str, Any],
+) -> None:
+    _WORKER.update(X=X, y=y, groups=groups, dates=dates, contexts=contexts, keys=keys, implied=implied, config=config)
+    if config["single_thread"]:
+        torch = optional_import("torch") if "set_mlp" in config["members"] else None
+        if torch is not None:
+            torch.set_num_threads(1)
+
+
+def _init_worker(x_spec: Tuple[Any, ...], *state: Any) -> None:
+    # Out-of-core features are reopened as a read-only memory map; in-memory ones live in one shared block.
+    X = np.load(x_spec[1], mmap_mode="r") if x_spec[0] == "memmap" else SharedArray.attach(x_spec)
+    _set_worker(X, *state)
+
+
+def _features() -> np.ndarray:
+    X = _WORKER["X"]
+    return X.array if isinstance(X, SharedArray) else X
+
+
+def _run_fold(task: Tuple[int, np.ndarray, np.ndarray]) -> Tuple[int, Dict[str, Any], StreamingMetrics]:
+    """Train members, gate and calibrator on the rows before the fold, score the fold's races.
+
+    The latest race days of the training rows play the part of cli.train's validation window: early stopping
+    and the calibrator see only them, the gate sees every training row. The fold's metrics travel back as
+    accumulators, so the parent merges them without ever holding the tested probabilities.
+    """
+    fold, train_idx, test_idx = task
+    X, y, groups, config = _features(), _WORKER["y"], _WORKER["groups"], _WORKER["config"]
+    contexts, keys, implied = _WORKER["contexts"], _WORKER["keys"], _WORKER["implied"]
+    started = time.perf_counter()
+    fit_idx, stop_idx = inner_split(train_idx, _WORKER["dates"])
+    has_stop = len(stop_idx) > 0
+    X_fit, X_stop = X[fit_idx], X[stop_idx]
+    models = {}
+    for name in config["members"]:
+        params = dict(config["params"].get(name) or {})
+        if config["single_thread"]:
+            params.update(SINGLE_THREAD_PARAMS[name])
+        model = make_member(name, X.shape[1], params or None, config["patience"], config["mlp_patience"], config["time_budgets"].get(name))
+        models[name] = fit_member(
+            model,
+            X_fit,
+            y[fit_idx],
+            X_stop if has_stop else None,
+            y[stop_idx] if has_stop else None,
+            groups[fit_idx],
+            groups[stop_idx] if has_stop else None,
+        )
+    fit_seconds = time.perf_counter() - started
+
+    rows = np.concatenate([train_idx, test_idx])
+    X_rows = X[rows]
+    base = np.column_stack([predict_member(model, X_rows, groups[rows]) for model in models.values()])
+    row_contexts = [contexts[i] for i in rows]
+    n_train = len(train_idx)
+    ensemble = ContextGatedEnsemble()
+    ensemble.fit(base[:n_train], row_contexts[:n_train], np.vstack([1 - y[train_idx], y[train_idx]]).T)
+    combined = ensemble.combine(list(base.T), row_contexts)
+
+    row_keys = keys[rows] if keys is not None else None
+    if has_stop:
+        # Positions of the early-stopping rows inside `rows`, whose first block is train_idx in order.
+        stop_pos = np.searchsorted(train_idx, stop_idx)
+        calibrator = choose_best_calibrator(
+            combined[stop_pos],
+            y[stop_idx],
+            keys=row_keys[stop_pos] if row_keys is not None else None,
+            by=config["calibration_by"],
+            min_count=config["calibration_min_rows"],
+        )
+    else:
+        calibrator = CalibrationResult("temperature", 1.0)
+    probs = np.clip(calibrator.apply(combined[n_train:], row_keys[n_train:] if row_keys is not None else None), 0.0, 1.0)
+    metrics = StreamingMetrics().update(y[test_idx], probs, groups[test_idx], implied[test_idx] if implied is not None else None)
+
+    result = {
+        "fold": fold,
+        "train_rows": int(n_train),
+        "rows": int(len(test_idx)),
+        "races": int(len(pd.unique(groups[test_idx]))),
+        "win_rate": float(y[test_idx].mean()),
+        **metrics.result(),
+        "calibration": calibrator.method,
+        "fit_seconds": fit_seconds,
+        "seconds": time.perf_counter() - started,
+    }
+    return fold, result, metrics
+
+
+def run_backtest(
+    X: np.ndarray,
+    y: np.ndarray,
+    groups: np.ndarray,
+    dates: Sequence[object],
+    contexts: List[Dict[str, object]],
+    splits: List[Split],
+    keys: Optional[np.ndarray] = None,
+    implied: Optional[np.ndarray] = None,
+    members: Sequence[str] = MEMBER_NAMES,
+    params: Optional[Dict[str, Dict[str, Any]]] = None,
+    patience: int = DEFAULT_PATIENCE,
+    mlp_patience: int = DEFAULT_MLP_PATIENCE,
+    time_budgets: Optional[Dict[str, float]] = None,
+    calibration_by: Optional[str] = None,
+    calibration_min_rows: int = 200,
+    workers: int = 1,
+    memmap_path: Optional[Path] = None,
+) -> Tuple[List[Dict[str, Any]], StreamingMetrics, float]:
+    """Every fold is an independent pool task; features are shared, never recomputed per fold.
+
+    Returns per-fold results in fold order, the merged metric accumulators of all tested rows (each row is
+    out-of-sample for exactly one fold) and the summed per-fold seconds.
+    """
+    config = {
+        "members": list(members),
+        "params": params or {},
+        "patience": patience,
+        "mlp_patience": mlp_patience,
+        "time_budgets": time_budgets or {},
+        "calibration_by": calibration_by,
+        "calibration_min_rows": calibration_min_rows,
+        "single_thread": workers > 1,
+    }
+    train_dates = np.asarray(pd.to_datetime(pd.Series(list(dates))).values)
+    state = (np.asarray(y), np.asarray(groups), train_dates, contexts, keys, implied, config)
+    tasks = [(k, split.train_idx, split.val_idx) for k, split in enumerate(splits)]
+    # Longest jobs first: the late folds train on the most history.
+    tasks.sort(key=lambda task: -len(task[1]))
+
+    total = StreamingMetrics()
+    results: Dict[int, Dict[str, Any]] = {}
+    cpu_s = 0.0
+
+    def collect(fold: int, result: Dict[str, Any], metrics: StreamingMetrics) -> None:
+        nonlocal cpu_s
+        total.merge(metrics)
+        results[fold] = {"cutoff": splits[fold].cutoff, "end": splits[fold].end, **result}
+        cpu_s += result["seconds"]
+        print(json.dumps({key: results[fold][key] for key in ("fold", "cutoff", "races", "logloss", "auc", "seconds")}), flush=True)
+
+    if workers > 1:
+        shared_X = None
+        if memmap_path is not None:
+            x_spec: Tuple[Any, ...] = ("memmap", str(memmap_path))
+        else:
+            shared_X = SharedArray.create(X.shape, "float64")
+            shared_X.array[:] = X
+            x_spec = shared_X.spec
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(x_spec, *state)) as executor:
+                futures = [executor.submit(_run_fold, task) for task in tasks]
+                for future in as_completed(futures):
+                    collect(*future.result())
+        finally:
+            if shared_X is not None:
+                shared_X.close()
+    else:
+        _set_worker(X, *state)
+        try:
+            for task in tasks:
+                collect(*_run_fold(task))
+        finally:
+            _WORKER.clear()
+    return [results[k] for k in sorted(results)], total, cpu_s
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Genişleyen pencereli walk-forward backtest")
+    parser.add_argument("--program", type=Path, required=True)
+    parser.add_argument("--workouts", type=Path, default=None)
+    parser.add_argument("--period", choices=sorted(PERIODS), default="month", help="Fold başına test dönemi")
+    parser.add_argument("--start", type=str, default=None, help="İlk test dönemi bu tarihi içerir (YYYY-MM-DD)")
+    parser.add_argument("--end", type=str, default=None, help="Bu tarihten sonra başlayan dönemler test edilmez")
+    parser.add_argument("--min-train-days", type=int, default=30, help="İlk fold'dan önce gereken asgari yarış günü")
+    parser.add_argument("--members", nargs="+", choices=list(MEMBER_NAMES) + sorted(RANKING_MEMBERS.values()), default=list(MEMBER_NAMES))
+    parser.add_argument("--params", type=Path, default=None, help="cli.tune çıktısı best_params.json")
+    parser.add_argument("--patience", type=int, default=DEFAULT_PATIENCE)
+    parser.add_argument("--mlp-patience", type=int, default=DEFAULT_MLP_PATIENCE)
+    parser.add_argument("--time-budget", action="append", default=[], metavar="MODEL=SECONDS")
+    parser.add_argument("--calibration-by", choices=["none", "gate_context_key", "hipodrom"], default="none")
+    parser.add_argument("--calibration-min-rows", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Paralel fold sayısı")
+    parser.add_argument("--out-of-core", type=Path, default=None, metavar="DIR", help="Özellik matrisini diske yazıp fold'lara memmap olarak paylaştır")
+    parser.add_argument("--chunk-races", type=int, default=2000)
+    parser.add_argument("--out", type=Path, default=Path("artifacts/backtest.json"))
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    dataset = load_dataset(args.program, args.workouts, design_dir=args.out_of_core, chunk_races=args.chunk_races)
+    features_seconds = time.perf_counter() - started
+    frame = dataset["frame"]
+    splits = expanding_window_splits(dataset["dates"], period=args.period, start=args.start, end=args.end, min_train_days=args.min_train_days)
+    if not splits:
+        raise SystemExit("Backtest fold'u üretilemedi: tarih aralığını veya --min-train-days değerini kontrol edin")
+
+    y = dataset["targets"]["win"]
+    calibration_by = args.calibration_by if args.calibration_by != "none" else None
+    folds, total, cpu_s = run_backtest(
+        dataset["X"],
+        np.asarray(y),
+        dataset["race_ids"],
+        dataset["dates"],
+        frame["race_context"].tolist(),
+        splits,
+        keys=frame[calibration_by].astype(str).values if calibration_by else None,
+        implied=frame["implied_prob"].values,
+        members=args.members,
+        params=load_params(args.params),
+        patience=args.patience,
+        mlp_patience=args.mlp_patience,
+        time_budgets=parse_time_budgets(args.time_budget),
+        calibration_by=calibration_by,
+        calibration_min_rows=args.calibration_min_rows,
+        workers=min(args.workers, len(splits)),
+        memmap_path=dataset["design"].directory / "X.npy" if "design" in dataset else None,
+    )
+    fold_logloss = np.array([fold["logloss"] for fold in folds])
+    aggregate = {
+        "rows": total.rows,
+        "races": int(sum(fold["races"] for fold in folds)),
+        **total.result(),
+        "logloss_fold_mean": float(fold_logloss.mean()),
+        "logloss_fold_std": float(fold_logloss.std()),
+    }
+    wall_s = time.perf_counter() - started
+    payload = {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "period": args.period,
+        "members": args.members,
+        "workers": min(args.workers, len(splits)),
+        "folds": folds,
+        "aggregate": aggregate,
+        "timing": {"features_s": features_seconds, "folds_cpu_s": cpu_s, "wall_s": wall_s},
+    }
+    args.out.parent.mkdir(parents=True, exist_ok=True)
+    args.out.write_text(json.dumps(payload, indent=2, ensure_ascii=False))
+    print(json.dumps({"status": "ok", "out": str(args.out), "folds": len(folds), "aggregate": aggregate, "wall_s": round(wall_s, 1)}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+from __future__ import annotations
+
+import argparse
+import copy
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from dataio.merge import merge_program_and_workouts
+from dataio.read_program import read_program_csv
+from dataio.read_workouts import read_workouts_csv
+
+from eval.backtest import time_based_split
+from eval.metrics import auc_score, brier_score, log_loss_score
+from models.ensemble import predict_member
+from models.sampling import downsample_negatives
+from models.tree_engine import NotCompilable, compile_wrapper, is_compilable
+
+from .predict import build_features, ensure_features, load_artifact
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+
+_STARTUP_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import cli.predict
+t1 = time.perf_counter()
+backends = ("xgboost", "lightgbm", "catboost", "torch", "sklearn")
+result = {{"import_s": t1 - t0, "backends_after_import": [b for b in backends if b in sys.modules]}}
+artifact_path = {artifact!r}
+if artifact_path:
+    from pathlib import Path
+    from src.cli import predict as p
+    from src.cli.bench import load_card
+    artifact = p.load_artifact(Path(artifact_path), engine={engine!r})
+    t2 = time.perf_counter()
+    X, groups, contexts = load_card(Path({program!r}), None, artifact["feature_columns"])
+    t3 = time.perf_counter()
+    p.compute_predictions(artifact, X, contexts, groups)
+    t4 = time.perf_counter()
+    result.update({{
+        "artifact_load_s": t2 - t1,
+        "read_features_s": t3 - t2,
+        "first_prediction_s": t4 - t3,
+        "time_to_first_prediction_s": t4 - t0,
+        "backends_after_prediction": [b for b in backends if b in sys.modules],
+    }})
+print(json.dumps(result))
+"""
+
+
+def time_call(fn: Callable[[], Any], repeats: int = 20, warmup: int = 2) -> Dict[str, float]:
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000.0)
+    arr = np.array(timings)
+    return {
+        "median_ms": float(np.median(arr)),
+        "p95_ms": float(np.percentile(arr, 95)),
+        "mean_ms": float(arr.mean()),
+    }
+
+
+def load_card(program: Path, workouts: Path | None, feature_columns) -> Tuple[np.ndarray, np.ndarray, List[Dict[str, object]]]:
+    """Feature matrix, race ids and the real race contexts, so probes exercise the gate's context columns."""
+    data = read_program_csv(program)
+    workout_frame = read_workouts_csv(workouts) if workouts else None
+    merged = merge_program_and_workouts(data, workout_frame)
+    enriched = build_features(merged.frame)
+    return ensure_features(enriched, feature_columns), enriched["race_uid"].values, enriched["race_context"].tolist()
+
+
+def bench_startup(program: Path | None, artifact: Path | None, runs: int, engine: str = "native") -> Dict[str, Any]:
+    """Run the import/load/predict sequence in fresh interpreters so module caches do not hide import cost."""
+    code = _STARTUP_PROBE.format(artifact=str(artifact) if artifact and program else "", program=str(program) if program else "", engine=engine)
+    samples = []
+    for _ in range(runs):
+        completed = subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT, capture_output=True, text=True, check=True)
+        samples.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    summary: Dict[str, Any] = {"runs": runs}
+    for key, value in samples[0].items():
+        if isinstance(value, float):
+            summary[key] = float(np.median([sample[key] for sample in samples]))
+        else:
+            summary[key] = value
+    return summary
+
+
+def bench_set_mlp(artifact: Dict[str, Any], X: np.ndarray, groups: np.ndarray, repeats: int) -> Dict[str, Any]:
+    wrapper = artifact["models"]["set_mlp"]
+    if not wrapper.supports_export:
+        raise SystemExit("Artifact içindeki set_mlp PyTorch modeli değil")
+    variants: Dict[str, Any] = {}
+    eager = copy.copy(wrapper)
+    eager.runtime = "eager"
+    eager.export_meta = None
+    variants["eager"] = eager
+    for name, quantize in (("torchscript_fp32", False), ("torchscript_int8", True)):
+        variant = copy.copy(wrapper)
+        variant.export_torchscript(quantize=quantize)
+        variants[name] = variant
+
+    reference = eager.predict_proba(X, groups=groups)[:, 1]
+    results: Dict[str, Any] = {"rows": int(len(X)), "races": int(len(set(groups)))}
+    for name, variant in variants.items():
+        probs = variant.predict_proba(X, groups=groups)[:, 1]
+        delta = np.abs(probs - reference)
+        entry = time_call(lambda v=variant: v.predict_proba(X, groups=groups), repeats=repeats)
+        entry.update({"max_abs_delta": float(delta.max()), "mean_abs_delta": float(delta.mean())})
+        if variant.export_meta:
+            entry["bytes"] = variant.export_meta["bytes"]
+        results[name] = entry
+    return results
+
+
+def bench_trees(artifact: Dict[str, Any], X: np.ndarray, rows: int | None, repeats: int) -> Dict[str, Any]:
+    """Native predict_proba vs the compiled NumPy engine for every tree member, in rows per second."""
+    if rows and rows > len(X):
+        X = np.tile(X, (int(np.ceil(rows / len(X))), 1))[:rows]
+    results: Dict[str, Any] = {"rows": int(len(X))}
+    for name, wrapper in artifact["models"].items():
+        if not is_compilable(wrapper):
+            continue
+        start = time.perf_counter()
+        try:
+            compiled = compile_wrapper(wrapper)
+        except NotCompilable as error:
+            results[name] = {"backend": wrapper.backend, "skipped": str(error)}
+            continue
+        compile_s = time.perf_counter() - start
+        native = wrapper.predict_proba(X)[:, 1]
+        delta = np.abs(compiled.predict_proba(X)[:, 1] - native)
+        entry: Dict[str, Any] = {"backend": wrapper.backend, "trees": compiled.n_trees, "compile_s": compile_s, "max_abs_delta": float(delta.max())}
+        for label, fn in (("native", lambda w=wrapper: w.predict_proba(X)), ("compiled", lambda c=compiled: c.predict_proba(X))):
+            timing = time_call(fn, repeats=repeats, warmup=1)
+            timing["rows_per_s"] = len(X) / (timing["median_ms"] / 1000.0)
+            entry[label] = timing
+        results[name] = entry
+    return results
+
+
+def bench_sampling(
+    program: Path, workouts: Path | None, val_date: str, rates: Sequence[float], members: Sequence[str]
+) -> Dict[str, Any]:
+    """Fit the members on negative-downsampled training rows at each rate; fit time and validation metric deltas vs. rate 1."""
+    from .train import load_dataset, train_models
+
+    dataset = load_dataset(program, workouts)
+    X, y, groups = dataset["X"], dataset["targets"]["win"], dataset["race_ids"]
+    split = time_based_split(dataset["dates"], val_date)
+    if not len(split.train_idx) or not len(split.val_idx):
+        raise SystemExit("--val-date hem eğitim hem validation satırı bırakmalı")
+    market = dataset["frame"]["p_market"].values
+    y_val = y[split.val_idx]
+    results: Dict[str, Any] = {"train_rows": int(len(split.train_idx)), "val_rows": int(len(split.val_idx)), "rates": {}}
+    # Warm-up fit so library imports and one-time setup are not charged to the first rate.
+    warm = split.train_idx[:200]
+    train_models(X[warm], y[warm], input_dim=X.shape[1], groups_train=groups[warm], members=members)
+    for rate in sorted(set(rates) | {1.0}, reverse=True):
+        sample = downsample_negatives(y[split.train_idx], groups[split.train_idx], market[split.train_idx], rate)
+        fit_idx = split.train_idx[sample.index]
+        entry: Dict[str, Any] = {"kept_rows": sample.report["kept_rows"], "members": {}}
+        for name in members:
+            started = time.perf_counter()
+            model = train_models(
+                X[fit_idx],
+                y[fit_idx],
+                X[split.val_idx],
+                y_val,
+                input_dim=X.shape[1],
+                groups_train=groups[fit_idx],
+                groups_val=groups[split.val_idx],
+                members=[name],
+                sample_weight=sample.weights,
+            )[name]
+            fit_s = time.perf_counter() - started
+            probs = predict_member(model, X[split.val_idx], groups[split.val_idx])
+            entry["members"][name] = {
+                "fit_s": fit_s,
+                "auc": auc_score(y_val, probs),
+                "logloss": log_loss_score(y_val, probs),
+                "brier": brier_score(y_val, probs),
+                "mean_prob": float(np.mean(probs)),
+            }
+        entry["fit_s"] = sum(member["fit_s"] for member in entry["members"].values())
+        results["rates"][str(rate)] = entry
+    baseline = results["rates"]["1.0"]
+    for entry in results["rates"].values():
+        entry["fit_time_ratio"] = entry["fit_s"] / baseline["fit_s"] if baseline["fit_s"] else float("nan")
+        for name, member in entry["members"].items():
+            for metric in ("auc", "logloss", "brier"):
+                member[f"{metric}_delta"] = member[metric] - baseline["members"][name][metric]
+    results["val_win_rate"] = float(np.mean(y_val))
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    mlp = sub.add_parser("set-mlp", help="Eager vs TorchScript (fp32/int8) Set-MLP latency ve olasılık farkı")
+    mlp.add_argument("--program", type=Path, required=True)
+    mlp.add_argument("--workouts", type=Path, default=None)
+    mlp.add_argument("--artifact", type=Path, default=Path("artifacts/model.pkl"))
+    mlp.add_argument("--repeats", type=int, default=20)
+    mlp.add_argument("--out", type=Path, default=None)
+    trees = sub.add_parser("trees", help="Native vs derlenmiş NumPy ağaç motoru: satır/sn ve olasılık farkı")
+    trees.add_argument("--program", type=Path, required=True)
+    trees.add_argument("--workouts", type=Path, default=None)
+    trees.add_argument("--artifact", type=Path, default=Path("artifacts/model.pkl"))
+    trees.add_argument("--rows", type=int, default=None, help="Kart bu satır sayısına kadar çoğaltılır (varsayılan: kart olduğu gibi)")
+    trees.add_argument("--repeats", type=int, default=5)
+    trees.add_argument("--out", type=Path, default=None)
+    sampling = sub.add_parser("sampling", help="Negatif örnekleme oranlarına göre eğitim süresi ve validation metrik farkları")
+    sampling.add_argument("--program", type=Path, required=True)
+    sampling.add_argument("--workouts", type=Path, default=None)
+    sampling.add_argument("--val-date", type=str, required=True)
+    sampling.add_argument("--rates", type=float, nargs="+", default=[0.5, 0.25])
+    sampling.add_argument("--members", nargs="+", choices=["xgb", "lgbm", "catboost", "set_mlp"], default=["xgb", "lgbm", "catboost"])
+    sampling.add_argument("--out", type=Path, default=None)
+    startup = sub.add_parser("startup", help="Import süresi ve ilk tahmine kadar geçen süre (yeni süreçte)")
+    startup.add_argument("--program", type=Path, default=None)
+    startup.add_argument("--artifact", type=Path, default=Path("artifacts/model.pkl"))
+    startup.add_argument("--runs", type=int, default=5)
+    startup.add_argument("--engine", choices=["native", "compiled"], default="native")
+    startup.add_argument("--out", type=Path, default=None)
+    args = parser.parse_args()
+
+    if args.command == "startup":
+        result = bench_startup(args.program, args.artifact.resolve() if args.program else None, args.runs, args.engine)
+    elif args.command == "set-mlp":
+        artifact = load_artifact(args.artifact)
+        X, groups, _ = load_card(args.program, args.workouts, artifact["feature_columns"])
+        result = bench_set_mlp(artifact, X, groups, args.repeats)
+    elif args.command == "trees":
+        artifact = load_artifact(args.artifact)
+        X, _, _ = load_card(args.program, args.workouts, artifact["feature_columns"])
+        result = bench_trees(artifact, X, args.rows, args.repeats)
+    elif args.command == "sampling":
+        result = bench_sampling(args.program, args.workouts, args.val_date, args.rates, args.members)
+
+    text = json.dumps(result, indent=2)
+    if args.out:
+        args.out.write_text(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,7 @@ import argparse
 import json
 import pickle
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Sequence, Tuple
 
 import numpy as np
 import pandas as pd
@@ -15,7 +15,14 @@ from dataio.read_workouts import read_workouts_csv
 from features.gate_context import compute_gate_and_context
 from features.market_features import compute_market_features
 from features.set_features import compute_set_features
-from models.calibrate import CalibrationResult
+from models.budget import Deadline
+from models.bundle import is_bundle, load_bundle
+from models.calibrate import CalibrationResult, ContextCalibrator
+from models.harville import finish_distribution
+from models.shards import ShardSet
+from models.ensemble import AnytimeEnsemble, predict_member
+from models.tree_engine import compile_or_native
+from models.uncertainty import UNCERTAINTY_SOURCES, UncertaintyEstimate, estimate_uncertainty, through_race_combiner
 
 
 artifact_calibration_method = "temperature"
@@ -31,9 +38,44 @@ def build_features(frame: pd.DataFrame) -> pd.DataFrame:
     return frame
 
 
-def load_artifact(path: Path) -> Dict[str, Any]:
+def load_artifact(path: Path, mlp_runtime: str = "artifact", engine: str = "native", with_compiled: bool = False) -> Dict[str, Any]:
+    """Pickle or bundle; with_compiled also reads a bundle's compiled trees next to its native tree members."""
+    if is_bundle(path):
+        return load_bundle(path, mlp_runtime=mlp_runtime, engine=engine, with_compiled=with_compiled)
     with open(path, "rb") as f:
-        return pickle.load(f)
+        artifact = pickle.load(f)
+    if artifact.get("shards") is not None:
+        artifact["shards"].root = shard_directory(path)
+    if engine == "compiled":
+        # Pickle artifacts still need the boosting libraries once, to read the trees; unsupported ones stay native.
+        artifact["models"] = {name: compile_or_native(model) for name, model in artifact["models"].items()}
+    return artifact
+
+
+def fast_artifact_path(path: Path) -> Path:
+    """`artifacts/model.pkl` -> `artifacts/model.fast.pkl`; bundles keep the distilled model inside the bundle."""
+    return path.with_name(f"{path.stem}.fast{path.suffix}")
+
+
+def shard_directory(path: Path) -> Path:
+    """`artifacts/model.pkl` -> `artifacts/model.shards/`; bundles keep their shards under `<bundle>/shards`."""
+    return path.with_name(f"{path.stem}.shards")
+
+
+def load_fast_artifact(path: Path) -> Dict[str, Any]:
+    """Only the distilled student, race combiner and target models; no base member, gate or calibrator is read."""
+    if is_bundle(path):
+        artifact = load_bundle(path, fast=True)
+    else:
+        # The full pickle holds the same student; unpickling it would read every member just to drop them.
+        candidate = fast_artifact_path(path)
+        if not candidate.exists():
+            raise SystemExit(f"{candidate} bulunamadı; cli.train --distill ile eğitin")
+        with open(candidate, "rb") as f:
+            artifact = pickle.load(f)
+    if artifact.get("distilled") is None:
+        raise SystemExit("Artifact içinde distile model yok; cli.train --distill ile eğitin")
+    return artifact
 
 
 def ensure_features(frame: pd.DataFrame, columns: List[str]) -> np.ndarray:
@@ -43,26 +85,130 @@ def ensure_features(frame: pd.DataFrame, columns: List[str]) -> np.ndarray:
     return frame[columns].fillna(0.0).values
 
 
-def compute_predictions(artifact: Dict[str, Any], features: np.ndarray, contexts: List[Dict[str, object]]) -> np.ndarray:
-    base_preds = []
-    for model in artifact["models"].values():
-        base = model.predict_proba(features)
-        base_preds.append(base[:, 1])
+def compute_predictions(
+    artifact: Dict[str, Any],
+    features: np.ndarray,
+    contexts: List[Dict[str, object]],
+    groups: np.ndarray | None = None,
+    calibration_keys: np.ndarray | None = None,
+) -> np.ndarray:
+    base_preds = [predict_member(model, features, groups) for model in artifact["models"].values()]
     combined = artifact["ensemble"].combine(base_preds, contexts)
-    calibrator: CalibrationResult = artifact["calibrator"]
-    calibrated = calibrator.apply(combined)
+    calibrator: CalibrationResult | ContextCalibrator = artifact["calibrator"]
+    calibrated = calibrator.apply(combined, calibration_keys)
     return np.clip(calibrated, 0.0, 1.0)
 
 
-def race_summary(frame: pd.DataFrame, win_probs: np.ndarray) -> List[Dict[str, Any]]:
+def compute_predictions_with_uncertainty(
+    artifact: Dict[str, Any],
+    features: np.ndarray,
+    contexts: List[Dict[str, object]],
+    groups: np.ndarray | None = None,
+    calibration_keys: np.ndarray | None = None,
+    sources: Sequence[str] = ("members",),
+) -> Tuple[np.ndarray, UncertaintyEstimate]:
+    """compute_predictions plus per-runner uncertainty reusing the same base-model outputs."""
+    base_preds = [predict_member(model, features, groups) for model in artifact["models"].values()]
+    combined = artifact["ensemble"].combine(base_preds, contexts)
+    calibrated = np.clip(artifact["calibrator"].apply(combined, calibration_keys), 0.0, 1.0)
+    estimate = estimate_uncertainty(
+        artifact["models"],
+        artifact["ensemble"],
+        base_preds,
+        combined,
+        features,
+        groups,
+        sources,
+        calibrator=artifact["calibrator"],
+        calibration_keys=calibration_keys,
+    )
+    return calibrated, estimate
+
+
+def compute_anytime_predictions(
+    artifact: Dict[str, Any],
+    features: np.ndarray,
+    contexts: List[Dict[str, object]],
+    groups: np.ndarray | None = None,
+    calibration_keys: np.ndarray | None = None,
+    deadline_ms: float | None = None,
+    deadline: Deadline | None = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Cheapest-first members under a deadline; returns calibrated probabilities and, per row, the member count used."""
+    anytime: AnytimeEnsemble | None = artifact.get("anytime")
+    if anytime is None:
+        raise SystemExit("Artifact içinde anytime gate'leri yok; cli.train --anytime ile yeniden eğitin")
+    combined, levels = anytime.predict(artifact["models"], features, contexts, groups, deadline_ms=deadline_ms, deadline=deadline)
+    calibrated = artifact["calibrator"].apply(combined, calibration_keys)
+    return np.clip(calibrated, 0.0, 1.0), levels
+
+
+def apply_shards(
+    shards: ShardSet,
+    keys: np.ndarray,
+    features: np.ndarray,
+    contexts: List[Dict[str, object]],
+    groups: np.ndarray,
+    raw_scores: np.ndarray,
+    uncertainty: UncertaintyEstimate,
+    sources: Sequence[str] = ("members",),
+) -> Dict[object, str]:
+    """Rescore the rows of every context that has a shard, in place; returns the model source of each race.
+
+    Each shard on the card is loaded once and released before the next, so at most one is held in memory.
+    """
+    model_sources = {race_uid: "global" for race_uid in pd.unique(groups)}
+    for value in pd.unique(keys):
+        if value not in shards.entries:
+            continue
+        shard = shards.load(value)
+        rows = np.flatnonzero(keys == value)
+        scores, estimate = compute_predictions_with_uncertainty(
+            shard, features[rows], [contexts[i] for i in rows], groups[rows], None, sources
+        )
+        raw_scores[rows] = scores
+        for name, values in estimate.components.items():
+            if name in uncertainty.components:
+                uncertainty.components[name][rows] = values
+        for name, seconds in estimate.seconds.items():
+            uncertainty.seconds[name] = uncertainty.seconds.get(name, 0.0) + seconds
+        for race_uid in pd.unique(groups[rows]):
+            model_sources[race_uid] = f"shard:{shards.by}={value}"
+    return model_sources
+
+
+def race_summary(
+    frame: pd.DataFrame,
+    win_probs: np.ndarray,
+    place_top: int = 3,
+    finish_dist: bool = False,
+    raw_scores: np.ndarray | None = None,
+    target_preds: Dict[str, np.ndarray] | None = None,
+    contributors: Dict[object, List[str]] | None = None,
+    uncertainty: UncertaintyEstimate | None = None,
+    model_sources: Dict[object, str] | None = None,
+) -> List[Dict[str, Any]]:
+    target_preds = target_preds or {}
     frame = frame.copy()
     frame["win_prob"] = win_probs
-    field_sizes = frame.groupby("race_uid")["race_uid"].transform("count")
-    frame["place_prob"] = np.clip(np.sqrt(frame["win_prob"]), 0, 1)
-    frame["expected_finish"] = 1 + (1 - frame["win_prob"]) * (field_sizes / 2)
-    frame["race_time_pred"] = frame["en_iyi_derece_s"].fillna(frame.groupby("race_uid")["en_iyi_derece_s"].transform("median")).fillna(95.0)
+    frame["raw_score"] = win_probs if raw_scores is None else raw_scores
+    finish = finish_distribution(win_probs, frame["race_uid"].values, positions=finish_dist)
+    frame["place_prob"] = finish.top2 if place_top == 2 else finish.top3
+    frame["expected_finish"] = finish.expected_finish
+    if finish_dist:
+        frame["finish_dist"] = list(finish.positions)
+    if "race_time" in target_preds:
+        frame["race_time_pred"] = target_preds["race_time"]
+    else:
+        frame["race_time_pred"] = frame["en_iyi_derece_s"].fillna(frame.groupby("race_uid")["en_iyi_derece_s"].transform("median")).fillna(95.0)
+    for name, values in target_preds.items():
+        frame[f"target_{name}"] = values
     frame["edge"] = frame["win_prob"] - frame["implied_prob"].fillna(0.0)
-    frame["win_std"] = np.sqrt(frame["win_prob"] * (1 - frame["win_prob"]))
+    if uncertainty is not None:
+        for name, values in uncertainty.components.items():
+            frame[name] = values
+    else:
+        frame["win_std"] = np.sqrt(frame["win_prob"] * (1 - frame["win_prob"]))
     frame["place_std"] = np.sqrt(frame["place_prob"] * (1 - frame["place_prob"]))
 
     races: List[Dict[str, Any]] = []
@@ -85,6 +231,13 @@ def race_summary(frame: pd.DataFrame, win_probs: np.ndarray) -> List[Dict[str, A
             },
             "predictions": [],
         }
+        if contributors is not None:
+            race_entry["meta"]["models"] = contributors[race_uid]
+        if model_sources is not None:
+            race_entry["meta"]["model"] = model_sources[race_uid]
+        if uncertainty is not None:
+            race_entry["meta"]["uncertainty"] = {f"{name}_mean": float(group[name].mean()) for name in uncertainty.components}
+            race_entry["meta"]["uncertainty"]["cost_ms"] = {name: 1000 * seconds for name, seconds in uncertainty.seconds.items()}
         for _, row in group.iterrows():
             race_entry["predictions"].append(
                 {
@@ -92,12 +245,14 @@ def race_summary(frame: pd.DataFrame, win_probs: np.ndarray) -> List[Dict[str, A
                     "at_ismi": row["at_ismi"],
                     "start_no": int(row["start_no"]) if not pd.isna(row["start_no"]) else None,
                     "win_prob": float(row["win_prob"]),
+                    "raw_score": float(row["raw_score"]),
                     "place_prob": float(row["place_prob"]),
                     "expected_finish": float(row["expected_finish"]),
                     "race_time": float(row["race_time_pred"]),
                     "uncertainty": {
                         "win_std": float(row["win_std"]),
                         "place_std": float(row["place_std"]),
+                        **{name: float(row[name]) for name in (uncertainty.components if uncertainty is not None else ()) if name != "win_std"},
                     },
                     "ganyan": float(row["ganyan"]) if not pd.isna(row["ganyan"]) else None,
                     "implied_prob": float(row["implied_prob"]) if not pd.isna(row["implied_prob"]) else None,
@@ -111,6 +266,10 @@ def race_summary(frame: pd.DataFrame, win_probs: np.ndarray) -> List[Dict[str, A
                     },
                 }
             )
+            if target_preds:
+                race_entry["predictions"][-1]["targets"] = {name: float(row[f"target_{name}"]) for name in target_preds}
+            if finish_dist:
+                race_entry["predictions"][-1]["finish_dist"] = [float(prob) for prob in row["finish_dist"][: len(group)]]
         races.append(race_entry)
     return races
 
@@ -129,13 +288,45 @@ def main() -> None:
     parser.add_argument("--artifact", type=Path, default=Path("artifacts/model.pkl"))
     parser.add_argument("--out", type=Path, required=True)
     parser.add_argument("--report", type=Path, default=None)
+    parser.add_argument("--mlp-runtime", choices=["artifact", "eager", "torchscript"], default="artifact")
+    parser.add_argument("--engine", choices=["native", "compiled"], default="native", help="Ağaç modelleri için NumPy derlenmiş motor")
+    parser.add_argument("--place-top", type=int, choices=[2, 3], default=3, help="place_prob: ilk 2 veya ilk 3 olasılığı")
+    parser.add_argument("--finish-dist", action="store_true", help="Her at için tam bitiş sırası dağılımını JSON'a ekle")
+    parser.add_argument("--fast", action="store_true", help="cli.train --distill ile üretilen tek modelli hızlı artifact'i kullan")
+    parser.add_argument(
+        "--uncertainty",
+        nargs="*",
+        choices=UNCERTAINTY_SOURCES,
+        default=None,
+        help="win_std kaynakları (varsayılan: members; boş: hepsi)",
+    )
+    parser.add_argument("--deadline-ms", type=float, default=None, help="Base modelleri ucuzdan pahalıya bu süre dolana kadar değerlendir")
+    parser.add_argument("--no-shards", action="store_true", help="Shard'ları yok say, her koşuyu global modelle skorla")
     args = parser.parse_args()
+    # The latency budget covers the whole call: artifact and card loading and feature building count against it.
+    deadline = Deadline(args.deadline_ms / 1000.0) if args.deadline_ms is not None else None
 
-    artifact = load_artifact(args.artifact)
     global artifact_calibration_method, artifact_calibration_param
-    calibrator = artifact["calibrator"]
-    artifact_calibration_method = calibrator.method
-    artifact_calibration_param = calibrator.param if isinstance(calibrator.param, (int, float)) else None
+    contributors = None
+    uncertainty = None
+    model_sources = None
+    if args.fast:
+        artifact = load_fast_artifact(args.artifact)
+        calibration_by = None
+        artifact_calibration_method, artifact_calibration_param = "distilled", None
+    else:
+        # The staged source walks compiled trees; a bundle ships them, so nothing is compiled per call.
+        staged = args.uncertainty is not None and (not args.uncertainty or "staged" in args.uncertainty)
+        artifact = load_artifact(args.artifact, mlp_runtime=args.mlp_runtime, engine=args.engine, with_compiled=staged)
+        mlp_model = artifact["models"].get("set_mlp")
+        if args.mlp_runtime != "artifact" and mlp_model is not None:
+            if args.mlp_runtime == "torchscript" and getattr(mlp_model, "exported", None) is None:
+                raise SystemExit("Artifact içinde TorchScript export yok; cli.train --mlp-export ile eğitin")
+            mlp_model.runtime = args.mlp_runtime
+        calibrator = artifact["calibrator"]
+        calibration_by = getattr(calibrator, "by", None)
+        artifact_calibration_method = f"{calibrator.method}@{calibration_by}" if calibration_by else calibrator.method
+        artifact_calibration_param = calibrator.param if isinstance(calibrator.param, (int, float)) else None
 
     program = read_program_csv(args.program)
     workouts = read_workouts_csv(args.workouts) if args.workouts else None
@@ -143,9 +334,56 @@ def main() -> None:
     enriched = build_features(merged.frame)
 
     X = ensure_features(enriched, artifact["feature_columns"])
-    win_probs = compute_predictions(artifact, X, enriched["race_context"].tolist())
+    calibration_keys = enriched[calibration_by].astype(str).values if calibration_by else None
+    if args.fast:
+        raw_scores = np.clip(artifact["distilled"].predict(X), 0.0, 1.0)
+    elif args.deadline_ms is not None:
+        raw_scores, levels = compute_anytime_predictions(
+            artifact, X, enriched["race_context"].tolist(), enriched["race_uid"].values, calibration_keys, deadline=deadline
+        )
+        order = artifact["anytime"].order
+        race_levels = pd.Series(levels).groupby(enriched["race_uid"].values).min()
+        contributors = {race_uid: order[:level] for race_uid, level in race_levels.items()}
+    else:
+        sources = ("members",) if args.uncertainty is None else (args.uncertainty or UNCERTAINTY_SOURCES)
+        raw_scores, uncertainty = compute_predictions_with_uncertainty(
+            artifact, X, enriched["race_context"].tolist(), enriched["race_uid"].values, calibration_keys, sources
+        )
+        shards = artifact.get("shards")
+        if shards is not None and shards.entries and not args.no_shards:
+            model_sources = apply_shards(
+                shards,
+                enriched[shards.by].astype(str).values,
+                X,
+                enriched["race_context"].tolist(),
+                enriched["race_uid"].values,
+                raw_scores,
+                uncertainty,
+                sources,
+            )
+    race_combiner = artifact.get("race_combiner")
+    if race_combiner is not None:
+        win_probs = race_combiner.predict(raw_scores, enriched["p_market"].values, enriched["race_uid"].values)
+        if uncertainty is not None:
+            # Reported stds follow win_prob, which is the race-normalized probability here.
+            through_race_combiner(uncertainty, raw_scores, win_probs, float(race_combiner.coef[0]))
+    else:
+        win_probs = raw_scores
+
+    target_models = artifact.get("targets")
+    target_preds = target_models.predict(X) if target_models is not None else None
 
-    races = race_summary(enriched, win_probs)
+    races = race_summary(
+        enriched,
+        win_probs,
+        place_top=args.place_top,
+        finish_dist=args.finish_dist,
+        raw_scores=raw_scores,
+        target_preds=target_preds,
+        contributors=contributors,
+        uncertainty=uncertainty,
+        model_sources=model_sources,
+    )
     json_output = build_json_output(races, artifact.get("metrics", {}), merged.errors)
 
     args.out.write_text(json.dumps(json_output, indent=2, ensure_ascii=False))
@@ -3,37 +3,52 @@ from __future__ import annotations
 import argparse
 import json
 import pickle
+import time
 from pathlib import Path
-from typing import Dict, List
+from typing import Any, Dict, Iterator, List, Sequence
 
 import numpy as np
 import pandas as pd
 
+from dataio.design_matrix import DesignMatrix, DesignMatrixWriter, open_design_matrix, source_signature, take_rows
 from dataio.merge import merge_program_and_workouts
-from dataio.read_program import read_program_csv
+from dataio.read_program import ProgramChunks, ProgramData, read_program_csv
 from dataio.read_workouts import read_workouts_csv
+from eval.accumulators import stream_metrics
 from eval.backtest import Split, time_based_split
 from eval.metrics import (
     auc_score,
     brier_score,
     edge_statistics,
     expected_calibration_error,
+    fidelity_report,
     log_loss_score,
-    ndcg_at_k,
     pr_auc_score,
+    race_log_loss,
+    rmse,
 )
+from eval.race_metrics import race_metrics
 from features.gate_context import compute_gate_and_context
 from features.market_features import compute_market_features
 from features.set_features import compute_set_features
+from models.bundle import save_bundle
+from models.budget import DEFAULT_MLP_PATIENCE, DEFAULT_PATIENCE, parse_time_budgets
 from models.calibrate import CalibrationResult, choose_best_calibrator
-from models.catb import CatBoostWrapper
-from models.ensemble import ContextGatedEnsemble
-from models.lgbm import LGBMWrapper
-from models.set_mlp import SetMLPWrapper
-from models.xgb import XGBWrapper
+from models.distill import distill_ensemble
+from models.ensemble import ContextGatedEnsemble, fit_anytime_ensemble, member_costs, predict_member, predict_member_chunked, prune_members
+from models.multitarget import AUX_TARGETS, TARGET_BACKENDS, TARGET_KINDS, fit_target_models
+from models.online import OnlineCalibrator, OnlineGate, OnlineState
+from models.race_logit import ConditionalLogit, cross_fitted_predict
+from models.sampling import downsample_negatives
+from models.shards import SHARD_KEYS, ShardSet
+from models.stacking import MEMBER_NAMES, RANKING_MEMBERS, continue_member, fit_member, fit_oof_stack, make_member
+
+from .predict import compute_predictions, fast_artifact_path, load_artifact, shard_directory
 
 
 NUMERIC_FILL = 0.0
+# Per-row columns besides the features that training reads; kept in RAM when the features live on disk.
+SIDE_COLUMNS = ["race_uid", "race_date", "race_context", "p_market", "implied_prob", "gate_context_key", "hipodrom", "pist_tipi"]
 
 
 def build_targets(frame: pd.DataFrame) -> Dict[str, np.ndarray]:
@@ -79,27 +94,266 @@ def select_feature_matrix(frame: pd.DataFrame) -> (np.ndarray, List[str]):
     return X, numeric_cols
 
 
-def train_models(X_train: np.ndarray, y_train: np.ndarray, X_val: np.ndarray | None = None, y_val: np.ndarray | None = None, input_dim: int = 10):
-    models = {}
-    xgb_model = XGBWrapper()
-    xgb_model.fit(X_train, y_train, X_val, y_val)
-    models["xgb"] = xgb_model
-
-    lgbm_model = LGBMWrapper()
-    lgbm_model.fit(X_train, y_train, X_val, y_val)
-    models["lgbm"] = lgbm_model
+def _fold_column_kinds(frame: pd.DataFrame, numeric: set, other: set) -> None:
+    """Record which columns hold numbers and which hold anything else; an all-null column in one chunk says nothing."""
+    for column in frame.columns:
+        values = frame[column]
+        if values.isna().all():
+            continue
+        if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            numeric.add(column)
+        else:
+            other.add(column)
+
+
+def _whole_race_batches(paths: List[Path], chunks: ProgramChunks, race_sizes: pd.Series, chunk_races: int) -> Iterator[pd.DataFrame]:
+    """Re-read the spilled chunks in file order and yield at least `chunk_races` complete races at a time.
+
+    Rows of a race that is still missing rows wait for the next chunk, so a race split by a chunk border is whole
+    when it is featurized.
+    """
+    pending = None
+    for i, path in enumerate(paths):
+        parsed = chunks.finish(pd.read_pickle(path))
+        path.unlink()
+        pending = parsed if pending is None else pd.concat([pending, parsed], ignore_index=True)
+        if pending.empty:
+            continue
+        seen = pending.groupby("race_uid", sort=False)["race_uid"].transform("size").to_numpy()
+        complete = seen == race_sizes.reindex(pending["race_uid"]).to_numpy()
+        if i == len(paths) - 1 or pending.loc[complete, "race_uid"].nunique() >= chunk_races:
+            yield pending[complete]
+            pending = pending[~complete]
+
+
+def write_design_matrix(
+    program_path: Path, workouts_path: Path | None, directory: Path, chunk_races: int = 2000, chunk_rows: int = 50_000
+) -> DesignMatrix:
+    """Stream the program CSV and featurize `chunk_races` races at a time straight into float32 memory maps.
+
+    The first pass parses `chunk_rows` CSV rows at a time, spills each parsed chunk under `directory/parsed` and
+    keeps only the row keys plus the file-wide kind of every column. The keys fix the row count and the final
+    order (date, then race, so each race is contiguous and a date split is two plain slices). The second pass
+    re-reads the spilled chunks and writes every batch of whole races to its final rows. Columns that are numeric
+    anywhere in the file are cast to float in every batch, so a chunk where a column happens to be empty yields
+    the same feature columns as the whole file would. Workouts are read whole and matched per batch. A matrix
+    already built from the same input files is reused.
+    """
+    sources = source_signature([program_path, workouts_path])
+    existing = open_design_matrix(directory, sources)
+    if existing is not None:
+        return existing
+    spill = Path(directory) / "parsed"
+    spill.mkdir(parents=True, exist_ok=True)
+    chunks = ProgramChunks(program_path, chunk_rows)
+    paths: List[Path] = []
+    keys = []
+    numeric: set = set()
+    other: set = set()
+    for parsed in chunks:
+        if parsed.empty:
+            continue
+        paths.append(spill / f"{len(paths):05d}.pkl")
+        parsed.to_pickle(paths[-1])
+        keys.append(parsed[["row_index", "race_uid", "race_date", "race_key"]])
+        _fold_column_kinds(parsed, numeric, other)
+    if not keys:
+        raise ValueError("Programda satır yok")
+    keys = chunks.finish(pd.concat(keys, ignore_index=True))
+    keys = keys.sort_values(["race_date", "race_uid"], kind="stable").reset_index(drop=True)
+    position = pd.Series(np.arange(len(keys)), index=keys["row_index"].to_numpy())
+    race_sizes = keys.groupby("race_uid", sort=False).size()
+    float_columns = sorted(numeric - other)
+    workouts = read_workouts_csv(workouts_path) if workouts_path else None
+
+    writer = None
+    side = []
+    for batch in _whole_race_batches(paths, chunks, race_sizes, chunk_races):
+        if batch.empty:
+            continue
+        rows = position.loc[batch["row_index"]].to_numpy()
+        order = np.argsort(rows, kind="stable")
+        batch, rows = batch.iloc[order].reset_index(drop=True), rows[order]
+        for column in float_columns:
+            if not pd.api.types.is_numeric_dtype(batch[column]):
+                batch[column] = batch[column].astype(np.float64)
+        batch_workouts = workouts
+        if workouts is not None and not workouts.empty:
+            batch_workouts = workouts[workouts["tarih"].isin(set(batch["race_date"]))]
+        enriched = build_features(merge_program_and_workouts(ProgramData(batch, chunks.errors), batch_workouts).frame)
+        targets = build_targets(enriched)
+        if writer is None:
+            _, feature_columns = select_feature_matrix(enriched)
+            writer = DesignMatrixWriter(directory, len(keys), feature_columns, list(targets))
+        X = enriched.reindex(columns=writer.feature_columns).fillna(NUMERIC_FILL).to_numpy(dtype=np.float32)
+        writer.write_rows(rows, X, targets)
+        side.append(enriched.reindex(columns=SIDE_COLUMNS).set_axis(rows))
+    spill.rmdir()
+    if writer is None:
+        raise ValueError("Programda satır yok")
+    return writer.close(pd.concat(side).sort_index(), sources)
+
+
+def load_dataset(
+    program_path: Path, workouts_path: Path | None = None, design_dir: Path | None = None, chunk_races: int = 2000
+) -> Dict[str, Any]:
+    """Read, merge and featurize a program (+ workouts) CSV into the arrays the trainers consume.
+
+    With `design_dir` the feature matrix and targets are memory-mapped from disk (see write_design_matrix).
+    """
+    if design_dir is not None:
+        design = write_design_matrix(program_path, workouts_path, design_dir, chunk_races)
+        return {
+            "frame": design.frame,
+            "X": design.X,
+            "feature_columns": design.feature_columns,
+            "targets": design.targets,
+            "race_ids": design.frame["race_uid"].values,
+            "dates": design.frame["race_date"].tolist(),
+            "design": design,
+        }
+    program = read_program_csv(program_path)
+    workouts = read_workouts_csv(workouts_path) if workouts_path else None
+    merged = merge_program_and_workouts(program, workouts)
+    enriched = build_features(merged.frame)
+    X, feature_columns = select_feature_matrix(enriched)
+    return {
+        "frame": enriched,
+        "X": X,
+        "feature_columns": feature_columns,
+        "targets": build_targets(enriched),
+        "race_ids": enriched["race_uid"].values,
+        "dates": enriched["race_date"].tolist(),
+    }
 
-    cat_model = CatBoostWrapper()
-    cat_model.fit(X_train, y_train, X_val, y_val)
-    models["catboost"] = cat_model
 
-    mlp_model = SetMLPWrapper(input_dim=input_dim)
-    mlp_model.fit(X_train, y_train, X_val, y_val)
-    models["set_mlp"] = mlp_model
+def load_params(path: Path | None) -> Dict[str, Dict[str, Any]]:
+    """Per-model hyperparameters as written by cli.tune (`{"xgb": {...}, ...}`)."""
+    if path is None:
+        return {}
+    payload = json.loads(Path(path).read_text())
+    return payload.get("params", payload)
+
+
+def train_models(
+    X_train: np.ndarray,
+    y_train: np.ndarray,
+    X_val: np.ndarray | None = None,
+    y_val: np.ndarray | None = None,
+    input_dim: int = 10,
+    patience: int = DEFAULT_PATIENCE,
+    mlp_patience: int = DEFAULT_MLP_PATIENCE,
+    time_budgets: Dict[str, float] | None = None,
+    groups_train: np.ndarray | None = None,
+    groups_val: np.ndarray | None = None,
+    params: Dict[str, Dict[str, Any]] | None = None,
+    members: Sequence[str] = MEMBER_NAMES,
+    sample_weight: np.ndarray | None = None,
+):
+    budgets = time_budgets or {}
+    params = params or {}
+    models = {}
+    for name in members:
+        model = make_member(name, input_dim, params.get(name), patience, mlp_patience, budgets.get(name))
+        models[name] = fit_member(model, X_train, y_train, X_val, y_val, groups_train, groups_val, sample_weight)
 
     return models
 
 
+def update_models(
+    models: Dict[str, Any],
+    X_train: np.ndarray,
+    y_train: np.ndarray,
+    X_val: np.ndarray | None = None,
+    y_val: np.ndarray | None = None,
+    groups_train: np.ndarray | None = None,
+    groups_val: np.ndarray | None = None,
+    rounds: int = 50,
+    mlp_epochs: int = 10,
+    time_budgets: Dict[str, float] | None = None,
+) -> List[str]:
+    """Continue every member of a previous artifact on new rows; members that cannot warm-start are kept as they are.
+    Returns the names of the members that were updated."""
+    budgets = time_budgets or {}
+    updated = []
+    for name, model in models.items():
+        if name in budgets:
+            model.time_budget_s = budgets[name]
+        member_rounds = mlp_epochs if name == "set_mlp" else rounds
+        if continue_member(model, X_train, y_train, X_val, y_val, groups_train, groups_val, member_rounds):
+            updated.append(name)
+    return updated
+
+
+def train_shards(
+    X: np.ndarray,
+    y: np.ndarray,
+    keys: np.ndarray,
+    train_idx: np.ndarray,
+    val_idx: np.ndarray,
+    global_probs: np.ndarray,
+    race_ids: np.ndarray,
+    race_contexts: List[Dict[str, object]],
+    by: str,
+    feature_columns: List[str],
+    members: Sequence[str] = ("lgbm",),
+    min_rows: int = 2000,
+    **train_kwargs: Any,
+) -> ShardSet:
+    """One small member set + gate + calibrator per context value; a shard is kept only if it beats the global
+    model's logloss on held-out races of its own context, otherwise that context falls back to the global model.
+
+    The context's validation races are dealt alternately into a fit half (early stopping, gate, calibrator)
+    and a selection half that only scores the keep/fallback decision.
+    """
+    shards = ShardSet(by=by)
+    for value in sorted(set(keys[train_idx])):
+        tr = train_idx[keys[train_idx] == value]
+        va = val_idx[keys[val_idx] == value]
+        race_codes = pd.factorize(race_ids[va])[0]
+        va_fit, va_select = va[race_codes % 2 == 0], va[race_codes % 2 == 1]
+        entry: Dict[str, Any] = {"train_rows": int(len(tr)), "val_rows": int(len(va_fit)), "select_rows": int(len(va_select))}
+        shards.report[value] = entry
+        if len(tr) < min_rows or len(va_fit) == 0 or len(va_select) == 0 or len(np.unique(y[tr])) < 2:
+            entry["status"] = "fallback:rows"
+            continue
+        models = train_models(
+            X[tr],
+            y[tr],
+            X[va_fit],
+            y[va_fit],
+            input_dim=X.shape[1],
+            groups_train=race_ids[tr],
+            groups_val=race_ids[va_fit],
+            members=members,
+            **train_kwargs,
+        )
+        # Same recipe as the global model on the fit half: gate on train + fit rows, calibrator on the fit rows.
+        rows = np.concatenate([tr, va_fit])
+        base = [predict_member(model, X[rows], race_ids[rows]) for model in models.values()]
+        contexts = [race_contexts[i] for i in rows]
+        ensemble = ContextGatedEnsemble()
+        ensemble.fit(np.column_stack(base), contexts, np.vstack([1 - y[rows], y[rows]]).T)
+        calibrator = choose_best_calibrator(ensemble.combine(base, contexts)[len(tr):], y[va_fit])
+        select_base = [predict_member(model, X[va_select], race_ids[va_select]) for model in models.values()]
+        probs = calibrator.apply(ensemble.combine(select_base, [race_contexts[i] for i in va_select]))
+        entry["logloss"] = log_loss_score(y[va_select], probs)
+        entry["logloss_global"] = log_loss_score(y[va_select], global_probs[va_select])
+        if not entry["logloss"] < entry["logloss_global"]:
+            entry["status"] = "fallback:worse"
+            continue
+        entry["status"] = "shard"
+        shards.trained[value] = {
+            "feature_columns": feature_columns,
+            "models": models,
+            "ensemble": ensemble,
+            "calibrator": calibrator,
+            "metrics": {"logloss": entry["logloss"]},
+            "meta": {"shard_by": by, "value": value, "members": list(members)},
+        }
+    return shards
+
+
 def main() -> None:
     parser = argparse.ArgumentParser()
     parser.add_argument("--program", type=Path, required=True)
@@ -107,15 +361,77 @@ def main() -> None:
     parser.add_argument("--val-date", type=str, required=True)
     parser.add_argument("--artifact", type=Path, default=Path("artifacts/model.pkl"))
     parser.add_argument("--meta-out", type=Path, default=Path("artifacts/train_meta.json"))
+    parser.add_argument("--patience", type=int, default=DEFAULT_PATIENCE)
+    parser.add_argument("--mlp-patience", type=int, default=DEFAULT_MLP_PATIENCE)
+    parser.add_argument("--time-budget", action="append", default=[], metavar="MODEL=SECONDS")
+    parser.add_argument("--mlp-export", choices=["none", "fp32", "int8"], default="none")
+    parser.add_argument("--bundle", type=Path, default=None, help="Native formatlı sürümlü bundle dizini")
+    parser.add_argument("--params", type=Path, default=None, help="cli.tune çıktısı best_params.json")
+    parser.add_argument("--stacking", choices=["none", "oof"], default="none", help="oof: gate zaman sıralı out-of-fold tahminlerle eğitilir")
+    parser.add_argument("--stack-folds", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=1, help="OOF stacking için süreç sayısı")
+    parser.add_argument("--calibration-by", choices=["none", "gate_context_key", "hipodrom"], default="none", help="Bağlam başına ayrı kalibratör")
+    parser.add_argument("--calibration-min-rows", type=int, default=200, help="Kendi kalibratörünü alacak bağlamın asgari satır sayısı")
+    parser.add_argument(
+        "--ranking",
+        nargs="*",
+        choices=sorted(RANKING_MEMBERS),
+        default=None,
+        help="Yarış gruplu ranking modelleri (boş: hepsi); ensemble'a ek sinyal olarak girer",
+    )
+    parser.add_argument(
+        "--targets",
+        nargs="*",
+        choices=AUX_TARGETS,
+        default=None,
+        help="Ek hedefler (boş: hepsi); ortak binlenmiş veri üzerinde eğitilir",
+    )
+    parser.add_argument("--target-backend", choices=TARGET_BACKENDS, default="lgbm")
+    parser.add_argument("--race-combiner", choices=["none", "clogit"], default="none", help="clogit: yarış içi softmax ile model + piyasa birleştirici")
+    parser.add_argument(
+        "--prune-value-per-ms",
+        type=float,
+        default=None,
+        help="Validation logloss+Brier katkısı / çıkarım maliyeti (ms/1000 satır) bu eşiğin altındaki üyeleri at",
+    )
+    parser.add_argument("--anytime", action="store_true", help="cli.predict --deadline-ms için ucuzdan pahalıya önek gate'lerini eğit")
+    parser.add_argument(
+        "--negative-rate",
+        type=float,
+        default=None,
+        help="Base modeller her koşunun tüm kazananları ve kaybedenlerinin bu oranı ile (ağırlıklı) eğitilir",
+    )
+    parser.add_argument("--shard-by", choices=("none",) + SHARD_KEYS, default="none", help="Bağlam başına özel model shard'ları")
+    parser.add_argument("--shard-members", nargs="+", choices=MEMBER_NAMES, default=["lgbm"], help="Her shard'da eğitilecek üyeler")
+    parser.add_argument("--shard-min-rows", type=int, default=2000, help="Shard eğitilecek bağlamın asgari eğitim satırı")
+    parser.add_argument("--distill", action="store_true", help="Kalibre ensemble çıktısını tek küçük booster'a distile et (cli.predict --fast)")
+    parser.add_argument("--distill-rounds", type=int, default=200, help="Distile model için en fazla ağaç sayısı")
+    parser.add_argument(
+        "--out-of-core",
+        type=Path,
+        default=None,
+        metavar="DIR",
+        help="Özellik matrisini ve hedefleri bu dizine parça parça float32 memmap olarak yaz ve modelleri diskten eğit",
+    )
+    parser.add_argument("--chunk-races", type=int, default=2000, help="--out-of-core: özellik çıkarımında parça başına koşu sayısı")
+    parser.add_argument("--update-from", type=Path, default=None, help="Önceki artifact (pickle veya bundle); modeller yeni satırlarla sürdürülür")
+    parser.add_argument("--update-rounds", type=int, default=50, help="Artımlı eğitimde booster başına en fazla ek ağaç")
+    parser.add_argument("--update-epochs", type=int, default=10, help="Artımlı eğitimde Set-MLP ince ayar epoch sayısı")
     args = parser.parse_args()
-
-    program = read_program_csv(args.program)
-    workouts = read_workouts_csv(args.workouts) if args.workouts else None
-    merged = merge_program_and_workouts(program, workouts)
-    enriched = build_features(merged.frame)
-
-    targets = build_targets(enriched)
-    X, feature_columns = select_feature_matrix(enriched)
+    if args.update_from is not None and args.stacking == "oof":
+        parser.error("--update-from ile --stacking oof birlikte kullanılamaz")
+    if args.negative_rate is not None and (args.update_from is not None or args.stacking == "oof"):
+        parser.error("--negative-rate yalnızca tam eğitimde (--stacking none) kullanılabilir")
+    time_budgets = parse_time_budgets(args.time_budget)
+    model_params = load_params(args.params)
+    members = list(MEMBER_NAMES)
+    if args.ranking is not None:
+        members += [RANKING_MEMBERS[name] for name in (args.ranking or sorted(RANKING_MEMBERS))]
+
+    dataset = load_dataset(args.program, args.workouts, design_dir=args.out_of_core, chunk_races=args.chunk_races)
+    enriched = dataset["frame"]
+    targets = dataset["targets"]
+    X, feature_columns = dataset["X"], dataset["feature_columns"]
 
     split = time_based_split(enriched["race_date"].tolist(), args.val_date)
     total_indices = np.arange(len(X))
@@ -133,56 +449,354 @@ def main() -> None:
         train_idx = np.setdiff1d(total_indices, val_idx)
         split = Split(train_idx=train_idx, val_idx=val_idx, cutoff=split.cutoff)
 
-    X_train = X[split.train_idx]
+    # Contiguous splits (always the case out of core) are views, so a memory-mapped matrix is not copied into RAM.
+    X_train = take_rows(X, split.train_idx)
     y_train = targets["win"][split.train_idx]
-    X_val = X[split.val_idx] if len(split.val_idx) else None
+    X_val = take_rows(X, split.val_idx) if len(split.val_idx) else None
     y_val = targets["win"][split.val_idx] if len(split.val_idx) else None
-
-    models = train_models(X_train, y_train, X_val, y_val, input_dim=X.shape[1])
-
-    base_preds = []
-    for model in models.values():
-        proba = model.predict_proba(X)
-        base_preds.append(proba[:, 1])
+    race_ids = enriched["race_uid"].values
+
+    stacking = None
+    update = None
+    sampling = None
+    target_models = None
+    if args.update_from is not None:
+        previous = load_artifact(args.update_from, mlp_runtime="eager")
+        if list(previous["feature_columns"]) != list(feature_columns):
+            raise ValueError("Özellik kolonları önceki artifact ile uyuşmuyor; tam eğitim gerekli")
+        # Rows before the previous validation date were already boosted on; the rest of the training window is new.
+        since = pd.Timestamp(previous["meta"]["val_date"])
+        train_dates = pd.to_datetime(pd.Series(enriched["race_date"].values[split.train_idx]))
+        new_idx = split.train_idx[(train_dates >= since).values]
+        if len(new_idx) == 0:
+            raise ValueError(f"{previous['meta']['val_date']} sonrasında güncellenecek yeni satır yok")
+        models = previous["models"]
+        update_started = time.perf_counter()
+        updated = update_models(
+            models,
+            X[new_idx],
+            targets["win"][new_idx],
+            X_val,
+            y_val,
+            race_ids[new_idx],
+            race_ids[split.val_idx] if len(split.val_idx) else None,
+            rounds=args.update_rounds,
+            mlp_epochs=args.update_epochs,
+            time_budgets=time_budgets,
+        )
+        update = {
+            "from": str(args.update_from),
+            "previous_val_date": previous["meta"]["val_date"],
+            "new_rows": int(len(new_idx)),
+            "rounds": args.update_rounds,
+            "mlp_epochs": args.update_epochs,
+            "updated": updated,
+            "kept": [name for name in models if name not in updated],
+            "seconds": time.perf_counter() - update_started,
+        }
+        if args.targets is None:
+            target_models = previous.get("targets")
+    elif args.stacking == "oof":
+        stacking = fit_oof_stack(
+            X,
+            targets["win"],
+            race_ids,
+            enriched["race_date"].tolist(),
+            split.train_idx,
+            split.val_idx,
+            n_folds=args.stack_folds,
+            workers=args.workers,
+            members=members,
+            params=model_params,
+            patience=args.patience,
+            mlp_patience=args.mlp_patience,
+            time_budgets=time_budgets,
+            memmap_path=dataset["design"].directory / "X.npy" if "design" in dataset else None,
+        )
+        models = stacking.models
+    else:
+        # Validation rows, the gate and the calibrator always see the full data, so only member fitting gets cheaper.
+        fit_idx, fit_weight = split.train_idx, None
+        if args.negative_rate is not None:
+            sample = downsample_negatives(y_train, race_ids[split.train_idx], enriched["p_market"].values[split.train_idx], args.negative_rate)
+            fit_idx, fit_weight = split.train_idx[sample.index], sample.weights
+            sampling = sample.report
+        fit_started = time.perf_counter()
+        models = train_models(
+            X[fit_idx],
+            targets["win"][fit_idx],
+            X_val,
+            y_val,
+            input_dim=X.shape[1],
+            patience=args.patience,
+            mlp_patience=args.mlp_patience,
+            time_budgets=time_budgets,
+            groups_train=race_ids[fit_idx],
+            groups_val=race_ids[split.val_idx] if len(split.val_idx) else None,
+            params=model_params,
+            members=members,
+            sample_weight=fit_weight,
+        )
+        if sampling is not None:
+            sampling["fit_seconds"] = time.perf_counter() - fit_started
+
+    mlp_model = models.get("set_mlp")
+    if args.mlp_export != "none" and mlp_model is not None and mlp_model.supports_export:
+        mlp_model.export_torchscript(quantize=args.mlp_export == "int8", path=args.artifact.with_name("set_mlp.ts"))
+
+    base_preds = [predict_member_chunked(model, X, race_ids) for model in models.values()]
     base_matrix = np.stack(base_preds, axis=1)
 
     race_contexts = enriched["race_context"].tolist()
+    win_targets = np.vstack([1 - targets["win"], targets["win"]]).T
+    if stacking is not None:
+        gate_rows = stacking.oof_rows
+        gate_inputs = stacking.oof[gate_rows]
+    else:
+        gate_rows = np.arange(len(X))
+        gate_inputs = base_matrix
+    gate_contexts = [race_contexts[i] for i in gate_rows]
+
+    # Scoring cost per member on (at most 5000) validation rows; only pruning and the anytime member order need it.
+    costs = None
+    if args.prune_value_per_ms is not None or args.anytime:
+        cost_rows = (split.val_idx if len(split.val_idx) else np.arange(len(X)))[:5000]
+        costs = member_costs(models, X[cost_rows], race_ids[cost_rows])
+    pruning = None
+    if args.prune_value_per_ms is not None and len(split.val_idx) and len(models) > 1:
+        # Leave-one-out gates never see validation rows: OOF outputs when stacking, training rows otherwise.
+        prune_rows = gate_rows if stacking is not None else split.train_idx
+        pruning = prune_members(
+            list(models),
+            costs,
+            (stacking.oof if stacking is not None else base_matrix)[prune_rows],
+            [race_contexts[i] for i in prune_rows],
+            win_targets[prune_rows],
+            base_matrix[split.val_idx],
+            [race_contexts[i] for i in split.val_idx],
+            targets["win"][split.val_idx],
+            min_value_per_ms=args.prune_value_per_ms,
+        )
+        # Pruned members leave the artifact entirely, so predict neither loads nor evaluates them.
+        columns = [list(models).index(name) for name in pruning.kept]
+        models = {name: models[name] for name in pruning.kept}
+        base_preds = [base_preds[c] for c in columns]
+        base_matrix = base_matrix[:, columns]
+        gate_inputs = gate_inputs[:, columns]
+
     ensemble = ContextGatedEnsemble()
-    ensemble.fit(base_matrix, race_contexts, np.vstack([1 - targets["win"], targets["win"]]).T)
+    ensemble.fit(gate_inputs, gate_contexts, win_targets[gate_rows])
+    anytime = fit_anytime_ensemble(list(models), costs, gate_inputs, gate_contexts, win_targets[gate_rows]) if args.anytime else None
     combined = ensemble.combine(base_preds, race_contexts)
 
-    calibrator = choose_best_calibrator(combined[split.val_idx], targets["win"][split.val_idx]) if len(split.val_idx) else CalibrationResult("temperature", 1.0)
-
-    calibrated = calibrator.apply(combined)
-
-    metrics = {
-        "auc": auc_score(targets["win"], calibrated),
-        "pr_auc": pr_auc_score(targets["win"], calibrated),
-        "brier": brier_score(targets["win"], calibrated),
-        "logloss": log_loss_score(targets["win"], calibrated),
-        "ndcg@3": ndcg_at_k(targets["win"], calibrated, k=3),
-        "ece": expected_calibration_error(targets["win"], calibrated),
-    }
-    edges = edge_statistics(calibrated, enriched["implied_prob"].values)
-    metrics.update(edges)
+    calibration_keys = enriched[args.calibration_by].astype(str).values if args.calibration_by != "none" else None
+    if len(split.val_idx):
+        calibrator = choose_best_calibrator(
+            combined[split.val_idx],
+            targets["win"][split.val_idx],
+            keys=calibration_keys[split.val_idx] if calibration_keys is not None else None,
+            by=args.calibration_by if calibration_keys is not None else None,
+            min_count=args.calibration_min_rows,
+        )
+    else:
+        calibrator = CalibrationResult("temperature", 1.0)
+
+    calibrated = calibrator.apply(combined, calibration_keys)
+    # Starting point for cli.update_results: the gate's training-row Hessian and the calibrator's validation statistics.
+    calibration_rows = split.val_idx if len(split.val_idx) else np.arange(len(X))
+    online = OnlineState(
+        gate=OnlineGate.from_ensemble(ensemble, gate_inputs, gate_contexts),
+        calibrator=OnlineCalibrator.from_calibrator(
+            calibrator,
+            combined[calibration_rows],
+            targets["win"][calibration_rows],
+            calibration_keys[calibration_rows] if calibration_keys is not None else None,
+        ),
+    )
+    if sampling is not None and len(split.val_idx):
+        # Weighted members and a gate/calibrator fit on unsampled rows should put the mean back at the true win rate.
+        sampling["val_win_rate"] = float(targets["win"][split.val_idx].mean())
+        sampling["val_mean_combined"] = float(combined[split.val_idx].mean())
+        sampling["val_mean_calibrated"] = float(calibrated[split.val_idx].mean())
+
+    if args.out_of_core is not None:
+        # Same metrics from histogram/sum accumulators fed in row chunks, without sklearn's full-array sorts.
+        streamed = stream_metrics(targets["win"], calibrated, race_ids, enriched["implied_prob"].values).result()
+        metrics = {name: streamed[name] for name in ("auc", "pr_auc", "brier", "logloss", "ndcg@3", "hit@3", "winner_rank", "ece")}
+        metrics.update({name: streamed[name] for name in ("edge_mean", "edge_median", "edge_positive_rate")})
+    else:
+        ranking = race_metrics(targets["win"], calibrated, groups=race_ids, k=3).aggregates()
+        metrics = {
+            "auc": auc_score(targets["win"], calibrated),
+            "pr_auc": pr_auc_score(targets["win"], calibrated),
+            "brier": brier_score(targets["win"], calibrated),
+            "logloss": log_loss_score(targets["win"], calibrated),
+            "ndcg@3": ranking["ndcg@3"],
+            "hit@3": ranking["hit@3"],
+            "winner_rank": ranking["winner_rank"],
+            "ece": expected_calibration_error(targets["win"], calibrated),
+        }
+        edges = edge_statistics(calibrated, enriched["implied_prob"].values)
+        metrics.update(edges)
+
+    race_combiner = None
+    if args.race_combiner == "clogit":
+        # Second stage: conditional logit over calibrated model and market probabilities, fit on the validation races.
+        fit_rows = split.val_idx if len(split.val_idx) else np.arange(len(calibrated))
+        market = enriched["p_market"].values
+        race_combiner = ConditionalLogit().fit(calibrated[fit_rows], market[fit_rows], targets["win"][fit_rows], race_ids[fit_rows])
+        # Reported on race-level out-of-fold predictions, never on races the scored coefficients were fit on.
+        race_probs = cross_fitted_predict(calibrated[fit_rows], market[fit_rows], targets["win"][fit_rows], race_ids[fit_rows])
+        model_only = ConditionalLogit(coef=np.array([1.0, 0.0, 0.0])).predict(calibrated[fit_rows], market[fit_rows], race_ids[fit_rows])
+        metrics["race_logloss_model"] = race_log_loss(targets["win"][fit_rows], model_only)
+        metrics["race_logloss"] = race_log_loss(targets["win"][fit_rows], race_probs)
+
+    if args.targets is not None:
+        aux = list(args.targets or AUX_TARGETS)
+        has_val = len(split.val_idx) > 0
+        target_models = fit_target_models(
+            X_train,
+            {name: targets[name][split.train_idx] for name in aux},
+            X_val,
+            {name: targets[name][split.val_idx] for name in aux} if has_val else None,
+            backend=args.target_backend,
+            params=model_params.get("targets"),
+            patience=args.patience,
+            time_budget_s=time_budgets.get("targets"),
+        )
+        if has_val:
+            aux_preds = target_models.predict(X_val)
+            for name, preds in aux_preds.items():
+                y_true = targets[name][split.val_idx]
+                known = np.isfinite(y_true)
+                if TARGET_KINDS[name] == "binary":
+                    metrics[f"{name}_auc"] = auc_score(y_true[known], preds[known])
+                    metrics[f"{name}_logloss"] = log_loss_score(y_true[known], preds[known])
+                else:
+                    metrics[f"{name}_rmse"] = rmse(y_true[known], preds[known])
+
+    shards = None
+    if args.shard_by != "none":
+        shards = train_shards(
+            X,
+            targets["win"],
+            enriched[args.shard_by].astype(str).values,
+            split.train_idx,
+            split.val_idx,
+            calibrated,
+            race_ids,
+            race_contexts,
+            args.shard_by,
+            feature_columns,
+            members=args.shard_members,
+            min_rows=args.shard_min_rows,
+            patience=args.patience,
+            mlp_patience=args.mlp_patience,
+            params=model_params,
+        )
+
+    distilled = None
+    if args.distill:
+        # Student learns the calibrated ensemble probability (before the race combiner, which the fast path still applies).
+        has_val = len(split.val_idx) > 0
+        distilled = distill_ensemble(
+            X_train,
+            calibrated[split.train_idx],
+            X_val,
+            calibrated[split.val_idx] if has_val else None,
+            params=model_params.get("distilled"),
+            rounds=args.distill_rounds,
+            patience=args.patience,
+            time_budget_s=time_budgets.get("distilled"),
+        )
+        eval_rows = split.val_idx if has_val else np.arange(len(X))
+        teacher = {"models": models, "ensemble": ensemble, "calibrator": calibrator}
+        started = time.perf_counter()
+        compute_predictions(
+            teacher,
+            X[eval_rows],
+            [race_contexts[i] for i in eval_rows],
+            race_ids[eval_rows],
+            calibration_keys[eval_rows] if calibration_keys is not None else None,
+        )
+        teacher_ms = 1000 * (time.perf_counter() - started)
+        started = time.perf_counter()
+        student = distilled.predict(X[eval_rows])
+        student_ms = 1000 * (time.perf_counter() - started)
+        distilled.fidelity = fidelity_report(targets["win"][eval_rows], calibrated[eval_rows], student)
+        distilled.fidelity.update(rows=int(len(eval_rows)), trees=distilled.best_iteration + 1, teacher_ms=teacher_ms, student_ms=student_ms)
 
     artifact = {
         "feature_columns": feature_columns,
         "models": models,
         "ensemble": ensemble,
+        "anytime": anytime,
         "calibrator": calibrator,
+        "race_combiner": race_combiner,
+        "targets": target_models,
+        "shards": shards,
+        "online": online,
         "metrics": metrics,
         "meta": {
             "val_date": args.val_date,
             "train_size": int(len(split.train_idx)),
             "val_size": int(len(split.val_idx)),
             "random_seed": 42,
+            "patience": args.patience,
+            "mlp_patience": args.mlp_patience,
+            "time_budgets": time_budgets,
+            "best_iterations": {name: model.best_iteration for name, model in models.items()},
+            "mlp_export": models["set_mlp"].export_meta if "set_mlp" in models else None,
+            "params": model_params,
+            "calibration_by": args.calibration_by,
+            "targets": {
+                "backend": target_models.backend,
+                "best_iterations": target_models.best_iterations,
+                "timings": target_models.timings,
+            }
+            if target_models is not None
+            else None,
+            "update": update,
+            "sampling": sampling,
+            "out_of_core": {"directory": str(args.out_of_core), "rows": int(len(X)), "bytes": dataset["design"].nbytes}
+            if args.out_of_core is not None
+            else None,
+            "member_costs_ms": costs,
+            "pruning": {"kept": pruning.kept, "dropped": pruning.dropped, "members": pruning.report} if pruning is not None else None,
+            "distill": distilled.fidelity if distilled is not None else None,
+            "shards": {"by": shards.by, "contexts": shards.report} if shards is not None else None,
+            "race_combiner": {"kind": "conditional_logit", "coef": race_combiner.coef.tolist()} if race_combiner is not None else None,
+            "stacking": {
+                "mode": args.stacking,
+                "folds": len(stacking.folds),
+                "oof_rows": int(len(stacking.oof_rows)),
+                "workers": args.workers,
+                "wall_s": stacking.wall_s,
+                "cpu_s": stacking.cpu_s,
+            }
+            if stacking is not None
+            else {"mode": "none"},
         },
     }
 
     args.artifact.parent.mkdir(parents=True, exist_ok=True)
+    if shards is not None:
+        shards.save_pickles(shard_directory(args.artifact))
     with open(args.artifact, "wb") as f:
         pickle.dump(artifact, f)
+    if distilled is not None:
+        fast_artifact = {
+            "feature_columns": feature_columns,
+            "distilled": distilled,
+            "race_combiner": race_combiner,
+            "targets": target_models,
+            "metrics": metrics,
+            "meta": {"val_date": args.val_date, "teacher": str(args.artifact), "distill": distilled.fidelity},
+        }
+        with open(fast_artifact_path(args.artifact), "wb") as f:
+            pickle.dump(fast_artifact, f)
+    if args.bundle:
+        save_bundle(args.bundle, {**artifact, "distilled": distilled})
 
     args.meta_out.parent.mkdir(parents=True, exist_ok=True)
     args.meta_out.write_text(json.dumps(metrics, indent=2))
@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from eval.backtest import walk_forward_splits
+from models.tuning import MAX_RESOURCE, RESOURCE_PARAMS, SEARCH_SPACES, parse_resources, tune_model
+
+from .train import load_dataset
+
+
+def build_folds(dates: List[str], n_splits: int) -> Tuple[List[Tuple[np.ndarray, np.ndarray]], List[str]]:
+    folds, cutoffs = [], []
+    for split in walk_forward_splits(dates, n_splits=n_splits):
+        if len(split.train_idx) and len(split.val_idx):
+            folds.append((split.train_idx, split.val_idx))
+            cutoffs.append(str(split.cutoff))
+    if not folds:
+        raise SystemExit("Walk-forward fold üretilemedi: en az iki farklı yarış tarihi gerekli")
+    return folds, cutoffs
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--program", type=Path, required=True)
+    parser.add_argument("--workouts", type=Path, default=None)
+    parser.add_argument("--models", nargs="+", choices=sorted(SEARCH_SPACES), default=["xgb", "lgbm", "catboost", "set_mlp"])
+    parser.add_argument("--folds", type=int, default=3, help="Walk-forward fold sayısı")
+    parser.add_argument("--strategy", choices=["sh", "hyperband"], default="sh")
+    parser.add_argument("--n-configs", type=int, default=81, help="Successive halving başlangıç konfigürasyon sayısı")
+    parser.add_argument("--eta", type=int, default=3, help="Her basamakta 1/eta konfigürasyon kalır")
+    parser.add_argument("--max-resource", action="append", default=[], metavar="MODEL=N", help="Son basamak bütçesi (tur/epoch)")
+    parser.add_argument("--min-resource", action="append", default=[], metavar="MODEL=N", help="İlk basamak bütçesi (tur/epoch)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", type=Path, default=Path("artifacts/best_params.json"))
+    args = parser.parse_args()
+    try:
+        max_resources = parse_resources(args.max_resource)
+        min_resources = parse_resources(args.min_resource)
+    except ValueError as exc:
+        parser.error(str(exc))
+
+    dataset = load_dataset(args.program, args.workouts)
+    folds, cutoffs = build_folds(dataset["dates"], args.folds)
+    X = dataset["X"].astype(np.float32)
+    y = dataset["targets"]["win"]
+
+    params: Dict[str, Dict[str, Any]] = {}
+    search: Dict[str, Dict[str, Any]] = {}
+    for model in args.models:
+        result = tune_model(
+            model,
+            X,
+            y,
+            dataset["race_ids"],
+            folds,
+            n_configs=args.n_configs,
+            eta=args.eta,
+            min_resource=min_resources.get(model),
+            max_resource=max_resources.get(model, MAX_RESOURCE[model]),
+            strategy=args.strategy,
+            workers=args.workers,
+            seed=args.seed,
+        )
+        # The winning budget becomes the wrapper's round/epoch cap; cli.train still early-stops below it.
+        params[model] = {**result.best_params, RESOURCE_PARAMS[model]: result.best_resource}
+        search[model] = {
+            "best_logloss": result.best_logloss,
+            "best_resource": result.best_resource,
+            "n_configs": result.n_configs,
+            "wall_s": result.wall_s,
+            "rungs": result.rungs,
+        }
+        print(json.dumps({"model": model, "best_logloss": result.best_logloss, "configs": result.n_configs, "wall_s": round(result.wall_s, 1)}))
+
+    payload = {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "strategy": args.strategy,
+        "eta": args.eta,
+        "fold_cutoffs": cutoffs,
+        "feature_columns": dataset["feature_columns"],
+        "params": params,
+        "search": search,
+    }
+    args.out.parent.mkdir(parents=True, exist_ok=True)
+    args.out.write_text(json.dumps(payload, indent=2, ensure_ascii=False))
+    print(json.dumps({"status": "ok", "out": str(args.out), "params": params}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import argparse
+import copy
+import json
+import os
+import pickle
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+import pandas as pd
+
+from dataio.merge import merge_program_and_workouts
+from dataio.read_program import read_program_csv
+from dataio.read_workouts import read_workouts_csv
+from eval.metrics import log_loss_score
+from models.ensemble import predict_member
+from models.online import DEFAULT_FORGETTING, DEFAULT_PRIOR_ROWS, OnlineState
+
+from .predict import build_features, ensure_features, load_artifact
+
+
+# Horse-name aliases accepted as the second key of a results CSV.
+HORSE_COLUMNS = ("at_ismi", "At İsmi")
+
+
+def read_results(enriched: pd.DataFrame, program_path: Path, results_path: Path | None) -> np.ndarray:
+    """Win labels of the enriched rows from real results; NaN where a horse has no result.
+
+    Without `results_path` the result columns of the program CSV itself are used, matched by row index. A results
+    CSV is matched on `race_uid` plus the horse name. `Result_Win` is used when present, otherwise
+    `Finish_Position == 1`. The favourite proxy cli.train falls back to is never used here: the online fit would
+    only learn to predict the market.
+    """
+    if results_path is None:
+        results = pd.read_csv(program_path, dtype=str, encoding="utf-8")
+        results.columns = [c.strip() for c in results.columns]
+        results = results.reindex(enriched["row_index"].to_numpy())
+    else:
+        results = pd.read_csv(results_path, dtype=str, encoding="utf-8")
+        results.columns = [c.strip() for c in results.columns]
+        horse = next((c for c in HORSE_COLUMNS if c in results.columns), None)
+        if "race_uid" not in results.columns or horse is None:
+            raise SystemExit(f"{results_path}: sonuç dosyasında race_uid ve at ismi ({' / '.join(HORSE_COLUMNS)}) kolonları gerekli")
+        keys = results["race_uid"].str.strip() + "|" + results[horse].fillna("").str.strip().str.lower()
+        wanted = enriched["race_uid"].astype(str) + "|" + enriched["at_ismi"].fillna("").str.strip().str.lower()
+        results = results.set_index(keys)
+        results = results[~results.index.duplicated(keep="last")].reindex(wanted.to_numpy())
+    if "Result_Win" in results.columns:
+        return pd.to_numeric(results["Result_Win"], errors="coerce").to_numpy(dtype=np.float64)
+    if "Finish_Position" in results.columns:
+        position = pd.to_numeric(results["Finish_Position"], errors="coerce")
+        return (position == 1).astype(np.float64).where(position.notna()).to_numpy(dtype=np.float64)
+    raise SystemExit(f"{results_path or program_path}: sonuç kolonu yok (Result_Win veya Finish_Position gerekli)")
+
+
+def online_directory(path: Path, artifact: Dict[str, Any]) -> Path:
+    """Versions of `artifacts/model.pkl` go to `artifacts/model.online/`; a version keeps writing next to itself."""
+    previous = (artifact.get("meta") or {}).get("online")
+    if previous and previous.get("directory"):
+        return Path(previous["directory"])
+    return path.with_name(f"{path.stem}.online")
+
+
+def write_version(directory: Path, artifact: Dict[str, Any], state: OnlineState) -> Path:
+    """`v0003-2025-09-24.pkl` plus a `latest.pkl` symlink that is switched atomically."""
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"v{state.version:04d}-{state.last_date}.pkl"
+    with open(path, "wb") as f:
+        pickle.dump(artifact, f)
+    link = directory / ".latest.pkl"
+    link.unlink(missing_ok=True)
+    link.symlink_to(path.name)
+    os.replace(link, directory / "latest.pkl")
+    return path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Biten koşuların sonuçlarıyla gate ve kalibratörü çevrimiçi güncelle")
+    parser.add_argument("--program", type=Path, required=True, help="Biten koşuların program CSV'si")
+    parser.add_argument("--workouts", type=Path, default=None)
+    parser.add_argument(
+        "--results", type=Path, default=None, help="race_uid + at_ismi ile eşlenen sonuç CSV'si (Result_Win veya Finish_Position); varsayılan: program CSV'sindeki sonuç kolonları"
+    )
+    parser.add_argument("--artifact", type=Path, default=Path("artifacts/model.pkl"), help="Eğitilmiş artifact veya önceki sürüm (latest.pkl)")
+    parser.add_argument("--out-dir", type=Path, default=None, help="Sürümlerin yazılacağı dizin (varsayılan: <artifact>.online/)")
+    parser.add_argument("--since", type=str, default=None, help="Yalnızca bu tarihten sonraki koşular (YYYY-MM-DD); varsayılan: son sürümün tarihi")
+    parser.add_argument("--forgetting", type=float, default=DEFAULT_FORGETTING, help="Yarış günü başına geçmiş kanıtın çarpanı")
+    parser.add_argument("--prior-rows", type=int, default=DEFAULT_PRIOR_ROWS, help="Eğitim istatistiği olmayan artifact'te donmuş fitin satır ağırlığı")
+    parser.add_argument("--mlp-runtime", choices=["artifact", "eager", "torchscript"], default="artifact")
+    args = parser.parse_args()
+    if not 0.0 < args.forgetting <= 1.0:
+        parser.error("--forgetting (0, 1] aralığında olmalı")
+
+    artifact = load_artifact(args.artifact, mlp_runtime=args.mlp_runtime)
+    state = copy.deepcopy(OnlineState.from_artifact(artifact, prior_rows=args.prior_rows))
+    frozen_ensemble, frozen_calibrator = artifact["ensemble"], artifact["calibrator"]
+    directory = args.out_dir or online_directory(args.artifact, artifact)
+
+    program = read_program_csv(args.program)
+    workouts = read_workouts_csv(args.workouts) if args.workouts else None
+    enriched = build_features(merge_program_and_workouts(program, workouts).frame)
+    since = args.since or state.last_date
+    if since is not None:
+        enriched = enriched[enriched["race_date"].astype(str) > since].reset_index(drop=True)
+    if enriched.empty:
+        raise SystemExit(f"{since or '-'} sonrasında güncellenecek koşu yok")
+    y = read_results(enriched, args.program, args.results)
+    # Only races with a known winner are evidence; runners without a result are left out.
+    has_winner = pd.Series(y == 1.0).groupby(enriched["race_uid"].to_numpy()).transform("any").to_numpy()
+    keep = has_winner & ~np.isnan(y)
+    if not keep.any():
+        raise SystemExit("Sonuçlarla eşleşen, kazananı belli koşu yok")
+    enriched, y = enriched[keep].reset_index(drop=True), y[keep]
+
+    # The base models are frozen: they score the finished races once, every day below reuses these outputs.
+    X = ensure_features(enriched, artifact["feature_columns"])
+    race_ids = enriched["race_uid"].values
+    base = np.column_stack([predict_member(model, X, race_ids) for model in artifact["models"].values()])
+    contexts = enriched["race_context"].tolist()
+    by = state.calibrator.by
+    keys = enriched[by].astype(str).values if by else None
+
+    days: List[Dict[str, Any]] = []
+    dates = enriched["race_date"].astype(str).values
+    for date in sorted(set(dates)):
+        rows = np.flatnonzero(dates == date)
+        day_base = base[rows]
+        day_contexts = [contexts[i] for i in rows]
+        day_keys = keys[rows] if keys is not None else None
+        ensemble, calibrator = state.gate.to_ensemble(), state.calibrator.to_calibrator()
+        # Scored before the update: each day is predicted by the version that was live when its races ran.
+        served = calibrator.apply(ensemble.combine(list(day_base.T), day_contexts), day_keys)
+        frozen = frozen_calibrator.apply(frozen_ensemble.combine(list(day_base.T), day_contexts), day_keys)
+
+        started = time.perf_counter()
+        state.gate.update(day_base, day_contexts, y[rows], forgetting=args.forgetting, prior_rows=args.prior_rows)
+        combined = state.gate.to_ensemble().combine(list(day_base.T), day_contexts)
+        state.calibrator.update(combined, y[rows], day_keys, forgetting=args.forgetting, prior_rows=args.prior_rows)
+        update_ms = 1000 * (time.perf_counter() - started)
+        state.version += 1
+        state.last_date = str(date)
+
+        version = dict(artifact)
+        version["ensemble"] = state.gate.to_ensemble()
+        version["calibrator"] = state.calibrator.to_calibrator()
+        if artifact.get("anytime") is not None:
+            # The full prefix must stay identical to the main gate; cheaper prefixes keep their frozen gates.
+            anytime = copy.copy(artifact["anytime"])
+            anytime.gates = list(anytime.gates[:-1]) + [version["ensemble"]]
+            version["anytime"] = anytime
+        # Shards are trained against one frozen global model and live next to the training artifact.
+        version["shards"] = None
+        version["online"] = copy.deepcopy(state)
+        day = {
+            "version": state.version,
+            "date": state.last_date,
+            "races": int(len(np.unique(race_ids[rows]))),
+            "rows": int(len(rows)),
+            "logloss_frozen": log_loss_score(y[rows], np.clip(frozen, 0.0, 1.0)),
+            "logloss_online": log_loss_score(y[rows], np.clip(served, 0.0, 1.0)),
+            "update_ms": update_ms,
+        }
+        version["meta"] = {
+            **(artifact.get("meta") or {}),
+            "online": {**day, "directory": str(directory), "forgetting": args.forgetting, "source": str(args.artifact)},
+        }
+        day["path"] = str(write_version(directory, version, state))
+        days.append(day)
+
+    print(json.dumps({"status": "ok", "directory": str(directory), "days": days}, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
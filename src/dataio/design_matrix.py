@@ -0,0 +1,114 @@
+"""On-disk design matrix: float32 features and targets as .npy memory maps written chunk by chunk."""
+from __future__ import annotations
+
+import json
+import pickle
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+MANIFEST_NAME = "design.json"
+
+
+@dataclass
+class DesignMatrix:
+    """Memory-mapped features/targets plus the small per-row side columns (ids, dates, contexts) held in RAM."""
+
+    directory: Path
+    X: np.ndarray
+    targets: Dict[str, np.ndarray]
+    feature_columns: List[str]
+    frame: pd.DataFrame
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.X.nbytes + sum(values.nbytes for values in self.targets.values()))
+
+
+def source_signature(paths: Sequence[Optional[Path]]) -> List[Dict[str, Any]]:
+    """Size and mtime of each input file; a stored matrix is reused only while these match."""
+    signature = []
+    for path in paths:
+        if path is None:
+            continue
+        stat = Path(path).stat()
+        signature.append({"path": str(Path(path).resolve()), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns})
+    return signature
+
+
+class DesignMatrixWriter:
+    """Preallocates the .npy files once the column set is known and fills them one row chunk at a time."""
+
+    def __init__(self, directory: Path, n_rows: int, feature_columns: List[str], target_names: Sequence[str]):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        (self.directory / MANIFEST_NAME).unlink(missing_ok=True)
+        self.n_rows = n_rows
+        self.feature_columns = list(feature_columns)
+        self.X = np.lib.format.open_memmap(self.directory / "X.npy", mode="w+", dtype=np.float32, shape=(n_rows, len(self.feature_columns)))
+        self.targets = {
+            name: np.lib.format.open_memmap(self.directory / f"y_{name}.npy", mode="w+", dtype=np.float64, shape=(n_rows,)) for name in target_names
+        }
+        self.written = 0
+
+    def write(self, X: np.ndarray, targets: Dict[str, np.ndarray]) -> None:
+        end = self.written + len(X)
+        self.X[self.written : end] = X
+        for name, values in targets.items():
+            self.targets[name][self.written : end] = values
+        self.written = end
+
+    def write_rows(self, rows: np.ndarray, X: np.ndarray, targets: Dict[str, np.ndarray]) -> None:
+        """Scatter a chunk to its final row positions, for inputs that are not read in row order."""
+        self.X[rows] = X
+        for name, values in targets.items():
+            self.targets[name][rows] = values
+        self.written += len(rows)
+
+    def close(self, frame: pd.DataFrame, sources: List[Dict[str, Any]]) -> DesignMatrix:
+        if self.written != self.n_rows:
+            raise ValueError(f"Tasarım matrisi eksik yazıldı: {self.written}/{self.n_rows} satır")
+        self.X.flush()
+        for values in self.targets.values():
+            values.flush()
+        with open(self.directory / "side.pkl", "wb") as f:
+            pickle.dump(frame.reset_index(drop=True), f)
+        manifest = {
+            "rows": self.n_rows,
+            "feature_columns": self.feature_columns,
+            "targets": sorted(self.targets),
+            "sources": sources,
+        }
+        # The manifest is written last, so an interrupted build is never mistaken for a complete one.
+        (self.directory / MANIFEST_NAME).write_text(json.dumps(manifest, indent=2, ensure_ascii=False))
+        return open_design_matrix(self.directory)
+
+
+def open_design_matrix(directory: Path, sources: Optional[List[Dict[str, Any]]] = None) -> Optional[DesignMatrix]:
+    """Open a stored matrix read-only; None if it is missing, incomplete, or (when `sources` is given) stale."""
+    directory = Path(directory)
+    manifest_path = directory / MANIFEST_NAME
+    if not manifest_path.exists():
+        return None
+    manifest = json.loads(manifest_path.read_text())
+    if sources is not None and manifest.get("sources") != sources:
+        return None
+    with open(directory / "side.pkl", "rb") as f:
+        frame = pickle.load(f)
+    return DesignMatrix(
+        directory=directory,
+        X=np.load(directory / "X.npy", mmap_mode="r"),
+        targets={name: np.load(directory / f"y_{name}.npy", mmap_mode="r") for name in manifest["targets"]},
+        feature_columns=list(manifest["feature_columns"]),
+        frame=frame,
+    )
+
+
+def take_rows(values: np.ndarray, index: np.ndarray) -> np.ndarray:
+    """values[index], as a view (no copy of a memory map) when the index is one contiguous ascending run."""
+    if len(index) and index[-1] - index[0] == len(index) - 1 and np.all(np.diff(index) == 1):
+        return values[index[0] : index[-1] + 1]
+    return values[index]
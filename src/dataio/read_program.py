@@ -3,7 +3,7 @@ from __future__ import annotations
 
 import difflib
 from collections import defaultdict
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterator, List, Optional, Tuple
 
 import pandas as pd
 
@@ -131,8 +131,56 @@ def _map_columns(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
+class _ParseState:
+    """Row errors plus the per-race state that spans rows: rejected races and the start counters of unnumbered runners."""
+
+    def __init__(self) -> None:
+        self.errors: List[Dict[str, object]] = []
+        self.invalid_race_keys: set = set()
+        self.start_counters: defaultdict[str, int] = defaultdict(int)
+
+    def finish(self, frame: pd.DataFrame) -> pd.DataFrame:
+        """Drop the rows of races rejected anywhere in the file, then the helper `race_key` column."""
+        if not frame.empty and self.invalid_race_keys:
+            mask = frame["race_key"].apply(lambda x: tuple(x) in self.invalid_race_keys)
+            frame = frame[~mask]
+        if "race_key" in frame.columns:
+            frame = frame.drop(columns=["race_key"])
+        return frame
+
+
 def read_program_csv(path: str) -> ProgramData:
-    df = pd.read_csv(path, dtype=str, encoding="utf-8")
+    state = _ParseState()
+    frame = _parse_rows(pd.read_csv(path, dtype=str, encoding="utf-8"), state)
+    return ProgramData(frame=state.finish(frame), errors=state.errors)
+
+
+class ProgramChunks:
+    """The program CSV parsed `chunk_rows` rows at a time.
+
+    Parse state is carried across chunks, so row indices, start tags and errors match read_program_csv. A race may
+    be rejected by a row in a later chunk; the yielded frames keep `race_key`, and `finish` drops rejected races
+    once every chunk has been read.
+    """
+
+    def __init__(self, path: str, chunk_rows: int = 50_000):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.state = _ParseState()
+
+    @property
+    def errors(self) -> List[Dict[str, object]]:
+        return self.state.errors
+
+    def __iter__(self) -> Iterator[pd.DataFrame]:
+        for df in pd.read_csv(self.path, dtype=str, encoding="utf-8", chunksize=self.chunk_rows):
+            yield _parse_rows(df, self.state)
+
+    def finish(self, frame: pd.DataFrame) -> pd.DataFrame:
+        return self.state.finish(frame)
+
+
+def _parse_rows(df: pd.DataFrame, state: _ParseState) -> pd.DataFrame:
     df.columns = [c.strip() for c in df.columns]
     df = _map_columns(df)
 
@@ -140,10 +188,10 @@ def read_program_csv(path: str) -> ProgramData:
     if missing_required:
         raise ValueError(f"Eksik zorunlu kolonlar: {missing_required}")
 
-    errors: List[Dict[str, object]] = []
+    errors = state.errors
     records: List[Dict[str, object]] = []
-    invalid_race_keys: set = set()
-    start_counters: defaultdict[str, int] = defaultdict(int)
+    invalid_race_keys = state.invalid_race_keys
+    start_counters = state.start_counters
 
     for idx, row in df.iterrows():
         row_idx = int(idx)
@@ -298,11 +346,4 @@ def read_program_csv(path: str) -> ProgramData:
         }
         records.append(record)
 
-    frame = pd.DataFrame.from_records(records)
-    if not frame.empty and invalid_race_keys:
-        mask = frame["race_key"].apply(lambda x: tuple(x) in invalid_race_keys)
-        frame = frame[~mask]
-        frame = frame.drop(columns=["race_key"])
-    elif "race_key" in frame.columns:
-        frame = frame.drop(columns=["race_key"])
-    return ProgramData(frame=frame, errors=errors)
+    return pd.DataFrame.from_records(records)
@@ -0,0 +1,282 @@
+"""Streaming metric accumulators: constant-memory sufficient statistics, updated chunk by chunk and merged across workers."""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+
+from .race_metrics import race_metrics
+
+AUC_BINS = 1 << 14
+EDGE_BINS = 4000
+# Same clipping as sklearn's log_loss for float64 probabilities.
+LOGLOSS_EPS = float(np.finfo(np.float64).eps)
+
+
+def _as_arrays(y_true: np.ndarray, y_prob: np.ndarray) -> tuple:
+    return np.asarray(y_true, dtype=np.float64).ravel(), np.asarray(y_prob, dtype=np.float64).ravel()
+
+
+@dataclass
+class AUCAccumulator:
+    """Positive/negative counts per fixed-width probability bin; ROC-AUC and average precision from the histograms.
+
+    Scores inside one bin count as ties, so the error is bounded by the mass that shares a bin (1/16384 wide).
+    """
+
+    bins: int = AUC_BINS
+    positives: np.ndarray = field(default=None)  # type: ignore[assignment]
+    negatives: np.ndarray = field(default=None)  # type: ignore[assignment]
+
+    def __post_init__(self) -> None:
+        if self.positives is None:
+            self.positives = np.zeros(self.bins)
+        if self.negatives is None:
+            self.negatives = np.zeros(self.bins)
+
+    def update(self, y_true: np.ndarray, y_prob: np.ndarray) -> "AUCAccumulator":
+        y_true, y_prob = _as_arrays(y_true, y_prob)
+        index = np.clip((y_prob * self.bins).astype(np.int64), 0, self.bins - 1)
+        self.positives += np.bincount(index, weights=y_true, minlength=self.bins)
+        self.negatives += np.bincount(index, weights=1.0 - y_true, minlength=self.bins)
+        return self
+
+    def merge(self, other: "AUCAccumulator") -> "AUCAccumulator":
+        if other.bins != self.bins:
+            raise ValueError(f"AUC histogramları farklı çözünürlükte: {self.bins} != {other.bins}")
+        self.positives += other.positives
+        self.negatives += other.negatives
+        return self
+
+    def auc(self) -> float:
+        n_pos, n_neg = self.positives.sum(), self.negatives.sum()
+        if n_pos == 0 or n_neg == 0:
+            return float("nan")
+        below = np.cumsum(self.negatives) - self.negatives
+        return float((self.positives * (below + 0.5 * self.negatives)).sum() / (n_pos * n_neg))
+
+    def average_precision(self) -> float:
+        n_pos = self.positives.sum()
+        if n_pos == 0:
+            return float("nan")
+        # Thresholds from the highest bin down, as sklearn walks distinct scores.
+        tp = np.cumsum(self.positives[::-1])
+        fp = np.cumsum(self.negatives[::-1])
+        seen = (tp + fp) > 0
+        precision = np.divide(tp, tp + fp, out=np.zeros_like(tp), where=seen)
+        recall_step = self.positives[::-1] / n_pos
+        return float((recall_step * precision).sum())
+
+
+@dataclass
+class ProbabilityAccumulator:
+    """Row count plus summed Brier and log-loss terms, and the per-bin sums behind ECE."""
+
+    ece_bins: int = 10
+    rows: float = 0.0
+    brier_sum: float = 0.0
+    logloss_sum: float = 0.0
+    bin_counts: np.ndarray = field(default=None)  # type: ignore[assignment]
+    bin_targets: np.ndarray = field(default=None)  # type: ignore[assignment]
+    bin_probs: np.ndarray = field(default=None)  # type: ignore[assignment]
+
+    def __post_init__(self) -> None:
+        for name in ("bin_counts", "bin_targets", "bin_probs"):
+            if getattr(self, name) is None:
+                setattr(self, name, np.zeros(self.ece_bins))
+
+    def update(self, y_true: np.ndarray, y_prob: np.ndarray) -> "ProbabilityAccumulator":
+        y_true, y_prob = _as_arrays(y_true, y_prob)
+        clipped = np.clip(y_prob, LOGLOSS_EPS, 1 - LOGLOSS_EPS)
+        self.rows += len(y_true)
+        self.brier_sum += float(((y_true - y_prob) ** 2).sum())
+        self.logloss_sum += float(-(y_true * np.log(clipped) + (1 - y_true) * np.log(1 - clipped)).sum())
+        index = np.clip((y_prob * self.ece_bins).astype(np.int64), 0, self.ece_bins - 1)
+        self.bin_counts += np.bincount(index, minlength=self.ece_bins)
+        self.bin_targets += np.bincount(index, weights=y_true, minlength=self.ece_bins)
+        self.bin_probs += np.bincount(index, weights=y_prob, minlength=self.ece_bins)
+        return self
+
+    def merge(self, other: "ProbabilityAccumulator") -> "ProbabilityAccumulator":
+        self.rows += other.rows
+        self.brier_sum += other.brier_sum
+        self.logloss_sum += other.logloss_sum
+        self.bin_counts += other.bin_counts
+        self.bin_targets += other.bin_targets
+        self.bin_probs += other.bin_probs
+        return self
+
+    def brier(self) -> float:
+        return self.brier_sum / self.rows if self.rows else float("nan")
+
+    def logloss(self) -> float:
+        return self.logloss_sum / self.rows if self.rows else float("nan")
+
+    def ece(self) -> float:
+        return float(np.abs(self.bin_targets - self.bin_probs).sum() / self.rows) if self.rows else 0.0
+
+
+@dataclass
+class EdgeAccumulator:
+    """Sum, positive count and a histogram of `win_prob - implied_prob` on [-1, 1]; the median is read off the histogram."""
+
+    bins: int = EDGE_BINS
+    rows: float = 0.0
+    total: float = 0.0
+    positive: float = 0.0
+    histogram: np.ndarray = field(default=None)  # type: ignore[assignment]
+
+    def __post_init__(self) -> None:
+        if self.histogram is None:
+            self.histogram = np.zeros(self.bins)
+
+    def update(self, win_prob: np.ndarray, implied_prob: np.ndarray) -> "EdgeAccumulator":
+        diff = np.asarray(win_prob, dtype=np.float64) - np.nan_to_num(np.asarray(implied_prob, dtype=np.float64), nan=0.0)
+        diff = diff[~np.isnan(diff)]
+        self.rows += len(diff)
+        self.total += float(diff.sum())
+        self.positive += float((diff > 0).sum())
+        index = np.clip(((diff + 1.0) * 0.5 * self.bins).astype(np.int64), 0, self.bins - 1)
+        self.histogram += np.bincount(index, minlength=self.bins)
+        return self
+
+    def merge(self, other: "EdgeAccumulator") -> "EdgeAccumulator":
+        self.rows += other.rows
+        self.total += other.total
+        self.positive += other.positive
+        self.histogram += other.histogram
+        return self
+
+    def result(self) -> Dict[str, float]:
+        if not self.rows:
+            nan = float("nan")
+            return {"edge_mean": nan, "edge_median": nan, "edge_positive_rate": nan}
+        # Linear interpolation inside the bin that holds the middle row.
+        cumulative = np.cumsum(self.histogram)
+        middle = 0.5 * self.rows
+        b = int(np.searchsorted(cumulative, middle))
+        before = cumulative[b] - self.histogram[b]
+        width = 2.0 / self.bins
+        median = -1.0 + width * (b + (middle - before) / self.histogram[b])
+        return {"edge_mean": self.total / self.rows, "edge_median": float(median), "edge_positive_rate": self.positive / self.rows}
+
+
+@dataclass
+class RaceAccumulator:
+    """Sums of the per-race ranking metrics; chunks must hold whole races."""
+
+    k: int = 3
+    races: float = 0.0
+    ndcg_sum: float = 0.0
+    hit_sum: float = 0.0
+    rank_sum: float = 0.0
+    logloss_sum: float = 0.0
+
+    def update(self, y_true: np.ndarray, y_score: np.ndarray, groups: Iterable[object]) -> "RaceAccumulator":
+        metrics = race_metrics(y_true, y_score, groups=groups, k=self.k)
+        scored = ~np.isnan(metrics.winner_rank)
+        self.races += float(scored.sum())
+        self.ndcg_sum += float(metrics.ndcg[scored].sum())
+        self.hit_sum += float(metrics.hit[scored].sum())
+        self.rank_sum += float(metrics.winner_rank[scored].sum())
+        self.logloss_sum += float(metrics.logloss[scored].sum())
+        return self
+
+    def merge(self, other: "RaceAccumulator") -> "RaceAccumulator":
+        self.races += other.races
+        self.ndcg_sum += other.ndcg_sum
+        self.hit_sum += other.hit_sum
+        self.rank_sum += other.rank_sum
+        self.logloss_sum += other.logloss_sum
+        return self
+
+    def result(self) -> Dict[str, float]:
+        races = self.races or float("nan")
+        return {
+            f"ndcg@{self.k}": self.ndcg_sum / races,
+            f"hit@{self.k}": self.hit_sum / races,
+            "winner_rank": self.rank_sum / races,
+            "race_logloss_norm": self.logloss_sum / races,
+        }
+
+
+@dataclass
+class StreamingMetrics:
+    """Every accumulator behind the train/backtest metric dict, fed with the same chunks."""
+
+    auc: AUCAccumulator = field(default_factory=AUCAccumulator)
+    probability: ProbabilityAccumulator = field(default_factory=ProbabilityAccumulator)
+    edge: Optional[EdgeAccumulator] = None
+    race: Optional[RaceAccumulator] = None
+
+    def update(
+        self,
+        y_true: np.ndarray,
+        y_prob: np.ndarray,
+        groups: Optional[Iterable[object]] = None,
+        implied_prob: Optional[np.ndarray] = None,
+    ) -> "StreamingMetrics":
+        self.auc.update(y_true, y_prob)
+        self.probability.update(y_true, y_prob)
+        if implied_prob is not None:
+            self.edge = (self.edge or EdgeAccumulator()).update(y_prob, implied_prob)
+        if groups is not None:
+            self.race = (self.race or RaceAccumulator()).update(y_true, y_prob, groups)
+        return self
+
+    def merge(self, other: "StreamingMetrics") -> "StreamingMetrics":
+        self.auc.merge(other.auc)
+        self.probability.merge(other.probability)
+        if other.edge is not None:
+            self.edge = self.edge.merge(other.edge) if self.edge is not None else other.edge
+        if other.race is not None:
+            self.race = self.race.merge(other.race) if self.race is not None else other.race
+        return self
+
+    @property
+    def rows(self) -> int:
+        return int(self.probability.rows)
+
+    def result(self) -> Dict[str, float]:
+        metrics = {
+            "auc": self.auc.auc(),
+            "pr_auc": self.auc.average_precision(),
+            "brier": self.probability.brier(),
+            "logloss": self.probability.logloss(),
+            "ece": self.probability.ece(),
+        }
+        if self.race is not None:
+            metrics.update(self.race.result())
+        if self.edge is not None:
+            metrics.update(self.edge.result())
+        return metrics
+
+
+def stream_metrics(
+    y_true: np.ndarray,
+    y_prob: np.ndarray,
+    groups: Optional[np.ndarray] = None,
+    implied_prob: Optional[np.ndarray] = None,
+    chunk_rows: int = 1_000_000,
+) -> StreamingMetrics:
+    """Feed aligned arrays (memory maps included) through StreamingMetrics `chunk_rows` at a time.
+
+    Rows of a race must be contiguous; chunk borders move to the next race start so no race is split.
+    """
+    metrics = StreamingMetrics()
+    n = len(y_true)
+    start = 0
+    while start < n:
+        end = min(start + chunk_rows, n)
+        if groups is not None:
+            while end < n and groups[end] == groups[end - 1]:
+                end += 1
+        metrics.update(
+            y_true[start:end],
+            y_prob[start:end],
+            groups[start:end] if groups is not None else None,
+            implied_prob[start:end] if implied_prob is not None else None,
+        )
+        start = end
+    return metrics
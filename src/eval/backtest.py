@@ -3,7 +3,7 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Iterable, List, Tuple
+from typing import Iterable, List, Optional, Tuple
 
 import numpy as np
 import pandas as pd
@@ -14,6 +14,7 @@ class Split:
     train_idx: np.ndarray
     val_idx: np.ndarray
     cutoff: str
+    end: Optional[str] = None
 
 
 def time_based_split(dates: Iterable[str], val_date: str) -> Split:
@@ -33,3 +34,40 @@ def walk_forward_splits(dates: Iterable[str], n_splits: int = 3) -> List[Split]:
         cutoff = sorted_dates[-i]
         splits.append(time_based_split(dates, cutoff))
     return splits
+
+
+PERIODS = {"month": "M", "week": "W"}
+
+
+def expanding_window_splits(
+    dates: Iterable[str],
+    period: str = "month",
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    min_train_days: int = 1,
+) -> List[Split]:
+    """One fold per calendar period: train on every race day before it, test on the period's races.
+
+    Periods before `start`, after `end`, or with fewer than `min_train_days` earlier race days are skipped.
+    """
+    parsed = pd.to_datetime(pd.Series(list(dates)))
+    periods = parsed.dt.to_period(PERIODS[period])
+    race_days = np.sort(parsed.drop_duplicates().values)
+    splits: List[Split] = []
+    for current in sorted(periods.unique()):
+        cutoff = current.start_time
+        if start is not None and current.end_time < pd.Timestamp(start):
+            continue
+        if end is not None and cutoff > pd.Timestamp(end):
+            break
+        if np.searchsorted(race_days, cutoff.to_datetime64()) < min_train_days:
+            continue
+        splits.append(
+            Split(
+                train_idx=np.where(parsed < cutoff)[0],
+                val_idx=np.where(periods == current)[0],
+                cutoff=str(cutoff.date()),
+                end=str(current.end_time.date()),
+            )
+        )
+    return splits
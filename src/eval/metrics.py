@@ -1,18 +1,17 @@
 """Evaluation metrics utilities."""
 from __future__ import annotations
 
+from typing import Dict, Iterable, Optional
+
 import numpy as np
 
-try:  # pragma: no cover
-    from sklearn.metrics import average_precision_score, brier_score_loss, log_loss, roc_auc_score
-except ImportError:  # pragma: no cover
-    average_precision_score = None  # type: ignore
-    brier_score_loss = None  # type: ignore
-    log_loss = None  # type: ignore
-    roc_auc_score = None  # type: ignore
+from models.backends import optional_attr
+
+from .race_metrics import race_metrics
 
 
 def auc_score(y_true: np.ndarray, y_prob: np.ndarray) -> float:
+    roc_auc_score = optional_attr("sklearn.metrics", "roc_auc_score")
     if roc_auc_score is None:
         return float("nan")
     try:
@@ -22,6 +21,7 @@ def auc_score(y_true: np.ndarray, y_prob: np.ndarray) -> float:
 
 
 def pr_auc_score(y_true: np.ndarray, y_prob: np.ndarray) -> float:
+    average_precision_score = optional_attr("sklearn.metrics", "average_precision_score")
     if average_precision_score is None:
         return float("nan")
     try:
@@ -31,12 +31,14 @@ def pr_auc_score(y_true: np.ndarray, y_prob: np.ndarray) -> float:
 
 
 def brier_score(y_true: np.ndarray, y_prob: np.ndarray) -> float:
+    brier_score_loss = optional_attr("sklearn.metrics", "brier_score_loss")
     if brier_score_loss is None:
         return float(np.mean((y_true - y_prob) ** 2))
     return float(brier_score_loss(y_true, y_prob))
 
 
 def log_loss_score(y_true: np.ndarray, y_prob: np.ndarray) -> float:
+    log_loss = optional_attr("sklearn.metrics", "log_loss")
     if log_loss is None:
         eps = 1e-6
         prob = np.clip(y_prob, eps, 1 - eps)
@@ -47,7 +49,10 @@ def log_loss_score(y_true: np.ndarray, y_prob: np.ndarray) -> float:
         return float("nan")
 
 
-def ndcg_at_k(y_true: np.ndarray, y_score: np.ndarray, k: int = 3) -> float:
+def ndcg_at_k(y_true: np.ndarray, y_score: np.ndarray, k: int = 3, groups: Optional[Iterable[object]] = None) -> float:
+    """Mean per-race NDCG@k when `groups` is given; without it the arrays are ranked as a single race."""
+    if groups is not None:
+        return race_metrics(y_true, y_score, groups=groups, k=k).aggregates()[f"ndcg@{k}"]
     order = np.argsort(-y_score)
     y_true_sorted = y_true[order][:k]
     gains = (2 ** y_true_sorted - 1) / np.log2(np.arange(2, k + 2))
@@ -61,35 +66,56 @@ def ndcg_at_k(y_true: np.ndarray, y_score: np.ndarray, k: int = 3) -> float:
     return float(dcg / idcg)
 
 
+def race_log_loss(y_true: np.ndarray, y_prob: np.ndarray) -> float:
+    """Mean -log P(winner) over winning rows; meaningful for probabilities normalized within each race."""
+    winners = np.asarray(y_true) > 0
+    if not np.any(winners):
+        return float("nan")
+    return float(-np.mean(np.log(np.clip(np.asarray(y_prob)[winners], 1e-6, 1.0))))
+
+
 def rmse(y_true: np.ndarray, y_pred: np.ndarray) -> float:
     return float(np.sqrt(np.mean((y_true - y_pred) ** 2)))
 
 
 def expected_calibration_error(y_true: np.ndarray, y_prob: np.ndarray, n_bins: int = 10) -> float:
-    bins = np.linspace(0.0, 1.0, n_bins + 1)
-    bin_ids = np.digitize(y_prob, bins) - 1
-    ece = 0.0
-    for b in range(n_bins):
-        mask = bin_ids == b
-        if not np.any(mask):
-            continue
-        acc = np.mean(y_true[mask])
-        conf = np.mean(y_prob[mask])
-        ece += np.abs(acc - conf) * np.mean(mask)
-    return float(ece)
-
-
-def topk_lift(y_true: np.ndarray, y_prob: np.ndarray, k: int = 3) -> float:
+    y_true = np.asarray(y_true, dtype=np.float64)
+    y_prob = np.asarray(y_prob, dtype=np.float64)
+    if len(y_prob) == 0:
+        return 0.0
+    # Equal-width bins; a probability of exactly 1.0 belongs to the last bin.
+    bin_ids = np.clip((y_prob * n_bins).astype(np.int64), 0, n_bins - 1)
+    counts = np.bincount(bin_ids, minlength=n_bins)
+    gap = np.bincount(bin_ids, weights=y_true, minlength=n_bins) - np.bincount(bin_ids, weights=y_prob, minlength=n_bins)
+    return float(np.abs(gap).sum() / len(y_prob)) if counts.any() else 0.0
+
+
+def topk_lift(y_true: np.ndarray, y_prob: np.ndarray, k: int = 3, groups: Optional[Iterable[object]] = None) -> float:
+    """Win rate of each race's top-k runners over the overall win rate (the whole array is one race without `groups`)."""
     if len(y_true) == 0:
         return float("nan")
     baseline = float(np.mean(y_true))
     if baseline == 0:
         return float("nan")
+    if groups is not None:
+        metrics = race_metrics(y_true, y_prob, groups=groups, k=k)
+        return float(metrics.top_wins.sum() / np.minimum(metrics.field_size, k).sum()) / baseline
     top_idx = np.argsort(-y_prob)[:k]
     top_rate = float(np.mean(y_true[top_idx]))
     return top_rate / baseline
 
 
+def fidelity_report(y_true: np.ndarray, teacher: np.ndarray, student: np.ndarray) -> Dict[str, float]:
+    """How closely a distilled student tracks its teacher: probability deviations and student-minus-teacher metric deltas."""
+    deviation = np.abs(np.asarray(student, dtype=np.float64) - np.asarray(teacher, dtype=np.float64))
+    report = {"max_abs_dev": float(deviation.max()) if len(deviation) else 0.0, "mean_abs_dev": float(deviation.mean()) if len(deviation) else 0.0}
+    for name, metric in (("auc", auc_score), ("logloss", log_loss_score), ("brier", brier_score)):
+        report[f"{name}_teacher"] = metric(y_true, teacher)
+        report[f"{name}_student"] = metric(y_true, student)
+        report[f"{name}_delta"] = report[f"{name}_student"] - report[f"{name}_teacher"]
+    return report
+
+
 def edge_statistics(win_prob: np.ndarray, implied_prob: np.ndarray) -> Dict[str, float]:
     diff = win_prob - np.nan_to_num(implied_prob, nan=0.0)
     return {
@@ -0,0 +1,110 @@
+"""Race-grouped ranking metrics over a flat runner array, computed with segmented array operations."""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+def race_offsets(groups: Iterable[object]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Stable permutation that makes every race contiguous, the race start offsets (n_races + 1) and race ids."""
+    codes, race_ids = pd.factorize(np.asarray(groups), sort=False)
+    order = np.argsort(codes, kind="stable")
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(race_ids)))])
+    return order, offsets, np.asarray(race_ids)
+
+
+@dataclass
+class RaceMetrics:
+    """Per-race arrays (NaN for races without a winner) and their race-weighted aggregates."""
+
+    k: int
+    field_size: np.ndarray
+    top_wins: np.ndarray
+    ndcg: np.ndarray
+    hit: np.ndarray
+    winner_rank: np.ndarray
+    logloss: np.ndarray
+    race_ids: Optional[np.ndarray] = None
+
+    def aggregates(self) -> Dict[str, float]:
+        scored = ~np.isnan(self.winner_rank)
+        if not scored.any():
+            nan = float("nan")
+            return {f"ndcg@{self.k}": nan, f"hit@{self.k}": nan, "winner_rank": nan, "race_logloss_norm": nan, "races": 0}
+        return {
+            f"ndcg@{self.k}": float(self.ndcg[scored].mean()),
+            f"hit@{self.k}": float(self.hit[scored].mean()),
+            "winner_rank": float(self.winner_rank[scored].mean()),
+            "race_logloss_norm": float(self.logloss[scored].mean()),
+            "races": int(scored.sum()),
+        }
+
+
+def _positions(race: np.ndarray, offsets: np.ndarray, key: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Rows sorted by race, then by descending `key` (ties keep row order), and each sorted row's 0-based place."""
+    order = np.lexsort((-key, race))
+    return order, np.arange(len(order)) - offsets[race[order]]
+
+
+def race_metrics(
+    y_true: np.ndarray,
+    y_score: np.ndarray,
+    groups: Optional[Iterable[object]] = None,
+    offsets: Optional[np.ndarray] = None,
+    k: int = 3,
+) -> RaceMetrics:
+    """NDCG@k, top-k hit rate, winner rank and logloss of every race in one pass over the flat arrays.
+
+    Races are given either as per-row `groups` (any order) or as `offsets` into rows already contiguous by race.
+    The race logloss renormalizes scores within the race, so it is -log P(winner) for independent win
+    probabilities as well as for race-normalized ones.
+    """
+    y_true = np.asarray(y_true, dtype=np.float64)
+    y_score = np.asarray(y_score, dtype=np.float64)
+    race_ids = None
+    if offsets is None:
+        if groups is None:
+            raise ValueError("race_metrics için groups veya offsets gerekli")
+        order, offsets, race_ids = race_offsets(groups)
+        y_true, y_score = y_true[order], y_score[order]
+    offsets = np.asarray(offsets, dtype=np.int64)
+    sizes = np.diff(offsets)
+    n_races = len(sizes)
+    race = np.repeat(np.arange(n_races), sizes)
+    discount = 1.0 / np.log2(np.arange(2, max(int(sizes.max(initial=0)), 1) + 2))
+
+    ranked, place = _positions(race, offsets, y_score)
+    top = place < k
+    gains = 2.0 ** y_true[ranked] - 1.0
+    dcg = np.bincount(race[ranked][top], weights=(gains * discount[place])[top], minlength=n_races)
+    ideal_ranked, ideal_place = _positions(race, offsets, y_true)
+    ideal_top = ideal_place < k
+    ideal_gains = 2.0 ** y_true[ideal_ranked] - 1.0
+    idcg = np.bincount(race[ideal_ranked][ideal_top], weights=(ideal_gains * discount[ideal_place])[ideal_top], minlength=n_races)
+
+    winner = y_true[ranked] > 0
+    has_winner = np.bincount(race, weights=(y_true > 0).astype(np.float64), minlength=n_races) > 0
+    top_wins = np.bincount(race[ranked], weights=(winner & top).astype(np.float64), minlength=n_races)
+    # Best-placed winner per race; rows are ordered by race so a segmented minimum gives it directly.
+    winner_place = np.where(winner, place, np.iinfo(np.int64).max)
+    first_winner = np.minimum.reduceat(winner_place, offsets[:-1]) if n_races else np.zeros(0, dtype=np.int64)
+
+    totals = np.bincount(race, weights=y_score, minlength=n_races)
+    winner_mass = np.bincount(race, weights=np.where(y_true > 0, y_score, 0.0), minlength=n_races)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        share = np.where(totals > 0, winner_mass / totals, 0.0)
+        ndcg = np.where(idcg > 0, dcg / idcg, np.nan)
+    nan = np.full(n_races, np.nan)
+    return RaceMetrics(
+        k=k,
+        field_size=sizes,
+        top_wins=top_wins,
+        ndcg=ndcg,
+        hit=np.where(has_winner, (top_wins > 0).astype(np.float64), nan),
+        winner_rank=np.where(has_winner, first_winner + 1.0, nan),
+        logloss=np.where(has_winner, -np.log(np.clip(share, 1e-6, 1.0)), nan),
+        race_ids=race_ids,
+    )
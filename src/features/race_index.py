@@ -0,0 +1,85 @@
+"""Race grouping helpers: offsets, padding and segmented layouts per race_uid."""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Iterable, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+@dataclass
+class RaceIndex:
+    codes: np.ndarray
+    order: np.ndarray
+    offsets: np.ndarray
+
+    @classmethod
+    def from_groups(cls, groups: Iterable[object] | None, n_rows: int | None = None) -> "RaceIndex":
+        if groups is None:
+            if n_rows is None:
+                raise ValueError("groups veya n_rows gerekli")
+            codes = np.arange(n_rows, dtype=np.int64)
+        else:
+            values = groups if isinstance(groups, (np.ndarray, pd.Series)) else np.asarray(list(groups), dtype=object)
+            codes, _ = pd.factorize(values, sort=False)
+            codes = codes.astype(np.int64)
+        order = np.argsort(codes, kind="stable")
+        sizes = np.bincount(codes, minlength=int(codes.max()) + 1 if len(codes) else 0)
+        offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        return cls(codes=codes, order=order, offsets=offsets)
+
+    @property
+    def n_rows(self) -> int:
+        return int(len(self.codes))
+
+    @property
+    def n_races(self) -> int:
+        return int(len(self.offsets) - 1)
+
+    @property
+    def sizes(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    @property
+    def max_field(self) -> int:
+        return int(self.sizes.max()) if self.n_races else 0
+
+    @property
+    def is_contiguous(self) -> bool:
+        """True when rows of each race are already adjacent and in first-seen race order."""
+        return bool(np.all(self.order == np.arange(self.n_rows)))
+
+    def slots(self) -> np.ndarray:
+        """Position of every row inside its race, in original row order."""
+        slots = np.empty(self.n_rows, dtype=np.int64)
+        slots[self.order] = np.arange(self.n_rows) - np.repeat(self.offsets[:-1], self.sizes)
+        return slots
+
+    def row_matrix(self, races: np.ndarray | None = None) -> np.ndarray:
+        """`[races, max_field]` matrix of row ids, padded with -1."""
+        races = np.arange(self.n_races) if races is None else np.asarray(races)
+        sizes = self.sizes[races]
+        width = int(sizes.max()) if len(sizes) else 0
+        cols = np.arange(width)
+        valid = cols[None, :] < sizes[:, None]
+        positions = self.offsets[races][:, None] + cols[None, :]
+        matrix = np.full((len(races), width), -1, dtype=np.int64)
+        matrix[valid] = self.order[positions[valid]]
+        return matrix
+
+    def pad(self, values: np.ndarray, races: np.ndarray | None = None, fill: float = 0.0) -> Tuple[np.ndarray, np.ndarray]:
+        """Gather `values` into `[races, max_field, ...]` with a boolean runner mask."""
+        rows = self.row_matrix(races)
+        mask = rows >= 0
+        padded = np.asarray(values)[np.where(mask, rows, 0)]
+        padded[~mask] = fill
+        return padded, mask
+
+    def unpad(self, padded: np.ndarray, races: np.ndarray | None = None) -> np.ndarray:
+        """Inverse of `pad` for per-runner outputs; returns values in original row order."""
+        rows = self.row_matrix(races)
+        mask = rows >= 0
+        out = np.empty((self.n_rows,) + padded.shape[2:], dtype=padded.dtype)
+        out[rows[mask]] = padded[mask]
+        return out
@@ -0,0 +1,102 @@
+"""Deferred imports for optional model backends (xgboost, lightgbm, catboost, torch, sklearn)."""
+from __future__ import annotations
+
+import importlib
+import pickle
+from pathlib import Path
+from typing import Any, Callable, ClassVar, Dict, Optional, Tuple
+
+_MISSING = object()
+_CACHE: Dict[str, Any] = {}
+
+BACKEND_MODULES = ("xgboost", "lightgbm", "catboost", "torch", "sklearn")
+
+
+def optional_import(name: str) -> Optional[Any]:
+    """Import `name` on first use; returns None when the backend is not installed."""
+    module = _CACHE.get(name, _MISSING)
+    if module is _MISSING:
+        try:
+            module = importlib.import_module(name)
+        except ImportError:
+            module = None
+        _CACHE[name] = module
+    return module
+
+
+def optional_attr(module_name: str, attr: str) -> Optional[Any]:
+    module = optional_import(module_name)
+    return getattr(module, attr, None) if module is not None else None
+
+
+class DeferredModel:
+    """Pickled backend model kept as bytes until first use, so unpickling an artifact imports nothing heavy."""
+
+    __slots__ = ("payload",)
+
+    def __init__(self, payload: bytes):
+        self.payload = payload
+
+    def __getstate__(self) -> Tuple[bytes]:
+        return (self.payload,)
+
+    def __setstate__(self, state: Tuple[bytes]) -> None:
+        (self.payload,) = state
+
+    def load(self) -> Any:
+        return pickle.loads(self.payload)
+
+
+class DeferredFile:
+    """Model stored in a native file (bundle component), read by `loader` on first use."""
+
+    __slots__ = ("path", "loader", "options")
+
+    def __init__(self, path: Path | str, loader: Callable[..., Any], options: Optional[Dict[str, Any]] = None):
+        self.path = str(path)
+        self.loader = loader
+        self.options = options or {}
+
+    def load(self) -> Any:
+        return self.loader(self.path, **self.options)
+
+
+def load_pickle_file(path: str) -> Any:
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+class DeferredModelMixin:
+    _transient_fields: ClassVar[Tuple[str, ...]] = ("_compiled",)
+    _state_fields: ClassVar[Tuple[str, ...]] = ("params", "early_stopping_rounds", "time_budget_s", "best_iteration", "backend")
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        for name in self._transient_fields:
+            state.pop(name, None)
+        model = state.get("model")
+        if isinstance(model, DeferredFile):
+            model = model.load()
+        if model is not None and not isinstance(model, DeferredModel):
+            state["model"] = DeferredModel(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL))
+        return state
+
+    def bundle_state(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self._state_fields}
+
+    def save_pickle_component(self, model: Any, directory: Path, stem: str) -> Dict[str, Any]:
+        """Fallback bundle entry for models without a native format (sklearn estimators)."""
+        path = directory / f"{stem}.pkl"
+        with open(path, "wb") as f:
+            pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return {"format": "pickle", "files": {"model": path.name}, "state": self.bundle_state()}
+
+    def resolved_model(self) -> Any:
+        if isinstance(self.model, (DeferredModel, DeferredFile)):  # type: ignore[attr-defined]
+            placeholder = self.model  # type: ignore[attr-defined]
+            self.model = placeholder.load()
+            cached = getattr(self, "_compiled", None)
+            if cached is not None and cached[0] is placeholder:
+                # Trees compiled from the stored model still describe it once it is loaded.
+                self._compiled = (self.model, *cached[1:])
+        return self.model  # type: ignore[attr-defined]
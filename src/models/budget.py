@@ -0,0 +1,52 @@
+"""Early stopping and wall-clock budget helpers shared by model wrappers."""
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Optional
+
+
+DEFAULT_PATIENCE = 50
+DEFAULT_MLP_PATIENCE = 10
+
+
+@dataclass
+class Deadline:
+    budget_s: Optional[float] = None
+    started_at: float = field(default_factory=time.perf_counter)
+
+    def expired(self) -> bool:
+        if self.budget_s is None:
+            return False
+        return time.perf_counter() - self.started_at >= self.budget_s
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started_at
+
+
+@dataclass
+class PatienceTracker:
+    patience: int
+    best_score: float = float("inf")
+    best_iteration: int = -1
+    rounds_without_improvement: int = 0
+
+    def update(self, iteration: int, score: float) -> bool:
+        """Record a validation loss; returns True once patience is exhausted."""
+        if score < self.best_score:
+            self.best_score = score
+            self.best_iteration = iteration
+            self.rounds_without_improvement = 0
+            return False
+        self.rounds_without_improvement += 1
+        return self.rounds_without_improvement >= self.patience
+
+
+def parse_time_budgets(entries: Iterable[str] | None) -> Dict[str, float]:
+    budgets: Dict[str, float] = {}
+    for entry in entries or []:
+        name, _, value = entry.partition("=")
+        if not name or not value:
+            raise ValueError(f"Geçersiz süre bütçesi: {entry!r} (beklenen: model=saniye)")
+        budgets[name.strip()] = float(value)
+    return budgets
@@ -0,0 +1,196 @@
+"""Versioned artifact bundle: manifest.json + native model files, loaded selectively."""
+from __future__ import annotations
+
+import hashlib
+import json
+import shutil
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+
+from .calibrate import calibrator_from_native
+from .catb import CatBoostWrapper
+from .distill import DistilledModel
+from .ensemble import AnytimeEnsemble, ContextGatedEnsemble
+from .lgbm import LGBMWrapper
+from .multitarget import TargetModels
+from .online import OnlineState
+from .race_logit import ConditionalLogit
+from .ranking import CatBoostRankWrapper, LGBMRankWrapper, XGBRankWrapper
+from .set_mlp import SetMLPWrapper
+from .shards import ShardSet
+from .tree_engine import CompiledTrees, NotCompilable, compile_wrapper, is_compilable, seed_compiled
+from .xgb import XGBWrapper
+
+BUNDLE_FORMAT = "tjk-prophet-bundle"
+BUNDLE_FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+# Manifest sections whose files are checksummed on load; cli.predict --fast reads only the second set.
+FULL_COMPONENTS = ("ensemble", "calibrator", "anytime", "race_combiner", "targets", "distilled", "online")
+FAST_COMPONENTS = ("race_combiner", "targets", "distilled")
+
+MODEL_CLASSES = {
+    cls.__name__: cls
+    for cls in (XGBWrapper, LGBMWrapper, CatBoostWrapper, SetMLPWrapper, XGBRankWrapper, LGBMRankWrapper, CatBoostRankWrapper)
+}
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_bundle(path: Path) -> bool:
+    return path.is_dir() and (path / MANIFEST_NAME).exists()
+
+
+def save_bundle(path: Path, artifact: Dict[str, Any]) -> Dict[str, Any]:
+    """Write `artifact` as a bundle directory; the previous bundle is replaced only after every file is written."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    staging = Path(tempfile.mkdtemp(prefix=f".{path.name}.", dir=path.parent))
+    try:
+        models: Dict[str, Any] = {}
+        for name, model in artifact["models"].items():
+            if type(model).__name__ not in MODEL_CLASSES:
+                raise TypeError(f"Bundle için desteklenmeyen model sınıfı: {type(model).__name__}")
+            entry = model.save_native(staging, name)
+            entry["class"] = type(model).__name__
+            if is_compilable(model):
+                try:
+                    compiled = compile_wrapper(model)
+                except NotCompilable:
+                    compiled = None
+                if compiled is not None:
+                    entry["compiled"] = compiled.save(staging / f"{name}.trees.npz")
+                    entry["files"]["compiled"] = f"{name}.trees.npz"
+            models[name] = entry
+        manifest = {
+            "format": BUNDLE_FORMAT,
+            "format_version": BUNDLE_FORMAT_VERSION,
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "feature_columns": list(artifact["feature_columns"]),
+            "metrics": artifact.get("metrics", {}),
+            "meta": artifact.get("meta", {}),
+            "models": models,
+            "ensemble": artifact["ensemble"].save_native(staging),
+            "calibrator": artifact["calibrator"].save_native(staging),
+        }
+        if artifact.get("anytime") is not None:
+            manifest["anytime"] = artifact["anytime"].save_native(staging)
+        if artifact.get("race_combiner") is not None:
+            manifest["race_combiner"] = artifact["race_combiner"].save_native(staging)
+        if artifact.get("targets") is not None:
+            manifest["targets"] = artifact["targets"].save_native(staging)
+        if artifact.get("distilled") is not None:
+            manifest["distilled"] = artifact["distilled"].save_native(staging)
+        if artifact.get("online") is not None:
+            manifest["online"] = artifact["online"].save_native(staging)
+        if artifact.get("shards") is not None:
+            # Each shard is a complete bundle of its own under shards/, verified when it is loaded.
+            manifest["shards"] = artifact["shards"].save_native(staging)
+        manifest["files"] = {
+            file.name: {"sha256": _sha256(file), "bytes": file.stat().st_size}
+            for file in sorted(staging.iterdir())
+            if file.is_file()
+        }
+        (staging / MANIFEST_NAME).write_text(json.dumps(manifest, indent=2, ensure_ascii=False, default=str))
+        if path.exists():
+            shutil.rmtree(path)
+        staging.rename(path)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return manifest
+
+
+def read_manifest(path: Path) -> Dict[str, Any]:
+    manifest = json.loads((Path(path) / MANIFEST_NAME).read_text())
+    if manifest.get("format") != BUNDLE_FORMAT:
+        raise ValueError(f"{path} bir model bundle'ı değil")
+    version = manifest.get("format_version")
+    if version != BUNDLE_FORMAT_VERSION:
+        raise ValueError(f"Desteklenmeyen bundle sürümü: {version} (beklenen {BUNDLE_FORMAT_VERSION})")
+    return manifest
+
+
+def _entry_files(entry: Dict[str, Any], runtime: str = "artifact", engine: str = "native", with_compiled: bool = False) -> Iterable[str]:
+    files = dict(entry.get("files", {}))
+    if "compiled" in files:
+        if engine == "compiled":
+            return [files["compiled"]]
+        if not with_compiled:
+            files.pop("compiled")
+    if entry.get("class") == SetMLPWrapper.__name__:
+        wanted = entry["state"].get("runtime", "eager") if runtime == "artifact" else runtime
+        if wanted == "torchscript" and "torchscript" in files:
+            files.pop("model", None)
+        else:
+            files.pop("torchscript", None)
+    return files.values()
+
+
+def load_bundle(
+    path: Path,
+    models: Optional[Iterable[str]] = None,
+    mlp_runtime: str = "artifact",
+    verify: bool = True,
+    engine: str = "native",
+    fast: bool = False,
+    with_compiled: bool = False,
+) -> Dict[str, Any]:
+    """Load a bundle into the artifact dict shape; only the requested members (and MLP runtime) are read.
+
+    With engine="compiled" tree members come back as CompiledTrees and no boosting library is imported.
+    With fast=True only the distilled student, race combiner and target models are read; members, gates,
+    calibrator, shards and online state come back empty.
+    With with_compiled=True native tree members also get their shipped compiled trees as the compiled_view cache,
+    so the staged uncertainty source traverses them without compiling the boosters first.
+    """
+    path = Path(path)
+    manifest = read_manifest(path)
+    wanted = set() if fast else set(models) if models is not None else None
+    entries = {name: entry for name, entry in manifest["models"].items() if wanted is None or name in wanted}
+    if wanted is not None and wanted - set(entries):
+        raise KeyError(f"Bundle içinde olmayan modeller: {sorted(wanted - set(entries))}")
+
+    if verify:
+        needed = [name for entry in entries.values() for name in _entry_files(entry, mlp_runtime, engine, with_compiled)]
+        components = FAST_COMPONENTS if fast else FULL_COMPONENTS
+        for component in components:
+            needed += list(manifest.get(component, {}).get("files", {}).values())
+        for name in needed:
+            expected = manifest["files"][name]["sha256"]
+            if _sha256(path / name) != expected:
+                raise ValueError(f"Bundle dosyası bozuk (checksum uyuşmuyor): {name}")
+
+    loaded: Dict[str, Any] = {}
+    for name, entry in entries.items():
+        cls = MODEL_CLASSES[entry["class"]]
+        if engine == "compiled" and "compiled" in entry:
+            loaded[name] = CompiledTrees.load(path / entry["files"]["compiled"], entry["compiled"])
+        elif cls is SetMLPWrapper:
+            loaded[name] = cls.from_native(path, entry, runtime=mlp_runtime)
+        else:
+            loaded[name] = cls.from_native(path, entry)
+            if with_compiled and "compiled" in entry:
+                seed_compiled(loaded[name], CompiledTrees.load(path / entry["files"]["compiled"], entry["compiled"]))
+    return {
+        "feature_columns": manifest["feature_columns"],
+        "models": loaded,
+        "ensemble": None if fast else ContextGatedEnsemble.from_native(path, manifest["ensemble"]),
+        "anytime": AnytimeEnsemble.from_native(path, manifest["anytime"]) if "anytime" in manifest and not fast else None,
+        "calibrator": None if fast else calibrator_from_native(path, manifest["calibrator"]),
+        "race_combiner": ConditionalLogit.from_native(path, manifest["race_combiner"]) if "race_combiner" in manifest else None,
+        "targets": TargetModels.from_native(path, manifest["targets"]) if "targets" in manifest else None,
+        "distilled": DistilledModel.from_native(path, manifest["distilled"]) if "distilled" in manifest else None,
+        "shards": ShardSet.from_native(path, manifest["shards"]) if "shards" in manifest and not fast else None,
+        "online": OnlineState.from_native(path, manifest["online"]) if "online" in manifest and not fast else None,
+        "metrics": manifest.get("metrics", {}),
+        "meta": manifest.get("meta", {}),
+        "bundle": {"path": str(path), "format_version": manifest["format_version"], "created_at": manifest["created_at"]},
+    }
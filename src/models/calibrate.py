@@ -1,16 +1,25 @@
 """Calibration utilities."""
 from __future__ import annotations
 
-import math
+import pickle
 from dataclasses import dataclass
-from typing import Dict, Literal, Optional
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Literal, Optional, Tuple
 
 import numpy as np
 
-try:  # pragma: no cover
-    from sklearn.isotonic import IsotonicRegression
-except ImportError:  # pragma: no cover
-    IsotonicRegression = None  # type: ignore
+from .backends import DeferredModel
+
+
+@dataclass
+class IsotonicBreakpoints:
+    """Piecewise-linear isotonic fit; equivalent to IsotonicRegression(out_of_bounds="clip").predict."""
+
+    x: np.ndarray
+    y: np.ndarray
+
+    def predict(self, probs: np.ndarray) -> np.ndarray:
+        return np.interp(probs, self.x, self.y)
 
 
 @dataclass
@@ -18,44 +27,224 @@ class CalibrationResult:
     method: Literal["temperature", "isotonic"]
     param: Optional[float | object]
 
-    def apply(self, probs: np.ndarray) -> np.ndarray:
+    def __getstate__(self) -> Dict[str, object]:
+        state = self.__dict__.copy()
+        if self.method == "isotonic" and self.param is not None and not isinstance(self.param, (DeferredModel, IsotonicBreakpoints)):
+            state["param"] = DeferredModel(pickle.dumps(self.param, protocol=pickle.HIGHEST_PROTOCOL))
+        return state
+
+    def apply(self, probs: np.ndarray, keys: Iterable[object] | None = None) -> np.ndarray:
+        if isinstance(self.param, DeferredModel):
+            self.param = self.param.load()
         if self.method == "temperature":
             temp = float(self.param or 1.0)
-            logits = np.log(np.clip(probs, 1e-6, 1 - 1e-6) / np.clip(1 - probs, 1e-6, 1))
-            logits = logits / max(temp, 1e-6)
+            logits = logit(probs) / max(temp, 1e-6)
             calibrated = 1 / (1 + np.exp(-logits))
             return calibrated
-        elif self.method == "isotonic" and isinstance(self.param, IsotonicRegression):
+        elif self.method == "isotonic" and hasattr(self.param, "predict"):
             model = self.param
             flat = probs.reshape(-1)
             calibrated = model.predict(flat)
             return calibrated.reshape(probs.shape)
         return probs
 
+    def save_native(self, directory: Path, stem: str = "calibrator") -> Dict[str, Any]:
+        if self.method != "isotonic":
+            return {"method": self.method, "param": float(self.param or 1.0)}
+        if isinstance(self.param, DeferredModel):
+            self.param = self.param.load()
+        if isinstance(self.param, IsotonicBreakpoints):
+            x, y = self.param.x, self.param.y
+        else:
+            x, y = self.param.X_thresholds_, self.param.y_thresholds_
+        np.save(directory / f"{stem}.x.npy", np.asarray(x, dtype=np.float64))
+        np.save(directory / f"{stem}.y.npy", np.asarray(y, dtype=np.float64))
+        return {"method": "isotonic", "param": None, "files": {"x": f"{stem}.x.npy", "y": f"{stem}.y.npy"}}
+
+    @classmethod
+    def from_native(cls, directory: Path, entry: Dict[str, Any]) -> "CalibrationResult":
+        if entry["method"] != "isotonic":
+            return cls(method=entry["method"], param=entry.get("param"))
+        x = np.load(directory / entry["files"]["x"], mmap_mode="r")
+        y = np.load(directory / entry["files"]["y"], mmap_mode="r")
+        return cls(method="isotonic", param=IsotonicBreakpoints(x=x, y=y))
+
+
+def logit(probs: np.ndarray) -> np.ndarray:
+    return np.log(np.clip(probs, 1e-6, 1 - 1e-6) / np.clip(1 - probs, 1e-6, 1))
+
+
+def sigmoid(values: np.ndarray) -> np.ndarray:
+    return 1.0 / (1.0 + np.exp(-values))
+
+
+TEMPERATURE_BOUNDS = (0.05, 20.0)
+
+
+def _fit_inverse_temperature(logits: np.ndarray, targets: np.ndarray, max_iter: int = 50, tol: float = 1e-10) -> float:
+    """Newton's method on a = 1/T for the mean logloss of sigmoid(a * z); convex in a, so a few steps suffice.
+    Separable data drives a to infinity, hence the clamp to TEMPERATURE_BOUNDS."""
+    low, high = 1.0 / TEMPERATURE_BOUNDS[1], 1.0 / TEMPERATURE_BOUNDS[0]
+    a = 1.0
+    for _ in range(max_iter):
+        scaled = 1 / (1 + np.exp(-a * logits))
+        grad = float(np.mean((scaled - targets) * logits))
+        hess = float(np.mean(scaled * (1 - scaled) * logits**2))
+        if hess <= 1e-12:
+            break
+        updated = min(max(a - grad / hess, low), high)
+        if abs(updated - a) < tol:
+            a = updated
+            break
+        a = updated
+    return a
+
 
 def fit_temperature_scaling(probs: np.ndarray, targets: np.ndarray) -> CalibrationResult:
-    temps = np.linspace(0.5, 3.0, 26)
-    best_temp = 1.0
-    best_loss = float("inf")
-    for temp in temps:
-        logits = np.log(np.clip(probs, 1e-6, 1 - 1e-6) / np.clip(1 - probs, 1e-6, 1))
-        scaled = 1 / (1 + np.exp(-logits / temp))
-        loss = -np.mean(targets * np.log(np.clip(scaled, 1e-6, 1)) + (1 - targets) * np.log(np.clip(1 - scaled, 1e-6, 1)))
-        if loss < best_loss:
-            best_loss = loss
-            best_temp = temp
-    return CalibrationResult(method="temperature", param=best_temp)
+    logits = logit(np.asarray(probs, dtype=np.float64))
+    a = _fit_inverse_temperature(logits, np.asarray(targets, dtype=np.float64))
+    return CalibrationResult(method="temperature", param=float(1.0 / a))
+
+
+def isotonic_breakpoints(probs: np.ndarray, targets: np.ndarray, weights: np.ndarray | None = None) -> IsotonicBreakpoints:
+    """Pool-adjacent-violators on the distinct inputs; only the two ends of each constant block are kept.
+
+    `weights` lets a row stand for several observations (e.g. a histogram bin's mean input and rate).
+    """
+    x, inverse = np.unique(np.asarray(probs, dtype=np.float64), return_inverse=True)
+    row_weight = np.ones(len(inverse)) if weights is None else np.asarray(weights, dtype=np.float64)
+    weight = np.bincount(inverse, weights=row_weight)
+    total = np.bincount(inverse, weights=np.asarray(targets, dtype=np.float64) * row_weight)
+    block_sum: list = []
+    block_weight: list = []
+    block_end: list = []
+    for i in range(len(x)):
+        s_, w_ = total[i], weight[i]
+        while block_sum and block_sum[-1] / block_weight[-1] >= s_ / w_:
+            s_ += block_sum.pop()
+            w_ += block_weight.pop()
+            block_end.pop()
+        block_sum.append(s_)
+        block_weight.append(w_)
+        block_end.append(i)
+    values = np.asarray(block_sum) / np.asarray(block_weight)
+    ends = np.asarray(block_end)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    bx = np.column_stack([x[starts], x[ends]]).ravel()
+    by = np.repeat(values, 2)
+    keep = np.concatenate([[True], bx[1:] != bx[:-1]])
+    return IsotonicBreakpoints(x=bx[keep], y=by[keep])
 
 
 def fit_isotonic(probs: np.ndarray, targets: np.ndarray) -> CalibrationResult:
-    if IsotonicRegression is None:
-        return CalibrationResult(method="temperature", param=1.0)
-    iso = IsotonicRegression(out_of_bounds="clip")
-    iso.fit(probs, targets)
-    return CalibrationResult(method="isotonic", param=iso)
+    return CalibrationResult(method="isotonic", param=isotonic_breakpoints(probs, targets))
+
+
+@dataclass
+class ContextCalibrator:
+    """One calibrator per context key (gate_context_key, hipodrom, ...) plus a global fallback at code 0.
+
+    Temperature: per-row 1/T gathered by code. Isotonic: every context's breakpoints are shifted to
+    [2k, 2k + 1] and concatenated, so the whole card is calibrated by one np.interp(p + 2 * code).
+    """
+
+    method: Literal["temperature", "isotonic"]
+    by: str
+    keys: List[str]
+    inverse_temperature: Optional[np.ndarray] = None
+    x: Optional[np.ndarray] = None
+    y: Optional[np.ndarray] = None
+    counts: Optional[Dict[str, int]] = None
+
+    @property
+    def param(self) -> None:
+        return None
+
+    def codes(self, keys: Iterable[object] | None, n_rows: int) -> np.ndarray:
+        if keys is None:
+            return np.zeros(n_rows, dtype=np.int64)
+        lookup = {key: code for code, key in enumerate(self.keys, start=1)}
+        return np.fromiter((lookup.get(str(key), 0) for key in keys), dtype=np.int64, count=n_rows)
+
+    def apply(self, probs: np.ndarray, keys: Iterable[object] | None = None) -> np.ndarray:
+        codes = self.codes(keys, len(probs))
+        if self.method == "temperature":
+            return 1 / (1 + np.exp(-logit(probs) * self.inverse_temperature[codes]))
+        return np.interp(np.clip(probs, 0.0, 1.0) + 2.0 * codes, self.x, self.y)
+
+    def save_native(self, directory: Path, stem: str = "calibrator") -> Dict[str, Any]:
+        entry: Dict[str, Any] = {"method": "context", "base_method": self.method, "by": self.by, "keys": self.keys, "counts": self.counts}
+        arrays = {"inverse_temperature": self.inverse_temperature} if self.method == "temperature" else {"x": self.x, "y": self.y}
+        entry["files"] = {}
+        for name, array in arrays.items():
+            np.save(directory / f"{stem}.{name}.npy", np.asarray(array, dtype=np.float64))
+            entry["files"][name] = f"{stem}.{name}.npy"
+        return entry
+
+    @classmethod
+    def from_native(cls, directory: Path, entry: Dict[str, Any]) -> "ContextCalibrator":
+        arrays = {name: np.load(directory / file, mmap_mode="r") for name, file in entry["files"].items()}
+        return cls(method=entry["base_method"], by=entry["by"], keys=list(entry["keys"]), counts=entry.get("counts"), **arrays)
+
+
+def shifted_breakpoints(fits: List[IsotonicBreakpoints]) -> Tuple[np.ndarray, np.ndarray]:
+    xs, ys = [], []
+    for code, fit in enumerate(fits):
+        x, y = np.asarray(fit.x), np.asarray(fit.y)
+        # Pin both ends of [0, 1] so a query never interpolates into the neighbouring context's block.
+        if x[0] > 0.0:
+            x, y = np.concatenate([[0.0], x]), np.concatenate([[y[0]], y])
+        if x[-1] < 1.0:
+            x, y = np.concatenate([x, [1.0]]), np.concatenate([y, [y[-1]]])
+        xs.append(x + 2.0 * code)
+        ys.append(y)
+    return np.concatenate(xs), np.concatenate(ys)
+
+
+def fit_context_calibrator(
+    probs: np.ndarray,
+    targets: np.ndarray,
+    keys: Iterable[object],
+    by: str,
+    method: Literal["temperature", "isotonic"],
+    min_count: int = 200,
+) -> ContextCalibrator:
+    """Per-key fits for keys with at least `min_count` rows and both outcomes; the rest use the global fit."""
+    probs = np.asarray(probs, dtype=np.float64)
+    targets = np.asarray(targets, dtype=np.float64)
+    labels = np.asarray([str(key) for key in keys], dtype=object)
+    uniques, inverse, counts = np.unique(labels, return_inverse=True, return_counts=True)
+    positives = np.bincount(inverse, weights=targets, minlength=len(uniques))
+    eligible = [i for i in range(len(uniques)) if counts[i] >= min_count and 0 < positives[i] < counts[i]]
+    kept = [str(uniques[i]) for i in eligible]
+    groups = [np.arange(len(probs))] + [np.where(inverse == i)[0] for i in eligible]
+    calibrator = ContextCalibrator(method=method, by=by, keys=kept, counts={str(uniques[i]): int(counts[i]) for i in eligible})
+    if method == "temperature":
+        logits = logit(probs)
+        calibrator.inverse_temperature = np.array([_fit_inverse_temperature(logits[rows], targets[rows]) for rows in groups])
+    else:
+        calibrator.x, calibrator.y = shifted_breakpoints([isotonic_breakpoints(probs[rows], targets[rows]) for rows in groups])
+    return calibrator
+
+
+def calibrator_from_native(directory: Path, entry: Dict[str, Any]) -> CalibrationResult | ContextCalibrator:
+    if entry["method"] == "context":
+        return ContextCalibrator.from_native(directory, entry)
+    return CalibrationResult.from_native(directory, entry)
 
 
-def choose_best_calibrator(probs: np.ndarray, targets: np.ndarray) -> CalibrationResult:
+def choose_best_calibrator(
+    probs: np.ndarray,
+    targets: np.ndarray,
+    keys: Iterable[object] | None = None,
+    by: Optional[str] = None,
+    min_count: int = 200,
+) -> CalibrationResult | ContextCalibrator:
+    if keys is not None and by:
+        keys = list(keys)
+        candidates = [fit_context_calibrator(probs, targets, keys, by, method, min_count) for method in ("temperature", "isotonic")]
+        losses = [_brier(candidate.apply(probs, keys), targets) for candidate in candidates]
+        return candidates[int(np.argmin(losses))]
     temp = fit_temperature_scaling(probs, targets)
     isotonic = fit_isotonic(probs, targets)
     temp_loss = _brier(temp.apply(probs), targets)
@@ -2,27 +2,42 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
+from pathlib import Path
 from typing import Any, Dict, Optional
 
 import numpy as np
 
-try:  # pragma: no cover
-    from catboost import CatBoostClassifier  # type: ignore
-except ImportError:  # pragma: no cover
-    CatBoostClassifier = None  # type: ignore
+from .backends import DeferredFile, DeferredModelMixin, load_pickle_file, optional_attr
+from .budget import DEFAULT_PATIENCE, Deadline
 
-try:  # pragma: no cover
-    from sklearn.ensemble import ExtraTreesClassifier
-except ImportError:  # pragma: no cover
-    ExtraTreesClassifier = None  # type: ignore
+
+class DeadlineCallback:
+    def __init__(self, deadline: Deadline):
+        self.deadline = deadline
+
+    def after_iteration(self, info) -> bool:
+        return not self.deadline.expired()
+
+
+def _load_catboost_file(path: str) -> Any:
+    CatBoostClassifier = optional_attr("catboost", "CatBoostClassifier")
+    if CatBoostClassifier is None:
+        raise ImportError("CatBoost modeli yüklemek için catboost gerekli")
+    booster = CatBoostClassifier()
+    booster.load_model(path, format="cbm")
+    return booster
 
 
 @dataclass
-class CatBoostWrapper:
+class CatBoostWrapper(DeferredModelMixin):
     params: Optional[Dict[str, Any]] = None
     model: Any = None
+    early_stopping_rounds: int = DEFAULT_PATIENCE
+    time_budget_s: Optional[float] = None
+    best_iteration: Optional[int] = None
+    backend: Optional[str] = None
 
-    def fit(self, X_train: np.ndarray, y_train: np.ndarray, X_val: np.ndarray | None = None, y_val: np.ndarray | None = None) -> None:
+    def _booster_params(self) -> Dict[str, Any]:
         defaults = {
             "depth": 8,
             "l2_leaf_reg": 3,
@@ -31,6 +46,18 @@ class CatBoostWrapper:
         }
         if self.params:
             defaults.update(self.params)
+        return defaults
+
+    def fit(
+        self,
+        X_train: np.ndarray,
+        y_train: np.ndarray,
+        X_val: np.ndarray | None = None,
+        y_val: np.ndarray | None = None,
+        sample_weight: np.ndarray | None = None,
+    ) -> None:
+        defaults = self._booster_params()
+        CatBoostClassifier = optional_attr("catboost", "CatBoostClassifier")
         if CatBoostClassifier is not None:
             booster = CatBoostClassifier(
                 task_type="CPU",
@@ -39,24 +66,95 @@ class CatBoostWrapper:
                 verbose=False,
                 **defaults,
             )
+            callbacks = [DeadlineCallback(Deadline(self.time_budget_s))] if self.time_budget_s is not None else None
             if X_val is not None and y_val is not None:
-                booster.fit(X_train, y_train, eval_set=(X_val, y_val), use_best_model=True)
+                booster.fit(
+                    X_train,
+                    y_train,
+                    sample_weight=sample_weight,
+                    eval_set=(X_val, y_val),
+                    use_best_model=True,
+                    early_stopping_rounds=self.early_stopping_rounds,
+                    callbacks=callbacks,
+                )
             else:
-                booster.fit(X_train, y_train)
+                booster.fit(X_train, y_train, sample_weight=sample_weight, callbacks=callbacks)
             self.model = booster
+            self.backend = "catboost"
+            best = booster.get_best_iteration()
+            self.best_iteration = int(best) if best is not None else int(booster.tree_count_) - 1
         else:
+            ExtraTreesClassifier = optional_attr("sklearn.ensemble", "ExtraTreesClassifier")
             if ExtraTreesClassifier is None:
                 raise ImportError("CatBoost ve ExtraTrees bulunamadı")
             forest = ExtraTreesClassifier(n_estimators=600, random_state=42)
-            forest.fit(X_train, y_train)
+            forest.fit(X_train, y_train, sample_weight=sample_weight)
             self.model = forest
+            self.backend = "sklearn"
+            self.best_iteration = None
+
+    @property
+    def supports_warm_start(self) -> bool:
+        return self.backend == "catboost" and self.model is not None
+
+    def continue_fit(self, X_train: np.ndarray, y_train: np.ndarray, X_val: np.ndarray | None = None, y_val: np.ndarray | None = None, rounds: int = 50) -> None:
+        """Add up to `rounds` trees on top of the kept ensemble (trees past best_iteration are dropped first)."""
+        CatBoostClassifier = optional_attr("catboost", "CatBoostClassifier")
+        if CatBoostClassifier is None:
+            raise ImportError("Artımlı eğitim için catboost gerekli")
+        kept = self.resolved_model()
+        if self.best_iteration is not None and kept.tree_count_ > self.best_iteration + 1:
+            kept = kept.copy()
+            kept.shrink(self.best_iteration + 1)
+        booster = CatBoostClassifier(
+            task_type="CPU",
+            loss_function="Logloss",
+            random_seed=42,
+            verbose=False,
+            **{**self._booster_params(), "iterations": rounds},
+        )
+        callbacks = [DeadlineCallback(Deadline(self.time_budget_s))] if self.time_budget_s is not None else None
+        if X_val is not None and y_val is not None:
+            booster.fit(
+                X_train,
+                y_train,
+                eval_set=(X_val, y_val),
+                use_best_model=True,
+                early_stopping_rounds=self.early_stopping_rounds,
+                callbacks=callbacks,
+                init_model=kept,
+            )
+        else:
+            booster.fit(X_train, y_train, callbacks=callbacks, init_model=kept)
+        self.model = booster
+        # get_best_iteration() only counts the new trees; use_best_model already shrank the model to them.
+        self.best_iteration = int(booster.tree_count_) - 1
 
     def predict_proba(self, X: np.ndarray) -> np.ndarray:
         if self.model is None:
             raise RuntimeError("Model not trained")
-        proba = self.model.predict_proba(X)
+        model = self.resolved_model()
+        if self.backend == "catboost" and self.best_iteration is not None:
+            proba = model.predict_proba(X, ntree_end=self.best_iteration + 1)
+        else:
+            proba = model.predict_proba(X)
         if isinstance(proba, list):
             proba = np.array(proba)
         if proba.ndim == 1:
             proba = np.vstack([1 - proba, proba]).T
         return proba
+
+    def save_native(self, directory: Path, stem: str) -> Dict[str, Any]:
+        model = self.resolved_model()
+        if self.backend != "catboost":
+            return self.save_pickle_component(model, directory, stem)
+        path = directory / f"{stem}.cbm"
+        model.save_model(str(path), format="cbm")
+        return {"format": "catboost-cbm", "files": {"model": path.name}, "state": self.bundle_state()}
+
+    @classmethod
+    def from_native(cls, directory: Path, entry: Dict[str, Any]) -> "CatBoostWrapper":
+        wrapper = cls(**entry["state"])
+        loader = _load_catboost_file if entry["format"] == "catboost-cbm" else load_pickle_file
+        wrapper.model = DeferredFile(directory / entry["files"]["model"], loader)
+        return wrapper
@@ -0,0 +1,94 @@
+"""Compact single-booster student distilled from the calibrated ensemble for low-latency scoring."""
+from __future__ import annotations
+
+import pickle
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from .backends import DeferredFile, DeferredModel, optional_import
+from .budget import DEFAULT_PATIENCE, Deadline
+from .lgbm import load_lgbm_file, stopping_callback
+
+# Shallow trees and a small round budget: one booster that scores a card in well under a millisecond per race.
+STUDENT_DEFAULTS: Dict[str, Any] = {
+    "num_leaves": 15,
+    "max_depth": 4,
+    "learning_rate": 0.1,
+    "min_data_in_leaf": 20,
+    "feature_fraction": 0.9,
+    "seed": 42,
+    "verbose": -1,
+}
+
+
+@dataclass
+class DistilledModel:
+    """LightGBM booster fit with a cross-entropy objective on the teacher's probabilities as soft labels."""
+
+    model: Any = None
+    best_iteration: Optional[int] = None
+    params: Dict[str, Any] = field(default_factory=dict)
+    fidelity: Dict[str, float] = field(default_factory=dict)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        model = self.model
+        if isinstance(model, DeferredFile):
+            model = model.load()
+        if model is not None and not isinstance(model, DeferredModel):
+            model = DeferredModel(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL))
+        state["model"] = model
+        return state
+
+    def _booster(self) -> Any:
+        if isinstance(self.model, (DeferredModel, DeferredFile)):
+            self.model = self.model.load()
+        return self.model
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        if self.model is None:
+            raise RuntimeError("Distilled model not trained")
+        num_iteration = self.best_iteration + 1 if self.best_iteration is not None else None
+        return np.asarray(self._booster().predict(X, num_iteration=num_iteration), dtype=np.float64)
+
+    def save_native(self, directory: Path, stem: str = "distilled") -> Dict[str, Any]:
+        path = directory / f"{stem}.txt"
+        num_iteration = self.best_iteration + 1 if self.best_iteration is not None else None
+        self._booster().save_model(str(path), num_iteration=num_iteration)
+        return {"format": "lightgbm-txt", "best_iteration": self.best_iteration, "params": self.params, "fidelity": self.fidelity, "files": {"model": path.name}}
+
+    @classmethod
+    def from_native(cls, directory: Path, entry: Dict[str, Any]) -> "DistilledModel":
+        return cls(
+            model=DeferredFile(directory / entry["files"]["model"], load_lgbm_file),
+            best_iteration=entry.get("best_iteration"),
+            params=dict(entry.get("params") or {}),
+            fidelity=dict(entry.get("fidelity") or {}),
+        )
+
+
+def distill_ensemble(
+    X_train: np.ndarray,
+    teacher_train: np.ndarray,
+    X_val: np.ndarray | None = None,
+    teacher_val: np.ndarray | None = None,
+    params: Optional[Dict[str, Any]] = None,
+    rounds: int = 200,
+    patience: int = DEFAULT_PATIENCE,
+    time_budget_s: Optional[float] = None,
+) -> DistilledModel:
+    """Fit the student to the teacher's probabilities; early stopping tracks cross-entropy against the teacher on validation rows."""
+    lgb = optional_import("lightgbm")
+    if lgb is None:
+        raise ImportError("Distilasyon için lightgbm gerekli")
+    booster_params = {**STUDENT_DEFAULTS, **(params or {}), "objective": "cross_entropy", "metric": "cross_entropy"}
+    train = lgb.Dataset(X_train, label=np.clip(teacher_train, 0.0, 1.0), params={"verbose": -1})
+    has_val = X_val is not None and teacher_val is not None and len(X_val) > 0
+    val = lgb.Dataset(X_val, label=np.clip(teacher_val, 0.0, 1.0), reference=train) if has_val else None
+    callbacks = [stopping_callback(lgb, patience if has_val else None, Deadline(time_budget_s))]
+    booster = lgb.train(booster_params, train, num_boost_round=rounds, valid_sets=[val] if has_val else None, callbacks=callbacks)
+    kept = booster.best_iteration or booster.current_iteration()
+    return DistilledModel(model=booster, best_iteration=int(kept) - 1, params=booster_params)
@@ -1,15 +1,17 @@
 """Context gated ensemble combiner."""
 from __future__ import annotations
 
-from dataclasses import dataclass
-from typing import Dict, List
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
 
 import numpy as np
 
-try:  # pragma: no cover
-    from sklearn.linear_model import LogisticRegression
-except ImportError:  # pragma: no cover
-    LogisticRegression = None  # type: ignore
+from features.race_index import RaceIndex
+
+from .backends import optional_attr
+from .budget import Deadline
 
 
 def _context_to_vector(context: Dict[str, object]) -> List[float]:
@@ -25,19 +27,43 @@ def _context_to_vector(context: Dict[str, object]) -> List[float]:
     ]
 
 
+def gate_design(base_outputs: np.ndarray, race_contexts: List[Dict[str, object]]) -> np.ndarray:
+    """Gate inputs: base-model probabilities, the race context vector and a constant column."""
+    context_vectors = np.array([_context_to_vector(ctx) for ctx in race_contexts])
+    intercept = np.ones((base_outputs.shape[0], 1))
+    return np.hstack([base_outputs, context_vectors, intercept])
+
+
+def predict_member(model: Any, X: np.ndarray, groups: Iterable[object] | None = None) -> np.ndarray:
+    """Positive-class probability of one base model; set models also receive the race ids."""
+    if getattr(model, "requires_groups", False):
+        return model.predict_proba(X, groups=groups)[:, 1]
+    return model.predict_proba(X)[:, 1]
+
+
+def predict_member_chunked(model: Any, X: np.ndarray, groups: np.ndarray, chunk_rows: int = 200_000) -> np.ndarray:
+    """predict_member over row chunks cut at race boundaries; for memory-mapped matrices whose races are contiguous."""
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    if len(X) <= chunk_rows or len(starts) != len(np.unique(groups)):
+        return predict_member(model, X, groups)
+    marks = np.arange(chunk_rows, len(X), chunk_rows)
+    bounds = np.unique(np.r_[0, starts[np.searchsorted(starts, marks, side="right") - 1], len(X)])
+    return np.concatenate([predict_member(model, X[a:b], groups[a:b]) for a, b in zip(bounds[:-1], bounds[1:])])
+
+
 @dataclass
 class ContextGatedEnsemble:
     model: object | None = None
 
     def fit(self, base_outputs: np.ndarray, race_contexts: List[Dict[str, object]], targets: np.ndarray) -> None:
-        context_vectors = np.array([_context_to_vector(ctx) for ctx in race_contexts])
-        intercept = np.ones((base_outputs.shape[0], 1))
-        design = np.hstack([base_outputs, context_vectors, intercept])
+        design = gate_design(base_outputs, race_contexts)
         y = targets[:, 1]
+        LogisticRegression = optional_attr("sklearn.linear_model", "LogisticRegression")
         if LogisticRegression is not None:
             clf = LogisticRegression(max_iter=200)
             clf.fit(design, y)
-            self.model = ("logreg", clf)
+            # Keep only the coefficients so predict does not need sklearn.
+            self.model = ("logit", (clf.coef_[0].copy(), float(clf.intercept_[0])))
         else:
             theta, *_ = np.linalg.lstsq(design, y, rcond=None)
             self.model = ("linear", theta)
@@ -45,15 +71,222 @@ class ContextGatedEnsemble:
     def combine(self, base_predictions: List[np.ndarray], race_contexts: List[Dict[str, object]]) -> np.ndarray:
         if self.model is None:
             raise RuntimeError("Ensemble not trained")
-        base = np.column_stack(base_predictions)
-        context_vectors = np.array([_context_to_vector(ctx) for ctx in race_contexts])
-        intercept = np.ones((base.shape[0], 1))
-        design = np.hstack([base, context_vectors, intercept])
+        design = gate_design(np.column_stack(base_predictions), race_contexts)
         kind, model = self.model
-        if kind == "logreg":
+        if kind == "logit":
+            coef, intercept = model
+            probs = 1 / (1 + np.exp(-(design @ coef + intercept)))
+        elif kind == "logreg":
             probs = model.predict_proba(design)[:, 1]
         else:
             theta = model
             preds = design @ theta
             probs = 1 / (1 + np.exp(-preds))
         return probs
+
+    def design_weights(self) -> np.ndarray:
+        """Weights on the full gate design with the separate intercept folded into the constant column, so that
+        combine() == sigmoid(gate_design(...) @ weights) for every kind."""
+        if self.model is None:
+            raise RuntimeError("Ensemble not trained")
+        kind, model = self.model
+        if kind == "logreg":
+            kind, model = "logit", (model.coef_[0], float(model.intercept_[0]))
+        if kind == "logit":
+            weights = np.array(model[0], dtype=np.float64)
+            weights[-1] += float(model[1])
+            return weights
+        return np.array(model, dtype=np.float64)
+
+    def member_weights(self, n_members: int) -> np.ndarray:
+        """Gate coefficients on the base-model inputs (the first `n_members` design columns)."""
+        return self.design_weights()[:n_members]
+
+    def save_native(self, directory: Path, stem: str = "ensemble") -> Dict[str, Any]:
+        if self.model is None:
+            raise RuntimeError("Ensemble not trained")
+        kind, model = self.model
+        if kind == "logreg":
+            kind, model = "logit", (model.coef_[0], float(model.intercept_[0]))
+        if kind == "logit":
+            coef, intercept = model
+            np.save(directory / f"{stem}.coef.npy", np.asarray(coef, dtype=np.float64))
+            return {"kind": "logit", "intercept": float(intercept), "files": {"coef": f"{stem}.coef.npy"}}
+        np.save(directory / f"{stem}.theta.npy", np.asarray(model, dtype=np.float64))
+        return {"kind": "linear", "files": {"theta": f"{stem}.theta.npy"}}
+
+    @classmethod
+    def from_native(cls, directory: Path, entry: Dict[str, Any]) -> "ContextGatedEnsemble":
+        if entry["kind"] == "logit":
+            coef = np.load(directory / entry["files"]["coef"], mmap_mode="r")
+            return cls(model=("logit", (coef, float(entry["intercept"]))))
+        return cls(model=("linear", np.load(directory / entry["files"]["theta"], mmap_mode="r")))
+
+
+def member_costs(models: Dict[str, Any], X: np.ndarray, groups: Iterable[object] | None = None, repeats: int = 3) -> Dict[str, float]:
+    """Inference cost of each member in ms per 1000 rows (best of `repeats`, after one warm-up call that loads the model)."""
+    groups = None if groups is None else np.asarray(list(groups))
+    costs: Dict[str, float] = {}
+    for name, model in models.items():
+        predict_member(model, X[:1], groups[:1] if groups is not None else None)
+        best = float("inf")
+        for _ in range(repeats):
+            started = time.perf_counter()
+            predict_member(model, X, groups)
+            best = min(best, time.perf_counter() - started)
+        costs[name] = 1000.0 * best * 1000.0 / max(1, len(X))
+    return costs
+
+
+@dataclass
+class PruningResult:
+    kept: List[str]
+    dropped: List[str] = field(default_factory=list)
+    report: Dict[str, Dict[str, float]] = field(default_factory=dict)
+
+
+def _gate_losses(
+    columns: Sequence[int],
+    fit_outputs: np.ndarray,
+    fit_contexts: List[Dict[str, object]],
+    fit_targets: np.ndarray,
+    eval_outputs: np.ndarray,
+    eval_contexts: List[Dict[str, object]],
+    eval_y: np.ndarray,
+) -> Tuple[float, float]:
+    gate = ContextGatedEnsemble()
+    gate.fit(fit_outputs[:, columns], fit_contexts, fit_targets)
+    probs = np.clip(gate.combine([eval_outputs[:, c] for c in columns], eval_contexts), 1e-6, 1 - 1e-6)
+    logloss = float(-np.mean(eval_y * np.log(probs) + (1 - eval_y) * np.log(1 - probs)))
+    return logloss, float(np.mean((eval_y - probs) ** 2))
+
+
+def prune_members(
+    names: Sequence[str],
+    costs_ms: Dict[str, float],
+    fit_outputs: np.ndarray,
+    fit_contexts: List[Dict[str, object]],
+    fit_targets: np.ndarray,
+    eval_outputs: np.ndarray,
+    eval_contexts: List[Dict[str, object]],
+    eval_y: np.ndarray,
+    min_value_per_ms: float = 0.0,
+) -> PruningResult:
+    """Backward elimination of gate inputs by value per millisecond of inference.
+
+    A member's value is how much validation logloss plus Brier score rise when the gate is refit without it;
+    each round drops the member with the lowest value / cost until every remaining one clears `min_value_per_ms`.
+    The gate is refit on rows disjoint from the validation rows (`fit_*`) and scored on the validation rows (`eval_*`).
+    """
+    names = list(names)
+    eval_y = np.asarray(eval_y, dtype=np.float64)
+    kept = list(range(len(names)))
+    result = PruningResult(kept=list(names))
+    args = (fit_outputs, fit_contexts, fit_targets, eval_outputs, eval_contexts, eval_y)
+    while len(kept) > 1:
+        base_logloss, base_brier = _gate_losses(kept, *args)
+        scores = {}
+        for column in kept:
+            logloss, brier = _gate_losses([c for c in kept if c != column], *args)
+            cost = max(costs_ms.get(names[column], 0.0), 1e-3)
+            value = (logloss - base_logloss) + (brier - base_brier)
+            scores[column] = value / cost
+            result.report[names[column]] = {
+                "cost_ms": costs_ms.get(names[column], 0.0),
+                "logloss_gain": logloss - base_logloss,
+                "brier_gain": brier - base_brier,
+                "value_per_ms": value / cost,
+            }
+        worst = min(kept, key=lambda column: scores[column])
+        if scores[worst] >= min_value_per_ms:
+            break
+        kept.remove(worst)
+        result.dropped.append(names[worst])
+    result.kept = [names[column] for column in kept]
+    return result
+
+
+@dataclass
+class AnytimeEnsemble:
+    """Gates fit on every cheapest-first prefix of the members, so any prefix yields a valid ensemble estimate."""
+
+    order: List[str]
+    gates: List[ContextGatedEnsemble]
+    costs_ms: Dict[str, float] = field(default_factory=dict)
+    members: List[str] = field(default_factory=list)
+
+    def gate_inputs(self, level: int) -> List[str]:
+        """Members feeding the gate of a prefix; the full prefix keeps the artifact's member order, matching its main gate."""
+        return list(self.members) if level == len(self.order) and self.members else self.order[:level]
+
+    def predict(
+        self,
+        models: Dict[str, Any],
+        X: np.ndarray,
+        race_contexts: List[Dict[str, object]],
+        groups: Iterable[object] | None = None,
+        deadline_ms: float | None = None,
+        chunk_races: int = 16,
+        deadline: Deadline | None = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Evaluate members cheapest-first in chunks of whole races until the deadline.
+
+        The first member always scores every race so each runner gets a probability. Returns the combined
+        probabilities and, per row, how many members (a prefix of `order`) went into them. A `deadline`
+        started by the caller (e.g. before feature building) takes precedence over `deadline_ms`.
+        """
+        if deadline is None:
+            deadline = Deadline(deadline_ms / 1000.0 if deadline_ms is not None else None)
+        groups = None if groups is None else np.asarray(list(groups))
+        index = RaceIndex.from_groups(groups, n_rows=len(X))
+        chunks = np.array_split(np.arange(index.n_races), max(1, -(-index.n_races // chunk_races)))
+        levels = np.zeros(len(X), dtype=np.int64)
+        outputs = np.zeros((len(X), len(self.order)))
+        for position, name in enumerate(self.order):
+            for chunk in chunks:
+                if len(chunk) == 0:
+                    continue
+                if position > 0 and deadline.expired():
+                    break
+                rows = index.order[index.offsets[chunk[0]] : index.offsets[chunk[-1] + 1]]
+                # Members run in order, so a race only gains member k once it has all earlier ones.
+                rows = rows[levels[rows] == position]
+                outputs[rows, position] = predict_member(models[name], X[rows], groups[rows] if groups is not None else None)
+                levels[rows] = position + 1
+            if position > 0 and deadline.expired():
+                break
+        combined = np.empty(len(X))
+        for level in np.unique(levels):
+            rows = np.where(levels == level)[0]
+            columns = [self.order.index(name) for name in self.gate_inputs(level)]
+            combined[rows] = self.gates[level - 1].combine([outputs[rows, k] for k in columns], [race_contexts[i] for i in rows])
+        return combined, levels
+
+    def save_native(self, directory: Path, stem: str = "anytime") -> Dict[str, Any]:
+        gates = [gate.save_native(directory, f"{stem}.{k + 1}") for k, gate in enumerate(self.gates)]
+        files = {f"{k + 1}.{key}": name for k, gate in enumerate(gates) for key, name in gate["files"].items()}
+        return {"order": list(self.order), "members": list(self.members), "costs_ms": self.costs_ms, "gates": gates, "files": files}
+
+    @classmethod
+    def from_native(cls, directory: Path, entry: Dict[str, Any]) -> "AnytimeEnsemble":
+        gates = [ContextGatedEnsemble.from_native(directory, gate) for gate in entry["gates"]]
+        return cls(order=list(entry["order"]), gates=gates, costs_ms=dict(entry.get("costs_ms") or {}), members=list(entry.get("members") or []))
+
+
+def fit_anytime_ensemble(
+    names: Sequence[str],
+    costs_ms: Dict[str, float],
+    fit_outputs: np.ndarray,
+    fit_contexts: List[Dict[str, object]],
+    fit_targets: np.ndarray,
+) -> AnytimeEnsemble:
+    """Order members by inference cost and fit one gate per prefix (`fit_outputs` columns follow `names`)."""
+    names = list(names)
+    order = sorted(range(len(names)), key=lambda column: costs_ms.get(names[column], 0.0))
+    gates = []
+    for k in range(1, len(order) + 1):
+        columns = order[:k] if k < len(order) else list(range(len(names)))
+        gate = ContextGatedEnsemble()
+        gate.fit(fit_outputs[:, columns], fit_contexts, fit_targets)
+        gates.append(gate)
+    return AnytimeEnsemble(order=[names[column] for column in order], gates=gates, costs_ms=dict(costs_ms), members=names)
@@ -0,0 +1,177 @@
+"""Harville / Plackett-Luce finish-order engine: place probabilities and finish distributions per race."""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from features.race_index import RaceIndex
+
+MAX_EXACT_FIELD = 16
+MIN_STRENGTH = 1e-9
+# Elements per DP chunk (races x 2^field); 2^22 float64 is 32 MB per working array.
+_DP_CHUNK = 1 << 22
+
+
+def normalize_strengths(padded: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """Win strengths -> per-race probabilities; padded slots are exactly 0."""
+    strengths = np.where(mask, np.maximum(np.nan_to_num(padded, nan=0.0), MIN_STRENGTH), 0.0)
+    totals = strengths.sum(axis=1, keepdims=True)
+    return strengths / np.where(totals > 0, totals, 1.0)
+
+
+@lru_cache(maxsize=None)
+def _exclusion_masks(width: int) -> Tuple[np.ndarray, np.ndarray]:
+    """others[j, l] = l != j; pair_others[j, k, l] = l not in {j, k}."""
+    eye = np.eye(width, dtype=bool)
+    others = ~eye
+    pair_others = others[:, None, :] & others[None, :, :]
+    return others.astype(np.float64), pair_others.astype(np.float64)
+
+
+def harville_top3(p: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Exact P(1st), P(2nd), P(3rd) for `[races, field]` probabilities (padding = 0).
+
+    P(2nd)_i = p_i * sum_{j != i} p_j / R_j and
+    P(3rd)_i = p_i * sum_{j != k, both != i} p_j p_k / (R_j R_jk), where R_j and R_jk are the masses of the
+    runners other than j (and k). The remaining masses are sums of positive terms rather than 1 - p, so a
+    near-certain favourite does not lose precision to cancellation.
+    """
+    others, pair_others = _exclusion_masks(p.shape[1])
+    rest = p @ others.T
+    first_ratio = np.divide(p, rest, out=np.zeros_like(p), where=rest > 0)
+    second = p * (first_ratio @ others.T)
+
+    pair_rest = np.einsum("rl,jkl->rjk", p, pair_others)
+    B = np.divide(first_ratio[:, :, None] * p[:, None, :], pair_rest, out=np.zeros(pair_rest.shape), where=pair_rest > 0)
+    B *= others
+    third = p * np.einsum("rjk,ij,ik->ri", B, others, others, optimize=True)
+    return p, second, third
+
+
+def expected_finish(p: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """E[position] = 1 + sum_j P(j ahead of i); under Plackett-Luce P(j ahead of i) = p_j / (p_i + p_j)."""
+    pair = p[:, :, None] + p[:, None, :]
+    ahead = np.divide(p[:, None, :], pair, out=np.zeros(pair.shape), where=pair > 0)
+    ahead *= mask[:, :, None] & mask[:, None, :]
+    diagonal = np.arange(p.shape[1])
+    ahead[:, diagonal, diagonal] = 0.0
+    return 1.0 + ahead.sum(axis=2)
+
+
+@lru_cache(maxsize=None)
+def _subset_layers(n: int) -> Tuple[List[List[Tuple[np.ndarray, np.ndarray]]], np.ndarray]:
+    """For every popcount k and runner i: the k-subsets without i and the same subsets with i added."""
+    subsets = np.arange(1 << n, dtype=np.int64)
+    popcount = np.zeros(1 << n, dtype=np.int64)
+    for bit in range(n):
+        popcount += (subsets >> bit) & 1
+    layers = []
+    for k in range(n):
+        layer = subsets[popcount == k]
+        moves = []
+        for i in range(n):
+            free = layer[((layer >> i) & 1) == 0]
+            moves.append((free, free | (1 << i)))
+        layers.append(moves)
+    return layers, popcount
+
+
+def finish_positions_exact(p: np.ndarray) -> np.ndarray:
+    """Exact `[races, n, n]` finish distribution (runner, position) by DP over placed subsets; fields of n <= 16.
+
+    f(S) is the probability that the runners in S take the first |S| places in some order; adding runner i
+    to S happens with probability p_i / (1 - p(S)) and contributes to P(i finishes at |S| + 1).
+    """
+    races, n = p.shape
+    out = np.zeros((races, n, n))
+    layers, _ = _subset_layers(n)
+    step = max(1, _DP_CHUNK >> n)
+    for start in range(0, races, step):
+        chunk = p[start : start + step]
+        mass = np.zeros((len(chunk), 1 << n))
+        for bit in range(n):
+            mass[:, 1 << bit : 2 << bit] = mass[:, : 1 << bit] + chunk[:, bit : bit + 1]
+        # Mass of the runners not yet placed is the mass of the complement subset, i.e. the reversed array.
+        remaining = mass[:, ::-1]
+        f = np.zeros_like(mass)
+        f[:, 0] = 1.0
+        for k, moves in enumerate(layers):
+            for i, (free, added) in enumerate(moves):
+                step_prob = f[:, free] * (chunk[:, i : i + 1] / remaining[:, free])
+                out[start : start + step, i, k] = step_prob.sum(axis=1)
+                if k + 1 < n:
+                    f[:, added] += step_prob
+    return out
+
+
+def finish_positions_sampled(p: np.ndarray, mask: np.ndarray, n_samples: int = 20000, seed: int = 0) -> np.ndarray:
+    """Monte Carlo `[races, field, field]` finish distribution: a Plackett-Luce order is argsort(-(log p + Gumbel))."""
+    races, width = p.shape
+    rng = np.random.default_rng(seed)
+    log_p = np.where(mask, np.log(np.where(mask, p, 1.0)), -np.inf)
+    counts = np.zeros(races * width * width, dtype=np.int64)
+    race_base = (np.arange(races) * width * width)[:, None, None]
+    runner_base = (np.arange(width) * width)[None, None, :]
+    batch = max(1, (1 << 22) // max(1, races * width))
+    for start in range(0, n_samples, batch):
+        size = min(batch, n_samples - start)
+        keys = log_p[:, None, :] + rng.gumbel(size=(races, size, width))
+        ranks = np.argsort(np.argsort(-keys, axis=2), axis=2)
+        flat = (race_base + runner_base + ranks)[np.broadcast_to(mask[:, None, :], ranks.shape)]
+        counts += np.bincount(flat, minlength=counts.size)
+    return counts.reshape(races, width, width) / n_samples
+
+
+@dataclass
+class FinishDistribution:
+    """Per-row outputs in the caller's row order; `positions[:, k]` is P(finish = k + 1)."""
+
+    win: np.ndarray
+    top2: np.ndarray
+    top3: np.ndarray
+    expected_finish: np.ndarray
+    positions: Optional[np.ndarray] = None
+    exact: Optional[np.ndarray] = None
+
+
+def finish_distribution(
+    strengths: np.ndarray,
+    groups: Iterable[object] | None,
+    positions: bool = False,
+    max_exact_field: int = MAX_EXACT_FIELD,
+    n_samples: int = 20000,
+    seed: int = 0,
+) -> FinishDistribution:
+    """Harville place probabilities for every race on a card (or a season) in one padded batch.
+
+    Strengths are normalized within each race, so any positive win score works. With `positions=True`
+    the full finish distribution is added: exact for fields up to `max_exact_field` (races are bucketed
+    by field size), Monte Carlo beyond that.
+    """
+    strengths = np.asarray(strengths, dtype=np.float64)
+    index = RaceIndex.from_groups(groups, n_rows=len(strengths))
+    padded, mask = index.pad(strengths)
+    p = normalize_strengths(padded, mask)
+    win, second, third = harville_top3(p)
+    result = FinishDistribution(
+        win=index.unpad(win),
+        top2=index.unpad(np.minimum(win + second, 1.0)),
+        top3=index.unpad(np.minimum(win + second + third, 1.0)),
+        expected_finish=index.unpad(expected_finish(p, mask)),
+    )
+    if positions:
+        width = p.shape[1]
+        dist = np.zeros((index.n_races, width, width))
+        sizes = index.sizes
+        for n in np.unique(sizes):
+            races = np.where(sizes == n)[0]
+            if n <= max_exact_field:
+                dist[races, :n, :n] = finish_positions_exact(p[races, :n])
+            else:
+                dist[races, :n, :n] = finish_positions_sampled(p[races, :n], mask[races, :n], n_samples, seed)
+        result.positions = index.unpad(dist)
+        result.exact = index.unpad(np.repeat((sizes <= max_exact_field)[:, None], width, axis=1) & mask)
+    return result
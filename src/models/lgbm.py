@@ -2,27 +2,54 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import Any, Dict, Optional
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
 
 import numpy as np
 
-try:  # pragma: no cover
-    import lightgbm as lgb  # type: ignore
-except ImportError:  # pragma: no cover
-    lgb = None  # type: ignore
+from .backends import DeferredFile, DeferredModelMixin, load_pickle_file, optional_attr, optional_import
+from .budget import DEFAULT_PATIENCE, Deadline, PatienceTracker
 
-try:  # pragma: no cover
-    from sklearn.ensemble import RandomForestClassifier
-except ImportError:  # pragma: no cover
-    RandomForestClassifier = None  # type: ignore
+
+def stopping_callback(lgb: Any, patience: int | None, deadline: Deadline, min_iterations: int = 0) -> Callable:
+    tracker = PatienceTracker(patience or 0)
+    state: Dict[str, Any] = {"best_results": []}
+
+    def _callback(env) -> None:
+        results = env.evaluation_result_list or []
+        if patience and results:
+            _, _, score, higher_better = results[0][:4]
+            exhausted = tracker.update(env.iteration, -score if higher_better else score)
+            if tracker.best_iteration == env.iteration:
+                state["best_results"] = results
+            if exhausted:
+                # LightGBM truncates the booster to the reported best iteration.
+                raise lgb.callback.EarlyStopException(max(tracker.best_iteration, min_iterations - 1), state["best_results"])
+        if deadline.expired():
+            best = tracker.best_iteration if tracker.best_iteration >= 0 else env.iteration
+            raise lgb.callback.EarlyStopException(best, state["best_results"] or results)
+
+    _callback.order = 30  # type: ignore[attr-defined]
+    return _callback
+
+
+def load_lgbm_file(path: str) -> Any:
+    lgb = optional_import("lightgbm")
+    if lgb is None:
+        raise ImportError("LightGBM modeli yüklemek için lightgbm gerekli")
+    return lgb.Booster(model_file=path)
 
 
 @dataclass
-class LGBMWrapper:
+class LGBMWrapper(DeferredModelMixin):
     params: Optional[Dict[str, Any]] = None
     model: Any = None
+    early_stopping_rounds: int = DEFAULT_PATIENCE
+    time_budget_s: Optional[float] = None
+    best_iteration: Optional[int] = None
+    backend: Optional[str] = None
 
-    def fit(self, X_train: np.ndarray, y_train: np.ndarray, X_val: np.ndarray | None = None, y_val: np.ndarray | None = None) -> None:
+    def _booster_params(self) -> Dict[str, Any]:
         defaults = {
             "num_leaves": 31,
             "feature_fraction": 0.8,
@@ -32,28 +59,102 @@ class LGBMWrapper:
         }
         if self.params:
             defaults.update(self.params)
+        return defaults
+
+    def fit(
+        self,
+        X_train: np.ndarray,
+        y_train: np.ndarray,
+        X_val: np.ndarray | None = None,
+        y_val: np.ndarray | None = None,
+        sample_weight: np.ndarray | None = None,
+    ) -> None:
+        defaults = self._booster_params()
+        lgb = optional_import("lightgbm")
         if lgb is not None:
             booster = lgb.LGBMClassifier(
                 objective="binary",
                 random_state=42,
+                verbose=-1,
                 **defaults,
             )
             eval_set = None
+            patience = None
             if X_val is not None and y_val is not None:
                 eval_set = [(X_val, y_val)]
-            booster.fit(X_train, y_train, eval_set=eval_set, verbose=False)
+                patience = self.early_stopping_rounds
+            callbacks = [stopping_callback(lgb, patience, Deadline(self.time_budget_s))]
+            booster.fit(X_train, y_train, sample_weight=sample_weight, eval_set=eval_set, eval_metric="binary_logloss", callbacks=callbacks)
             self.model = booster
+            self.backend = "lightgbm"
+            kept = booster.best_iteration_ or booster.booster_.current_iteration()
+            self.best_iteration = int(kept) - 1
         else:
+            RandomForestClassifier = optional_attr("sklearn.ensemble", "RandomForestClassifier")
             if RandomForestClassifier is None:
                 raise ImportError("Neither lightgbm nor sklearn RandomForest available")
             forest = RandomForestClassifier(n_estimators=400, random_state=42)
-            forest.fit(X_train, y_train)
+            forest.fit(X_train, y_train, sample_weight=sample_weight)
             self.model = forest
+            self.backend = "sklearn"
+            self.best_iteration = None
+
+    @property
+    def supports_warm_start(self) -> bool:
+        return self.backend == "lightgbm" and self.model is not None
+
+    def continue_fit(self, X_train: np.ndarray, y_train: np.ndarray, X_val: np.ndarray | None = None, y_val: np.ndarray | None = None, rounds: int = 50) -> None:
+        """Add up to `rounds` trees on top of the kept ensemble (trees past best_iteration are dropped first)."""
+        lgb = optional_import("lightgbm")
+        if lgb is None:
+            raise ImportError("Artımlı eğitim için lightgbm gerekli")
+        previous = self.resolved_model()
+        previous = previous.booster_ if hasattr(previous, "booster_") else previous
+        num_iteration = self.best_iteration + 1 if self.best_iteration is not None else None
+        kept = lgb.Booster(model_str=previous.model_to_string(num_iteration=num_iteration))
+        booster = lgb.LGBMClassifier(objective="binary", random_state=42, verbose=-1, **{**self._booster_params(), "n_estimators": rounds})
+        eval_set = None
+        patience = None
+        if X_val is not None and y_val is not None:
+            eval_set = [(X_val, y_val)]
+            patience = self.early_stopping_rounds
+        callbacks = [stopping_callback(lgb, patience, Deadline(self.time_budget_s))]
+        booster.fit(X_train, y_train, eval_set=eval_set, eval_metric="binary_logloss", init_model=kept, callbacks=callbacks)
+        self.model = booster
+        # Both counters include the init model's trees.
+        kept_trees = booster.best_iteration_ or booster.booster_.current_iteration()
+        self.best_iteration = int(kept_trees) - 1
 
     def predict_proba(self, X: np.ndarray) -> np.ndarray:
         if self.model is None:
             raise RuntimeError("Model not trained")
-        proba = self.model.predict_proba(X)
+        model = self.resolved_model()
+        num_iteration = self.best_iteration + 1 if self.best_iteration is not None else None
+        if self.backend == "lightgbm" and not hasattr(model, "predict_proba"):
+            # Raw Booster loaded from a bundle text file.
+            positive = model.predict(X, num_iteration=num_iteration)
+            proba = np.vstack([1 - positive, positive]).T
+        elif self.backend == "lightgbm" and num_iteration is not None:
+            proba = model.predict_proba(X, num_iteration=num_iteration)
+        else:
+            proba = model.predict_proba(X)
         if proba.ndim == 1:
             proba = np.vstack([1 - proba, proba]).T
         return proba
+
+    def save_native(self, directory: Path, stem: str) -> Dict[str, Any]:
+        model = self.resolved_model()
+        if self.backend != "lightgbm":
+            return self.save_pickle_component(model, directory, stem)
+        path = directory / f"{stem}.txt"
+        booster = model.booster_ if hasattr(model, "booster_") else model
+        num_iteration = self.best_iteration + 1 if self.best_iteration is not None else None
+        booster.save_model(str(path), num_iteration=num_iteration)
+        return {"format": "lightgbm-txt", "files": {"model": path.name}, "state": self.bundle_state()}
+
+    @classmethod
+    def from_native(cls, directory: Path, entry: Dict[str, Any]) -> "LGBMWrapper":
+        wrapper = cls(**entry["state"])
+        loader = load_lgbm_file if entry["format"] == "lightgbm-txt" else load_pickle_file
+        wrapper.model = DeferredFile(directory / entry["files"]["model"], loader)
+        return wrapper
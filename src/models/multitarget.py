@@ -0,0 +1,188 @@
+"""Auxiliary targets (place, finish position, race time) trained on one shared binned dataset."""
+from __future__ import annotations
+
+import pickle
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+from .backends import DeferredFile, DeferredModel, optional_import
+from .budget import DEFAULT_PATIENCE, Deadline
+from .lgbm import stopping_callback
+from .xgb import deadline_callback
+
+AUX_TARGETS: Tuple[str, ...] = ("place", "finish", "race_time")
+TARGET_KINDS: Dict[str, str] = {"place": "binary", "finish": "regression", "race_time": "regression"}
+TARGET_BACKENDS: Tuple[str, ...] = ("lgbm", "xgb")
+
+_LGBM_DEFAULTS = {"num_leaves": 31, "feature_fraction": 0.8, "bagging_fraction": 0.8, "bagging_freq": 1, "learning_rate": 0.05, "seed": 42, "verbose": -1}
+_XGB_DEFAULTS = {"tree_method": "hist", "max_depth": 7, "eta": 0.05, "subsample": 0.8, "colsample_bytree": 0.8, "seed": 42}
+
+
+class SharedBinnedData:
+    """Train/validation matrices binned once (lgb.Dataset / xgb.QuantileDMatrix); targets are label swaps.
+
+    CatBoost is not offered: its Pool cannot change labels after quantization, so every target would re-bin.
+    Rows without a label for the current target get weight 0 instead of being dropped.
+    """
+
+    def __init__(self, backend: str, X_train: np.ndarray, X_val: np.ndarray | None = None):
+        started = time.perf_counter()
+        self.backend = backend
+        self.has_val = X_val is not None and len(X_val) > 0
+        zeros_train = np.zeros(len(X_train))
+        if backend == "lgbm":
+            lgb = optional_import("lightgbm")
+            if lgb is None:
+                raise ImportError("Çoklu hedef eğitimi için lightgbm gerekli")
+            self.train = lgb.Dataset(X_train, label=zeros_train, params={"verbose": -1}, free_raw_data=False).construct()
+            self.val = lgb.Dataset(X_val, label=np.zeros(len(X_val)), reference=self.train).construct() if self.has_val else None
+        elif backend == "xgb":
+            xgb = optional_import("xgboost")
+            if xgb is None:
+                raise ImportError("Çoklu hedef eğitimi için xgboost gerekli")
+            self.train = xgb.QuantileDMatrix(X_train, label=zeros_train)
+            self.val = xgb.QuantileDMatrix(X_val, label=np.zeros(len(X_val)), ref=self.train) if self.has_val else None
+        else:
+            raise KeyError(f"Desteklenmeyen çoklu hedef backend'i: {backend}")
+        self.bin_s = time.perf_counter() - started
+
+    def set_target(self, y_train: np.ndarray, y_val: np.ndarray | None) -> None:
+        for dataset, labels in ((self.train, y_train), (self.val, y_val)):
+            if dataset is None or labels is None:
+                continue
+            labels = np.asarray(labels, dtype=np.float64)
+            known = np.isfinite(labels)
+            dataset.set_label(np.where(known, labels, 0.0))
+            dataset.set_weight(known.astype(np.float64))
+
+
+def _fit_lgbm(data: SharedBinnedData, kind: str, params: Dict[str, Any], rounds: int, patience: int, deadline: Deadline) -> Tuple[Any, int]:
+    lgb = optional_import("lightgbm")
+    booster_params = {**_LGBM_DEFAULTS, **params, "objective": kind, "metric": "binary_logloss" if kind == "binary" else "l2"}
+    callbacks = [stopping_callback(lgb, patience if data.has_val else None, deadline)]
+    booster = lgb.train(booster_params, data.train, num_boost_round=rounds, valid_sets=[data.val] if data.has_val else None, callbacks=callbacks)
+    kept = booster.best_iteration or booster.current_iteration()
+    return booster, int(kept) - 1
+
+
+def _fit_xgb(data: SharedBinnedData, kind: str, params: Dict[str, Any], rounds: int, patience: int, deadline: Deadline) -> Tuple[Any, int]:
+    xgb = optional_import("xgboost")
+    objective = "binary:logistic" if kind == "binary" else "reg:squarederror"
+    booster_params = {**_XGB_DEFAULTS, **params, "objective": objective, "eval_metric": "logloss" if kind == "binary" else "rmse"}
+    booster = xgb.train(
+        booster_params,
+        data.train,
+        num_boost_round=rounds,
+        evals=[(data.val, "val")] if data.has_val else (),
+        early_stopping_rounds=patience if data.has_val else None,
+        callbacks=[deadline_callback(xgb, deadline)] if deadline.budget_s is not None else None,
+        verbose_eval=False,
+    )
+    if data.has_val:
+        return booster, int(booster.best_iteration)
+    return booster, int(booster.num_boosted_rounds()) - 1
+
+
+@dataclass
+class TargetModels:
+    """One booster per auxiliary target; boosters stay serialized until the first prediction."""
+
+    backend: str
+    models: Dict[str, Any] = field(default_factory=dict)
+    best_iterations: Dict[str, int] = field(default_factory=dict)
+    timings: Dict[str, float] = field(default_factory=dict)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        models = {}
+        for target, model in self.models.items():
+            if isinstance(model, DeferredFile):
+                model = model.load()
+            models[target] = model if isinstance(model, DeferredModel) else DeferredModel(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL))
+        state["models"] = models
+        return state
+
+    def _model(self, target: str) -> Any:
+        model = self.models[target]
+        if isinstance(model, (DeferredModel, DeferredFile)):
+            model = self.models[target] = model.load()
+        return model
+
+    def predict(self, X: np.ndarray, targets: Iterable[str] | None = None) -> Dict[str, np.ndarray]:
+        outputs: Dict[str, np.ndarray] = {}
+        matrix = None
+        for target in targets or self.models:
+            model = self._model(target)
+            kept = self.best_iterations[target] + 1
+            if self.backend == "lgbm":
+                outputs[target] = np.asarray(model.predict(X, num_iteration=kept), dtype=np.float64)
+            else:
+                if matrix is None:
+                    matrix = optional_import("xgboost").DMatrix(X)
+                outputs[target] = np.asarray(model.predict(matrix, iteration_range=(0, kept)), dtype=np.float64)
+        return outputs
+
+    def save_native(self, directory: Path, stem: str = "targets") -> Dict[str, Any]:
+        files = {}
+        for target in self.models:
+            model = self._model(target)
+            if self.backend == "lgbm":
+                path = directory / f"{stem}.{target}.txt"
+                model.save_model(str(path), num_iteration=self.best_iterations[target] + 1)
+            else:
+                path = directory / f"{stem}.{target}.ubj"
+                model.save_model(str(path))
+            files[target] = path.name
+        return {"backend": self.backend, "best_iterations": self.best_iterations, "files": files}
+
+    @classmethod
+    def from_native(cls, directory: Path, entry: Dict[str, Any]) -> "TargetModels":
+        loader = _load_lgbm_booster if entry["backend"] == "lgbm" else _load_xgb_booster
+        models = {target: DeferredFile(directory / name, loader) for target, name in entry["files"].items()}
+        return cls(backend=entry["backend"], models=models, best_iterations=dict(entry["best_iterations"]))
+
+
+def _load_lgbm_booster(path: str) -> Any:
+    lgb = optional_import("lightgbm")
+    if lgb is None:
+        raise ImportError("Hedef modellerini yüklemek için lightgbm gerekli")
+    return lgb.Booster(model_file=path)
+
+
+def _load_xgb_booster(path: str) -> Any:
+    xgb = optional_import("xgboost")
+    if xgb is None:
+        raise ImportError("Hedef modellerini yüklemek için xgboost gerekli")
+    booster = xgb.Booster()
+    booster.load_model(path)
+    return booster
+
+
+def fit_target_models(
+    X_train: np.ndarray,
+    y_train: Dict[str, np.ndarray],
+    X_val: np.ndarray | None = None,
+    y_val: Optional[Dict[str, np.ndarray]] = None,
+    backend: str = "lgbm",
+    params: Optional[Dict[str, Any]] = None,
+    rounds: int = 600,
+    patience: int = DEFAULT_PATIENCE,
+    time_budget_s: Optional[float] = None,
+) -> TargetModels:
+    """Bin the matrices once, then fit every target in `y_train` by swapping labels on the shared data."""
+    data = SharedBinnedData(backend, X_train, X_val)
+    fit = _fit_lgbm if backend == "lgbm" else _fit_xgb
+    result = TargetModels(backend=backend, timings={"bin_s": data.bin_s})
+    deadline = Deadline(time_budget_s)
+    for target, labels in y_train.items():
+        started = time.perf_counter()
+        data.set_target(labels, y_val.get(target) if y_val and data.has_val else None)
+        booster, best = fit(data, TARGET_KINDS[target], dict(params or {}), rounds, patience, deadline)
+        result.models[target] = booster
+        result.best_iterations[target] = best
+        result.timings[f"{target}_s"] = time.perf_counter() - started
+    return result
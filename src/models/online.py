@@ -0,0 +1,278 @@
+"""Streaming updates of the ensemble gate and the calibrator from finished races, between full retrains."""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from .calibrate import (
+    TEMPERATURE_BOUNDS,
+    CalibrationResult,
+    ContextCalibrator,
+    IsotonicBreakpoints,
+    isotonic_breakpoints,
+    logit,
+    shifted_breakpoints,
+    sigmoid,
+)
+from .ensemble import ContextGatedEnsemble, gate_design
+
+# Per race day: yesterday's evidence counts 0.98 as much as today's (a half-life of ~35 race days).
+DEFAULT_FORGETTING = 0.98
+# Rows the frozen fit is worth when an artifact carries no training statistics.
+DEFAULT_PRIOR_ROWS = 2000
+CALIBRATION_BINS = 64
+
+
+@dataclass
+class OnlineGate:
+    """Logistic gate updated by one recursive Newton step per batch.
+
+    `precision` is the running Hessian of the logloss (the Laplace posterior precision): it starts from the fit's
+    training rows, is multiplied by the forgetting factor before each batch and grows by the batch's Hessian,
+    so a batch moves the weights by as much as its evidence outweighs the (decayed) past.
+
+    The step minimizes the decayed logloss plus the `l2 / 2 * |w|^2` penalty of the C=1 LogisticRegression the gate
+    was fit with (the constant column stands in for its unpenalized intercept). The penalty does not decay, so each
+    day pulls the weights toward zero by the share of past evidence that was forgotten, and with no forgetting the
+    update tracks the penalized full fit instead of drifting toward an unregularized one.
+    """
+
+    weights: np.ndarray
+    precision: Optional[np.ndarray] = None
+    l2: float = 1.0
+
+    @classmethod
+    def from_ensemble(
+        cls, ensemble: ContextGatedEnsemble, base_outputs: np.ndarray | None = None, contexts: List[Dict[str, object]] | None = None
+    ) -> "OnlineGate":
+        gate = cls(weights=ensemble.design_weights())
+        if base_outputs is not None and contexts is not None and len(base_outputs):
+            gate.precision = _hessian(gate_design(base_outputs, contexts), gate.weights)
+        return gate
+
+    def update(
+        self,
+        base_outputs: np.ndarray,
+        contexts: List[Dict[str, object]],
+        y: np.ndarray,
+        forgetting: float = DEFAULT_FORGETTING,
+        prior_rows: int = DEFAULT_PRIOR_ROWS,
+    ) -> None:
+        design = gate_design(base_outputs, contexts)
+        batch = _hessian(design, self.weights)
+        if self.precision is None:
+            # No training statistics: treat the frozen weights as `prior_rows` rows that looked like this batch.
+            self.precision = batch * (prior_rows / max(len(design), 1))
+        self.precision = forgetting * self.precision + batch
+        penalty = np.full(len(self.weights), self.l2)
+        penalty[-1] = 0.0
+        # The decayed past was at its penalized optimum, so its data gradient there was -forgetting * penalty * w.
+        gradient = design.T @ (sigmoid(design @ self.weights) - np.asarray(y, dtype=np.float64)) + (1 - forgetting) * penalty * self.weights
+        hessian = self.precision + np.diag(penalty)
+        jitter = 1e-9 * np.trace(hessian) / len(hessian)
+        self.weights = self.weights - np.linalg.solve(hessian + jitter * np.eye(len(hessian)), gradient)
+
+    def to_ensemble(self) -> ContextGatedEnsemble:
+        weights = np.array(self.weights, dtype=np.float64)
+        return ContextGatedEnsemble(model=("logit", (weights, 0.0)))
+
+
+def _hessian(design: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    probs = sigmoid(design @ weights)
+    return (design * (probs * (1 - probs))[:, None]).T @ design
+
+
+@dataclass
+class OnlineCalibrator:
+    """Running statistics behind a temperature or isotonic calibrator, global (code 0) plus one per context key.
+
+    Temperature: 1/T per code with a running logloss curvature, one Newton step per batch.
+    Isotonic: forgetting histograms of raw probability per code (row count, win count, summed input), refit with
+    weighted pool-adjacent-violators on the bin means. As in fit_context_calibrator, the global fit sees every row.
+    """
+
+    method: str
+    by: Optional[str] = None
+    keys: List[str] = field(default_factory=list)
+    inverse_temperature: Optional[np.ndarray] = None
+    curvature: Optional[np.ndarray] = None
+    edges: Optional[np.ndarray] = None
+    counts: Optional[np.ndarray] = None
+    wins: Optional[np.ndarray] = None
+    sums: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_calibrator(
+        cls,
+        calibrator: CalibrationResult | ContextCalibrator,
+        probs: np.ndarray | None = None,
+        y: np.ndarray | None = None,
+        keys: Iterable[object] | None = None,
+        prior_rows: int = DEFAULT_PRIOR_ROWS,
+    ) -> "OnlineCalibrator":
+        """Statistics from the calibration rows when given; otherwise pseudo-counts that reproduce the frozen fit."""
+        context = isinstance(calibrator, ContextCalibrator)
+        online = cls(method=calibrator.method, by=calibrator.by if context else None, keys=list(calibrator.keys) if context else [])
+        n_codes = len(online.keys) + 1
+        has_data = probs is not None and y is not None and len(probs) > 0
+        if online.method == "temperature":
+            if context:
+                online.inverse_temperature = np.array(calibrator.inverse_temperature, dtype=np.float64)
+            else:
+                online.inverse_temperature = np.array([1.0 / max(float(calibrator.param or 1.0), 1e-6)])
+            if has_data:
+                online.curvature = np.zeros(n_codes)
+                online._accumulate_curvature(np.asarray(probs, dtype=np.float64), np.asarray(y, dtype=np.float64), online.codes(keys, len(probs)))
+            return online
+
+        if has_data:
+            probs = np.asarray(probs, dtype=np.float64)
+            online.edges = np.unique(np.concatenate([[0.0, 1.0], np.quantile(probs, np.linspace(0, 1, CALIBRATION_BINS + 1))]))
+            online.counts, online.wins, online.sums = (np.zeros((n_codes, len(online.edges) - 1)) for _ in range(3))
+            online._accumulate_bins(probs, np.asarray(y, dtype=np.float64), online.codes(keys, len(probs)))
+            return online
+        # Without data, seed every bin with an equal share of `prior_rows` at the frozen curve's value.
+        online.edges = np.linspace(0.0, 1.0, CALIBRATION_BINS + 1)
+        centers = (online.edges[:-1] + online.edges[1:]) / 2
+        share = prior_rows / CALIBRATION_BINS
+        online.counts = np.full((n_codes, len(centers)), share)
+        online.sums = online.counts * centers
+        if context:
+            online.wins = np.vstack([share * np.interp(centers + 2.0 * code, calibrator.x, calibrator.y) for code in range(n_codes)])
+        else:
+            online.wins = share * CalibrationResult("isotonic", calibrator.param).apply(centers)[None, :]
+        return online
+
+    def codes(self, keys: Iterable[object] | None, n_rows: int) -> np.ndarray:
+        if keys is None or not self.keys:
+            return np.zeros(n_rows, dtype=np.int64)
+        lookup = {key: code for code, key in enumerate(self.keys, start=1)}
+        return np.fromiter((lookup.get(str(key), 0) for key in keys), dtype=np.int64, count=n_rows)
+
+    def _accumulate_curvature(self, probs: np.ndarray, y: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Add the batch's logloss curvature in 1/T per code and return the matching gradients."""
+        logits = logit(probs)
+        n_codes = len(self.inverse_temperature)
+        scaled = sigmoid(logits * self.inverse_temperature[codes])
+        # The global temperature (code 0) is fit on all rows, each context's on its own rows.
+        gradient_terms, curvature_terms = (scaled - y) * logits, scaled * (1 - scaled) * logits**2
+        gradient = np.bincount(codes, weights=gradient_terms, minlength=n_codes)
+        curvature = np.bincount(codes, weights=curvature_terms, minlength=n_codes)
+        if n_codes > 1:
+            global_scaled = sigmoid(logits * self.inverse_temperature[0])
+            gradient[0] = float(np.sum((global_scaled - y) * logits))
+            curvature[0] = float(np.sum(global_scaled * (1 - global_scaled) * logits**2))
+        self.curvature = curvature if self.curvature is None else self.curvature + curvature
+        return gradient
+
+    def _accumulate_bins(self, probs: np.ndarray, y: np.ndarray, codes: np.ndarray) -> None:
+        n_bins = len(self.edges) - 1
+        bins = np.clip(np.searchsorted(self.edges, probs, side="right") - 1, 0, n_bins - 1)
+        for target, values in ((self.counts, np.ones_like(probs)), (self.wins, y), (self.sums, probs)):
+            target[0] += np.bincount(bins, weights=values, minlength=n_bins)
+            if len(self.keys):
+                own = codes > 0
+                flat = np.bincount(codes[own] * n_bins + bins[own], weights=values[own], minlength=len(target) * n_bins)
+                target[1:] += flat.reshape(len(target), n_bins)[1:]
+
+    def update(
+        self,
+        probs: np.ndarray,
+        y: np.ndarray,
+        keys: Iterable[object] | None = None,
+        forgetting: float = DEFAULT_FORGETTING,
+        prior_rows: int = DEFAULT_PRIOR_ROWS,
+    ) -> None:
+        probs = np.asarray(probs, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        codes = self.codes(keys, len(probs))
+        if self.method == "temperature":
+            previous = self.curvature
+            self.curvature = None
+            gradient = self._accumulate_curvature(probs, y, codes)
+            batch = self.curvature
+            if previous is None:
+                previous = batch * (prior_rows / max(len(probs), 1))
+            self.curvature = forgetting * previous + batch
+            step = np.divide(gradient, self.curvature, out=np.zeros_like(gradient), where=self.curvature > 1e-12)
+            low, high = 1.0 / TEMPERATURE_BOUNDS[1], 1.0 / TEMPERATURE_BOUNDS[0]
+            self.inverse_temperature = np.clip(self.inverse_temperature - step, low, high)
+            return
+        for stats in (self.counts, self.wins, self.sums):
+            stats *= forgetting
+        self._accumulate_bins(probs, y, codes)
+
+    def _isotonic_fit(self, code: int) -> IsotonicBreakpoints:
+        filled = self.counts[code] > 1e-12
+        counts = self.counts[code][filled]
+        return isotonic_breakpoints(self.sums[code][filled] / counts, self.wins[code][filled] / counts, weights=counts)
+
+    def to_calibrator(self) -> CalibrationResult | ContextCalibrator:
+        if self.by is None:
+            if self.method == "temperature":
+                return CalibrationResult("temperature", float(1.0 / self.inverse_temperature[0]))
+            return CalibrationResult("isotonic", self._isotonic_fit(0))
+        calibrator = ContextCalibrator(method=self.method, by=self.by, keys=list(self.keys))
+        if self.method == "temperature":
+            calibrator.inverse_temperature = np.array(self.inverse_temperature)
+        else:
+            calibrator.x, calibrator.y = shifted_breakpoints([self._isotonic_fit(code) for code in range(len(self.keys) + 1)])
+        return calibrator
+
+
+_ARRAYS = {
+    "gate": ("weights", "precision"),
+    "calibrator": ("inverse_temperature", "curvature", "edges", "counts", "wins", "sums"),
+}
+
+
+@dataclass
+class OnlineState:
+    """Everything update-results carries from one race day to the next."""
+
+    gate: OnlineGate
+    calibrator: OnlineCalibrator
+    version: int = 0
+    last_date: Optional[str] = None
+
+    @classmethod
+    def from_artifact(cls, artifact: Dict[str, Any], prior_rows: int = DEFAULT_PRIOR_ROWS) -> "OnlineState":
+        """The artifact's stored state, or one seeded from its frozen gate and calibrator."""
+        if artifact.get("online") is not None:
+            return artifact["online"]
+        return cls(
+            gate=OnlineGate.from_ensemble(artifact["ensemble"]),
+            calibrator=OnlineCalibrator.from_calibrator(artifact["calibrator"], prior_rows=prior_rows),
+        )
+
+    def save_native(self, directory: Path, stem: str = "online") -> Dict[str, Any]:
+        entry: Dict[str, Any] = {
+            "version": self.version,
+            "last_date": self.last_date,
+            "method": self.calibrator.method,
+            "by": self.calibrator.by,
+            "keys": self.calibrator.keys,
+            "files": {},
+        }
+        for part, names in _ARRAYS.items():
+            for name in names:
+                array = getattr(getattr(self, part), name)
+                if array is not None:
+                    np.save(directory / f"{stem}.{part}.{name}.npy", np.asarray(array, dtype=np.float64))
+                    entry["files"][f"{part}.{name}"] = f"{stem}.{part}.{name}.npy"
+        return entry
+
+    @classmethod
+    def from_native(cls, directory: Path, entry: Dict[str, Any]) -> "OnlineState":
+        arrays = {key: np.load(directory / file) for key, file in entry["files"].items()}
+        gate = OnlineGate(**{name: arrays.get(f"gate.{name}") for name in _ARRAYS["gate"]})
+        calibrator = OnlineCalibrator(
+            method=entry["method"],
+            by=entry.get("by"),
+            keys=list(entry.get("keys") or []),
+            **{name: arrays.get(f"calibrator.{name}") for name in _ARRAYS["calibrator"]},
+        )
+        return cls(gate=gate, calibrator=calibrator, version=int(entry.get("version", 0)), last_date=entry.get("last_date"))
@@ -0,0 +1,148 @@
+"""Race-normalized conditional-logit combiner over the model and market probabilities."""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from features.race_index import RaceIndex
+
+FEATURES: Tuple[str, ...] = ("model_logit", "market_log_prob", "market_missing")
+
+
+def race_features(model_probs: np.ndarray, market_probs: np.ndarray | None) -> np.ndarray:
+    """`[rows, 3]` design: model logit, log market probability (0 when missing) and a missing-market flag."""
+    probs = np.clip(np.asarray(model_probs, dtype=np.float64), 1e-6, 1 - 1e-6)
+    market = np.full(len(probs), np.nan) if market_probs is None else np.asarray(market_probs, dtype=np.float64)
+    missing = ~(market > 0)
+    log_market = np.log(np.where(missing, 1.0, np.clip(market, 1e-6, 1.0)))
+    return np.column_stack([np.log(probs / (1 - probs)), log_market, missing.astype(np.float64)])
+
+
+def segmented_softmax(scores: np.ndarray, starts: np.ndarray, sizes: np.ndarray) -> np.ndarray:
+    """Softmax within contiguous segments; `scores` must already be in race order."""
+    peaks = np.repeat(np.maximum.reduceat(scores, starts), sizes)
+    exp = np.exp(scores - peaks)
+    return exp / np.repeat(np.add.reduceat(exp, starts), sizes)
+
+
+def race_softmax(scores: np.ndarray, groups: Iterable[object] | None) -> np.ndarray:
+    """Softmax of `scores` within each race, returned in the caller's row order."""
+    scores = np.asarray(scores, dtype=np.float64)
+    index = RaceIndex.from_groups(groups, n_rows=len(scores))
+    probs = np.empty_like(scores)
+    probs[index.order] = segmented_softmax(scores[index.order], index.offsets[:-1], index.sizes)
+    return probs
+
+
+@dataclass
+class ConditionalLogit:
+    """P(i wins race r) = exp(x_i . coef) / sum_{j in r} exp(x_j . coef), fit by Newton's method.
+
+    Per-runner binary probabilities do not sum to one within a race; this second stage re-weights the
+    model against the market and normalizes every race in one segmented pass over race offsets.
+    """
+
+    coef: Optional[np.ndarray] = None
+    l2: float = 1e-3
+    history: List[float] = field(default_factory=list)
+
+    def _layout(self, groups: Iterable[object] | None, n_rows: int) -> Tuple[RaceIndex, np.ndarray, np.ndarray]:
+        index = RaceIndex.from_groups(groups, n_rows=n_rows)
+        return index, index.offsets[:-1], index.sizes
+
+    def fit(
+        self,
+        model_probs: np.ndarray,
+        market_probs: np.ndarray | None,
+        wins: np.ndarray,
+        groups: Iterable[object],
+        max_iter: int = 50,
+        tol: float = 1e-8,
+    ) -> "ConditionalLogit":
+        X = race_features(model_probs, market_probs)
+        index, starts, sizes = self._layout(groups, len(X))
+        X, y = X[index.order], np.asarray(wins, dtype=np.float64)[index.order]
+        # Only races with a recorded winner carry likelihood; dead heats split the target mass.
+        winners = np.add.reduceat(y, starts)
+        keep = np.repeat(winners > 0, sizes)
+        X, y = X[keep], (y / np.repeat(np.where(winners > 0, winners, 1.0), sizes))[keep]
+        sizes = sizes[winners > 0]
+        starts = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+        n_races = max(1, len(sizes))
+
+        def objective(coef: np.ndarray) -> Tuple[float, np.ndarray]:
+            scores = X @ coef
+            peaks = np.maximum.reduceat(scores, starts)
+            log_norm = peaks + np.log(np.add.reduceat(np.exp(scores - np.repeat(peaks, sizes)), starts))
+            loss = float(np.repeat(log_norm, sizes) @ y - scores @ y) / n_races + 0.5 * self.l2 * float(coef @ coef)
+            return loss, scores
+
+        coef = np.array([1.0, 0.0, 0.0]) if self.coef is None else np.asarray(self.coef, dtype=np.float64).copy()
+        loss, scores = objective(coef)
+        self.history = [loss]
+        for _ in range(max_iter):
+            probs = segmented_softmax(scores, starts, sizes)
+            grad = X.T @ (probs - y) / n_races + self.l2 * coef
+            mean_x = np.repeat(np.add.reduceat(probs[:, None] * X, starts), sizes, axis=0)
+            centered = X - mean_x
+            hess = (centered * probs[:, None]).T @ centered / n_races + self.l2 * np.eye(len(coef))
+            step = np.linalg.solve(hess, grad)
+            scale = 1.0
+            while True:
+                trial = coef - scale * step
+                trial_loss, trial_scores = objective(trial)
+                if trial_loss <= loss or scale < 1e-6:
+                    break
+                scale /= 2
+            coef, scores, improvement = trial, trial_scores, loss - trial_loss
+            loss = trial_loss
+            self.history.append(loss)
+            if improvement < tol:
+                break
+        self.coef = coef
+        return self
+
+    def scores(self, model_probs: np.ndarray, market_probs: np.ndarray | None) -> np.ndarray:
+        if self.coef is None:
+            raise RuntimeError("Conditional logit not trained")
+        return race_features(model_probs, market_probs) @ np.asarray(self.coef)
+
+    def predict(self, model_probs: np.ndarray, market_probs: np.ndarray | None, groups: Iterable[object] | None) -> np.ndarray:
+        """Race-normalized win probabilities in the caller's row order."""
+        return race_softmax(self.scores(model_probs, market_probs), groups)
+
+    def save_native(self, directory: Path, stem: str = "race_logit") -> Dict[str, Any]:
+        np.save(directory / f"{stem}.coef.npy", np.asarray(self.coef, dtype=np.float64))
+        return {"kind": "conditional_logit", "features": list(FEATURES), "l2": self.l2, "files": {"coef": f"{stem}.coef.npy"}}
+
+    @classmethod
+    def from_native(cls, directory: Path, entry: Dict[str, Any]) -> "ConditionalLogit":
+        return cls(coef=np.load(directory / entry["files"]["coef"], mmap_mode="r"), l2=float(entry.get("l2", 1e-3)))
+
+
+def cross_fitted_predict(
+    model_probs: np.ndarray,
+    market_probs: np.ndarray | None,
+    wins: np.ndarray,
+    groups: Iterable[object],
+    n_folds: int = 5,
+    l2: float = 1e-3,
+) -> np.ndarray:
+    """Out-of-fold race probabilities: races are dealt into `n_folds` folds, each predicted by a fit on the others."""
+    index = RaceIndex.from_groups(groups, n_rows=len(model_probs))
+    race_fold = np.arange(index.n_races) % max(2, n_folds)
+    row_fold = np.empty(len(model_probs), dtype=np.int64)
+    row_fold[index.order] = np.repeat(race_fold, index.sizes)
+    market = None if market_probs is None else np.asarray(market_probs)
+    groups = np.asarray(groups)
+    probs = np.empty(len(model_probs))
+    for fold in np.unique(race_fold):
+        held, rest = row_fold == fold, row_fold != fold
+        combiner = ConditionalLogit(l2=l2).fit(
+            model_probs[rest], None if market is None else market[rest], wins[rest], groups[rest]
+        )
+        probs[held] = combiner.predict(model_probs[held], None if market is None else market[held], groups[held])
+    return probs
@@ -0,0 +1,261 @@
+"""Race-grouped ranking members: XGBoost rank:ndcg, LightGBM LambdaRank and CatBoost YetiRank."""
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, ClassVar, Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+from features.race_index import RaceIndex
+
+from .backends import DeferredFile, DeferredModelMixin, optional_attr, optional_import
+from .budget import DEFAULT_PATIENCE, Deadline
+from .catb import DeadlineCallback
+from .lgbm import stopping_callback
+from .race_logit import race_softmax
+from .xgb import deadline_callback
+
+# NDCG@3 on small fields ties after the first few trees, so early stopping alone would keep almost none.
+MIN_RANK_ITERATIONS = 100
+
+
+def race_layout(
+    X: np.ndarray, y: np.ndarray, groups: Iterable[object] | None
+) -> Tuple[np.ndarray, np.ndarray, RaceIndex]:
+    """Rows in race order plus the index; the matrix is only reordered (copied) if races are not already contiguous."""
+    index = RaceIndex.from_groups(groups, n_rows=len(X))
+    if index.is_contiguous:
+        return X, y, index
+    return X[index.order], y[index.order], index
+
+
+@dataclass
+class RankingWrapper(DeferredModelMixin, ABC):
+    """Shared fit/predict plumbing; subclasses provide the library-specific pieces.
+
+    Raw ranking scores have no probability scale, so predict_proba applies a softmax within each race.
+    """
+
+    params: Optional[Dict[str, Any]] = None
+    model: Any = None
+    early_stopping_rounds: int = DEFAULT_PATIENCE
+    time_budget_s: Optional[float] = None
+    best_iteration: Optional[int] = None
+    backend: Optional[str] = None
+    min_iterations: int = MIN_RANK_ITERATIONS
+
+    requires_groups: ClassVar[bool] = True
+
+    def fit(
+        self,
+        X_train: np.ndarray,
+        y_train: np.ndarray,
+        X_val: np.ndarray | None = None,
+        y_val: np.ndarray | None = None,
+        groups_train: Iterable[object] | None = None,
+        groups_val: Iterable[object] | None = None,
+        sample_weight: np.ndarray | None = None,
+    ) -> None:
+        X_train, y_train, train_index = race_layout(X_train, np.asarray(y_train), groups_train)
+        # Listwise losses weight whole races, not runners: each race gets the mean weight of its rows.
+        race_weight = None
+        if sample_weight is not None:
+            race_weight = np.bincount(train_index.codes, weights=np.asarray(sample_weight, dtype=np.float64), minlength=train_index.n_races)
+            race_weight = race_weight / np.maximum(train_index.sizes, 1)
+        val = None
+        if X_val is not None and y_val is not None and len(X_val):
+            val = race_layout(X_val, np.asarray(y_val), groups_val)
+        self._fit(X_train, y_train, train_index, val, Deadline(self.time_budget_s), race_weight)
+
+    @abstractmethod
+    def _fit(
+        self,
+        X: np.ndarray,
+        y: np.ndarray,
+        index: RaceIndex,
+        val: Optional[Tuple[np.ndarray, np.ndarray, RaceIndex]],
+        deadline: Deadline,
+        race_weight: Optional[np.ndarray] = None,
+    ) -> None:
+        """Train the library ranker on race-ordered rows (one weight per race, if any) and set model, backend and best_iteration."""
+
+    @abstractmethod
+    def scores(self, X: np.ndarray) -> np.ndarray:
+        """Raw ranking scores up to best_iteration, in the caller's row order."""
+
+    @property
+    def _patience(self) -> int:
+        # A best score at the first tree must still leave min_iterations trees to keep.
+        return max(self.early_stopping_rounds, self.min_iterations)
+
+    def _kept_iteration(self, best: int, trained: int) -> int:
+        """Last tree to use: the validation best, but no earlier than min_iterations (and no later than what was trained)."""
+        return min(max(best, self.min_iterations - 1), trained - 1)
+
+    def predict_proba(self, X: np.ndarray, groups: Iterable[object] | None = None) -> np.ndarray:
+        if self.model is None:
+            raise RuntimeError("Model not trained")
+        positive = race_softmax(self.scores(X), groups)
+        return np.vstack([1 - positive, positive]).T
+
+
+def _load_xgb_ranker(path: str) -> Any:
+    xgb = optional_import("xgboost")
+    if xgb is None:
+        raise ImportError("xgboost ranker yüklemek için xgboost gerekli")
+    ranker = xgb.XGBRanker()
+    ranker.load_model(path)
+    return ranker
+
+
+@dataclass
+class XGBRankWrapper(RankingWrapper):
+    def _fit(self, X, y, index, val, deadline, race_weight=None) -> None:
+        xgb = optional_import("xgboost")
+        if xgb is None:
+            raise ImportError("rank:ndcg için xgboost gerekli")
+        params = {"tree_method": "hist", "max_depth": 6, "eta": 0.05, "subsample": 0.8, "colsample_bytree": 0.8, "n_estimators": 600}
+        if self.params:
+            params.update(self.params)
+        ranker = xgb.XGBRanker(
+            objective="rank:ndcg",
+            eval_metric="ndcg@3",
+            random_state=42,
+            early_stopping_rounds=self._patience if val is not None else None,
+            callbacks=[deadline_callback(xgb, deadline)] if self.time_budget_s is not None else None,
+            **params,
+        )
+        # XGBoost ranking takes one weight per query group.
+        fit_kwargs: Dict[str, Any] = {"group": index.sizes, "sample_weight": race_weight}
+        if val is not None:
+            fit_kwargs.update(eval_set=[val[:2]], eval_group=[val[2].sizes])
+        ranker.fit(X, y, verbose=False, **fit_kwargs)
+        ranker.set_params(callbacks=None)
+        self.model = ranker
+        self.backend = "xgboost"
+        trained = int(ranker.get_booster().num_boosted_rounds())
+        self.best_iteration = self._kept_iteration(int(ranker.best_iteration) if val is not None else trained - 1, trained)
+
+    def scores(self, X: np.ndarray) -> np.ndarray:
+        model = self.resolved_model()
+        iteration_range = (0, self.best_iteration + 1) if self.best_iteration is not None else None
+        return np.asarray(model.predict(X, iteration_range=iteration_range), dtype=np.float64)
+
+    def save_native(self, directory: Path, stem: str) -> Dict[str, Any]:
+        path = directory / f"{stem}.ubj"
+        self.resolved_model().save_model(path)
+        return {"format": "xgboost-ubj", "files": {"model": path.name}, "state": self.bundle_state()}
+
+    @classmethod
+    def from_native(cls, directory: Path, entry: Dict[str, Any]) -> "XGBRankWrapper":
+        wrapper = cls(**entry["state"])
+        wrapper.model = DeferredFile(directory / entry["files"]["model"], _load_xgb_ranker)
+        return wrapper
+
+
+def _load_lgbm_ranker(path: str) -> Any:
+    lgb = optional_import("lightgbm")
+    if lgb is None:
+        raise ImportError("LightGBM ranker yüklemek için lightgbm gerekli")
+    return lgb.Booster(model_file=path)
+
+
+@dataclass
+class LGBMRankWrapper(RankingWrapper):
+    def _fit(self, X, y, index, val, deadline, race_weight=None) -> None:
+        lgb = optional_import("lightgbm")
+        if lgb is None:
+            raise ImportError("LambdaRank için lightgbm gerekli")
+        params = {"num_leaves": 31, "feature_fraction": 0.8, "bagging_fraction": 0.8, "learning_rate": 0.05, "n_estimators": 600}
+        if self.params:
+            params.update(self.params)
+        ranker = lgb.LGBMRanker(objective="lambdarank", random_state=42, verbose=-1, **params)
+        # LightGBM weights rows; every runner carries its race's weight.
+        fit_kwargs: Dict[str, Any] = {"group": index.sizes, "sample_weight": np.repeat(race_weight, index.sizes) if race_weight is not None else None}
+        patience = None
+        if val is not None:
+            fit_kwargs.update(eval_set=[val[:2]], eval_group=[val[2].sizes], eval_at=[3])
+            patience = self._patience
+        ranker.fit(X, y, callbacks=[stopping_callback(lgb, patience, deadline, self.min_iterations)], **fit_kwargs)
+        self.model = ranker
+        self.backend = "lightgbm"
+        trained = int(ranker.booster_.current_iteration())
+        self.best_iteration = self._kept_iteration(int(ranker.best_iteration_ or trained) - 1, trained)
+
+    def scores(self, X: np.ndarray) -> np.ndarray:
+        model = self.resolved_model()
+        num_iteration = self.best_iteration + 1 if self.best_iteration is not None else None
+        return np.asarray(model.predict(X, num_iteration=num_iteration), dtype=np.float64)
+
+    def save_native(self, directory: Path, stem: str) -> Dict[str, Any]:
+        model = self.resolved_model()
+        booster = model.booster_ if hasattr(model, "booster_") else model
+        path = directory / f"{stem}.txt"
+        booster.save_model(str(path), num_iteration=self.best_iteration + 1 if self.best_iteration is not None else None)
+        return {"format": "lightgbm-txt", "files": {"model": path.name}, "state": self.bundle_state()}
+
+    @classmethod
+    def from_native(cls, directory: Path, entry: Dict[str, Any]) -> "LGBMRankWrapper":
+        wrapper = cls(**entry["state"])
+        wrapper.model = DeferredFile(directory / entry["files"]["model"], _load_lgbm_ranker)
+        return wrapper
+
+
+def _load_catboost_ranker(path: str) -> Any:
+    CatBoostRanker = optional_attr("catboost", "CatBoostRanker")
+    if CatBoostRanker is None:
+        raise ImportError("CatBoost ranker yüklemek için catboost gerekli")
+    ranker = CatBoostRanker()
+    ranker.load_model(path, format="cbm")
+    return ranker
+
+
+@dataclass
+class CatBoostRankWrapper(RankingWrapper):
+    def _fit(self, X, y, index, val, deadline, race_weight=None) -> None:
+        CatBoostRanker = optional_attr("catboost", "CatBoostRanker")
+        Pool = optional_attr("catboost", "Pool")
+        if CatBoostRanker is None or Pool is None:
+            raise ImportError("YetiRank için catboost gerekli")
+        params = {"depth": 6, "l2_leaf_reg": 3, "iterations": 1000, "learning_rate": 0.05}
+        if self.params:
+            params.update(self.params)
+        ranker = CatBoostRanker(task_type="CPU", loss_function="YetiRank", eval_metric="NDCG:top=3", random_seed=42, verbose=False, **params)
+        # Group ids in race order; CatBoost only needs each query's rows to be adjacent.
+        train_pool = Pool(
+            X,
+            y,
+            group_id=np.repeat(np.arange(index.n_races), index.sizes),
+            group_weight=np.repeat(race_weight, index.sizes) if race_weight is not None else None,
+        )
+        callbacks = [DeadlineCallback(deadline)] if self.time_budget_s is not None else None
+        if val is not None:
+            X_val, y_val, val_index = val
+            val_pool = Pool(X_val, y_val, group_id=np.repeat(np.arange(val_index.n_races), val_index.sizes))
+            # Trees past the best are kept so that min_iterations can apply; scores() stops at best_iteration.
+            ranker.fit(train_pool, eval_set=val_pool, use_best_model=False, early_stopping_rounds=self._patience, callbacks=callbacks)
+        else:
+            ranker.fit(train_pool, callbacks=callbacks)
+        self.model = ranker
+        self.backend = "catboost"
+        best = ranker.get_best_iteration()
+        trained = int(ranker.tree_count_)
+        self.best_iteration = self._kept_iteration(int(best) if best is not None else trained - 1, trained)
+
+    def scores(self, X: np.ndarray) -> np.ndarray:
+        model = self.resolved_model()
+        ntree_end = self.best_iteration + 1 if self.best_iteration is not None else 0
+        return np.asarray(model.predict(X, ntree_end=ntree_end), dtype=np.float64)
+
+    def save_native(self, directory: Path, stem: str) -> Dict[str, Any]:
+        path = directory / f"{stem}.cbm"
+        self.resolved_model().save_model(str(path), format="cbm")
+        return {"format": "catboost-cbm", "files": {"model": path.name}, "state": self.bundle_state()}
+
+    @classmethod
+    def from_native(cls, directory: Path, entry: Dict[str, Any]) -> "CatBoostRankWrapper":
+        wrapper = cls(**entry["state"])
+        wrapper.model = DeferredFile(directory / entry["files"]["model"], _load_catboost_ranker)
+        return wrapper
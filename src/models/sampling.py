@@ -0,0 +1,66 @@
+"""Race-aware negative downsampling: every winner, a market-rank-stratified fraction of each race's losers."""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Any, Dict
+
+import numpy as np
+import pandas as pd
+
+
+@dataclass
+class NegativeSample:
+    """Kept row indices (sorted) and the compensating weight of each kept row."""
+
+    index: np.ndarray
+    weights: np.ndarray
+    report: Dict[str, Any] = field(default_factory=dict)
+
+
+def downsample_negatives(
+    y: np.ndarray,
+    groups: np.ndarray,
+    market_prob: np.ndarray,
+    rate: float,
+    seed: int = 42,
+) -> NegativeSample:
+    """Keep all winners and round(rate * n) of the n losers of every race (at least one).
+
+    Losers are ordered by market probability (favourites first, missing odds last) and picked by systematic
+    sampling with a random offset per race, so each race keeps losers from across its market ranks. A kept loser
+    stands for n / k losers of its race and is weighted accordingly, which keeps the weighted base rate equal
+    to the full data's.
+    """
+    if not 0.0 < rate <= 1.0:
+        raise ValueError("Negatif örnekleme oranı (0, 1] aralığında olmalı")
+    winners = np.asarray(y) > 0
+    codes, uniques = pd.factorize(np.asarray(groups))
+    n_races = len(uniques)
+    rng = np.random.default_rng(seed)
+
+    negatives = np.flatnonzero(~winners)
+    score = np.nan_to_num(-np.asarray(market_prob, dtype=np.float64)[negatives], nan=np.inf)
+    ordered = negatives[np.lexsort((rng.random(len(negatives)), score, codes[negatives]))]
+    race = codes[ordered]
+    n = np.bincount(race, minlength=n_races)
+    k = np.where(n > 0, np.maximum(1, np.round(rate * n)), 0).astype(np.int64)
+    rank = np.arange(len(ordered)) - (np.cumsum(n) - n)[race]
+    # Row `rank` is kept when one of the k points (j + u) * n / k, j = 0..k-1, falls in [rank, rank + 1).
+    step = k[race] / n[race]
+    offset = rng.random(n_races)[race]
+    keep = np.ceil((rank + 1) * step - offset) > np.ceil(rank * step - offset)
+
+    kept_negatives = ordered[keep]
+    index = np.concatenate([np.flatnonzero(winners), kept_negatives])
+    weights = np.concatenate([np.ones(int(winners.sum())), (n / np.maximum(k, 1))[codes[kept_negatives]]])
+    order = np.argsort(index, kind="stable")
+    report = {
+        "rate": float(rate),
+        "races": int(n_races),
+        "rows": int(len(winners)),
+        "kept_rows": int(len(index)),
+        "winners": int(winners.sum()),
+        "negatives_kept": int(len(kept_negatives)),
+        "weight_sum": float(weights.sum()),
+    }
+    return NegativeSample(index=index[order], weights=weights[order], report=report)
@@ -1,29 +1,38 @@
-"""Set-style MLP encoder for CPU with optional PyTorch backend."""
+"""Set-style encoder over whole race fields for CPU with optional PyTorch backend."""
 from __future__ import annotations
 
+import copy
+import inspect
+import io
+import warnings
 from dataclasses import dataclass
-from typing import Any, Optional
+from pathlib import Path
+from typing import Any, ClassVar, Dict, Iterable, Optional, Tuple
 
 import numpy as np
 
-try:  # pragma: no cover
-    import torch
-    import torch.nn as nn
-    import torch.optim as optim
-except ImportError:  # pragma: no cover
-    torch = None  # type: ignore
-    nn = None  # type: ignore
-    optim = None  # type: ignore
+from features.race_index import RaceIndex
 
-try:  # pragma: no cover
-    from sklearn.neural_network import MLPClassifier
-except ImportError:  # pragma: no cover
-    MLPClassifier = None  # type: ignore
+from .backends import DeferredFile, DeferredModelMixin, load_pickle_file, optional_attr, optional_import
+from .budget import DEFAULT_MLP_PATIENCE, Deadline, PatienceTracker
 
+ENCODER_KWARGS: Dict[str, Any] = {"hidden_dim": 128, "num_layers": 2, "num_heads": 4, "dropout": 0.1}
+
+
+def _encoder_class() -> Any:
+    """Build `_SetEncoder` on first use so importing this module does not import torch."""
+    cached = globals().get("_SET_ENCODER")
+    if cached is not None:
+        return cached
+    torch = optional_import("torch")
+    if torch is None:
+        raise ImportError("PyTorch mevcut değil")
+    nn = torch.nn
 
-if torch is not None:
     class _SetEncoder(nn.Module):  # type: ignore[misc]
-        def __init__(self, input_dim: int, hidden_dim: int = 128, num_layers: int = 2, dropout: float = 0.1):
+        """DeepSets + self-attention encoder over a padded `[races, max_field, features]` batch."""
+
+        def __init__(self, input_dim: int, hidden_dim: int = 128, num_layers: int = 2, num_heads: int = 4, dropout: float = 0.1):
             super().__init__()
             layers = []
             last = input_dim
@@ -32,76 +41,407 @@ if torch is not None:
                 layers.append(nn.ReLU())
                 layers.append(nn.Dropout(dropout))
                 last = hidden_dim
-            layers.append(nn.Linear(last, 1))
-            self.net = nn.Sequential(*layers)
+            self.phi = nn.Sequential(*layers)
+            self.attn = nn.MultiheadAttention(hidden_dim, num_heads, dropout=dropout, batch_first=True)
+            self.norm = nn.LayerNorm(hidden_dim)
+            self.rho = nn.Sequential(
+                nn.Linear(3 * hidden_dim, hidden_dim),
+                nn.ReLU(),
+                nn.Dropout(dropout),
+                nn.Linear(hidden_dim, 1),
+            )
+
+        def forward(self, x: torch.Tensor, mask: torch.Tensor) -> torch.Tensor:
+            h = self.phi(x)
+            attended, _ = self.attn(h, h, h, key_padding_mask=~mask, need_weights=False)
+            h = self.norm(h + attended)
+            weights = mask.unsqueeze(-1).to(h.dtype)
+            pooled = (h * weights).sum(dim=1) / weights.sum(dim=1).clamp(min=1.0)
+            pooled = pooled.unsqueeze(1).expand_as(h)
+            return self.rho(torch.cat([h, pooled, h - pooled], dim=-1)).squeeze(-1)
+
+    _SetEncoder.__module__ = __name__
+    _SetEncoder.__qualname__ = "_SetEncoder"
+    globals()["_SET_ENCODER"] = _SetEncoder
+    return _SetEncoder
+
+
+def _load_encoder_state(path: str, input_dim: int, encoder_kwargs: Dict[str, Any]) -> Any:
+    torch = optional_import("torch")
+    if torch is None:
+        raise ImportError("Set-MLP state dict yüklemek için PyTorch gerekli")
+    model = _encoder_class()(input_dim, **encoder_kwargs)
+    model.load_state_dict(torch.load(path, map_location="cpu", weights_only=True))
+    model.eval()
+    return model
+
 
-        def forward(self, x: torch.Tensor) -> torch.Tensor:  # type: ignore[name-defined]
-            return self.net(x).squeeze(-1)
+def _column_moments(X: np.ndarray, chunk_rows: int = 65536) -> Tuple[np.ndarray, np.ndarray]:
+    """Column mean and standard deviation accumulated over row chunks, so a memory-mapped matrix is never copied whole."""
+    total = np.zeros(X.shape[1])
+    squares = np.zeros(X.shape[1])
+    for start in range(0, len(X), chunk_rows):
+        chunk = np.asarray(X[start : start + chunk_rows], dtype=np.float64)
+        total += chunk.sum(axis=0)
+        squares += np.square(chunk).sum(axis=0)
+    mean = total / max(len(X), 1)
+    return mean, np.sqrt(np.maximum(squares / max(len(X), 1) - mean**2, 0.0))
+
+
+def __getattr__(name: str) -> Any:
+    # Pickled encoders reference `models.set_mlp._SetEncoder`; build it lazily on unpickle.
+    if name == "_SetEncoder":
+        return _encoder_class()
+    raise AttributeError(name)
 
 
 @dataclass
-class SetMLPWrapper:
+class SetMLPWrapper(DeferredModelMixin):
+    requires_groups: ClassVar[bool] = True
+    _transient_fields: ClassVar[Tuple[str, ...]] = ("_scripted", "_compiled")
+    _state_fields: ClassVar[Tuple[str, ...]] = (
+        "input_dim",
+        "params",
+        "max_epochs",
+        "batch_races",
+        "early_stopping_rounds",
+        "time_budget_s",
+        "best_iteration",
+        "runtime",
+        "export_meta",
+    )
+
     input_dim: int
     device: str = "cpu"
+    params: Optional[Dict[str, Any]] = None
     model: Any = None
+    max_epochs: int = 150
+    batch_races: int = 64
+    early_stopping_rounds: int = DEFAULT_MLP_PATIENCE
+    time_budget_s: Optional[float] = None
+    best_iteration: Optional[int] = None
+    feature_mean: Optional[np.ndarray] = None
+    feature_scale: Optional[np.ndarray] = None
+    runtime: str = "eager"
+    exported: Optional[bytes] = None
+    export_meta: Optional[Dict[str, Any]] = None
 
-    def fit(self, X_train: np.ndarray, y_train: np.ndarray, X_val: np.ndarray | None = None, y_val: np.ndarray | None = None) -> None:
+    def fit(
+        self,
+        X_train: np.ndarray,
+        y_train: np.ndarray,
+        X_val: np.ndarray | None = None,
+        y_val: np.ndarray | None = None,
+        groups_train: Iterable[object] | None = None,
+        groups_val: Iterable[object] | None = None,
+        sample_weight: np.ndarray | None = None,
+    ) -> None:
+        torch = optional_import("torch")
         if torch is None:
+            MLPClassifier = optional_attr("sklearn.neural_network", "MLPClassifier")
             if MLPClassifier is None:
                 raise ImportError("PyTorch ve sklearn MLP mevcut değil")
-            mlp = MLPClassifier(hidden_layer_sizes=(128, 64), activation="relu", alpha=1e-4, learning_rate_init=3e-4, max_iter=500, random_state=42)
-            mlp.fit(X_train, y_train)
+            mlp = MLPClassifier(
+                hidden_layer_sizes=(128, 64),
+                activation="relu",
+                alpha=1e-4,
+                learning_rate_init=3e-4,
+                max_iter=500,
+                early_stopping=True,
+                n_iter_no_change=self.early_stopping_rounds,
+                random_state=42,
+            )
+            if sample_weight is None:
+                mlp.fit(X_train, y_train)
+            elif "sample_weight" in inspect.signature(mlp.fit).parameters:
+                mlp.fit(X_train, y_train, sample_weight=sample_weight)
+            else:
+                # sklearn < 1.7 has no weighted MLP fit; draw rows in proportion to their weight instead.
+                weights = np.asarray(sample_weight, dtype=np.float64)
+                rows = np.random.default_rng(42).choice(len(X_train), size=len(X_train), p=weights / weights.sum())
+                mlp.fit(X_train[rows], np.asarray(y_train)[rows])
             self.model = mlp
+            self.best_iteration = int(mlp.n_iter_) - 1
             return
 
+        if isinstance(X_train, np.memmap):
+            mean, scale = _column_moments(X_train)
+        else:
+            mean, scale = X_train.mean(axis=0), X_train.std(axis=0)
+        self.feature_mean = mean.astype(np.float32)
+        self.feature_scale = np.where(scale > 1e-6, scale, 1.0).astype(np.float32)
+
+        params = self.params or {}
+        model = _encoder_class()(self.input_dim, **self.encoder_kwargs())
+        self._train(model, params.get("lr", 3e-4), self.max_epochs, X_train, y_train, X_val, y_val, groups_train, groups_val, sample_weight)
+
+    @property
+    def supports_warm_start(self) -> bool:
+        return self.supports_export
+
+    def continue_fit(
+        self,
+        X_train: np.ndarray,
+        y_train: np.ndarray,
+        X_val: np.ndarray | None = None,
+        y_val: np.ndarray | None = None,
+        rounds: int = 10,
+        groups_train: Iterable[object] | None = None,
+        groups_val: Iterable[object] | None = None,
+        lr_scale: float = 0.1,
+    ) -> None:
+        """Fine-tune the trained encoder for up to `rounds` epochs at a reduced learning rate.
+
+        The feature standardization is kept so the saved weights see inputs on the scale they were trained on;
+        a stale TorchScript export is dropped and has to be re-exported.
+        """
+        if not self.supports_warm_start:
+            raise RuntimeError("İnce ayar için eğitilmiş bir PyTorch encoder gerekli")
+        lr = (self.params or {}).get("lr", 3e-4) * lr_scale
+        self.exported, self.export_meta, self.runtime = None, None, "eager"
+        self._scripted = None
+        self._train(self.resolved_model(), lr, rounds, X_train, y_train, X_val, y_val, groups_train, groups_val, warm=True)
+
+    def _train(
+        self,
+        model: Any,
+        lr: float,
+        max_epochs: int,
+        X_train: np.ndarray,
+        y_train: np.ndarray,
+        X_val: np.ndarray | None,
+        y_val: np.ndarray | None,
+        groups_train: Iterable[object] | None,
+        groups_val: Iterable[object] | None,
+        sample_weight: np.ndarray | None = None,
+        warm: bool = False,
+    ) -> None:
+        """Epoch loop with early stopping on validation loss.
+
+        With `warm=True` the incoming weights are the baseline: the tracker starts from their validation loss
+        and they are kept when no epoch beats it.
+        """
+        torch = optional_import("torch")
         torch.manual_seed(42)
-        model = _SetEncoder(self.input_dim, hidden_dim=128, num_layers=3, dropout=0.1)
+        rng = np.random.default_rng(42)
+        params = self.params or {}
         model.to(self.device)
-        criterion = nn.BCEWithLogitsLoss()
-        optimizer = optim.AdamW(model.parameters(), lr=3e-4)
-
-        X_tensor = torch.tensor(X_train, dtype=torch.float32, device=self.device)
-        y_tensor = torch.tensor(y_train, dtype=torch.float32, device=self.device)
-        val_tensor = None
-        val_target = None
-        if X_val is not None and y_val is not None:
-            val_tensor = torch.tensor(X_val, dtype=torch.float32, device=self.device)
-            val_target = torch.tensor(y_val, dtype=torch.float32, device=self.device)
-
-        best_loss = float("inf")
+        criterion = torch.nn.BCEWithLogitsLoss(reduction="sum")
+        optimizer = torch.optim.AdamW(model.parameters(), lr=lr, weight_decay=params.get("weight_decay", 0.01))
+
+        train_index = RaceIndex.from_groups(groups_train, n_rows=len(X_train))
+        # Memory-mapped inputs stay on disk; each batch is gathered and standardized on its own.
+        lazy = isinstance(X_train, np.memmap)
+        X_std = X_train if lazy else self._standardize(X_train)
+        y_std = np.asarray(y_train, dtype=np.float32)
+        w_std = np.asarray(sample_weight, dtype=np.float32) if sample_weight is not None else None
+        has_val = X_val is not None and y_val is not None
+        if has_val:
+            val_index = RaceIndex.from_groups(groups_val, n_rows=len(X_val))
+            lazy_val = isinstance(X_val, np.memmap)
+            X_val_std = X_val if lazy_val else self._standardize(X_val)
+            y_val_std = np.asarray(y_val, dtype=np.float32)
+
+        def validation_loss() -> float:
+            model.eval()
+            total = 0.0
+            with torch.no_grad():
+                for races in np.array_split(np.arange(val_index.n_races), max(1, val_index.n_races // 512)):
+                    x, mask, target = self._batch(val_index, X_val_std, races, y_val_std, standardize=lazy_val)
+                    total += criterion(model(x, mask)[mask], target[mask]).item()
+            return total / len(X_val_std)
+
+        deadline = Deadline(self.time_budget_s)
+        tracker = PatienceTracker(self.early_stopping_rounds)
         best_state = None
-        for epoch in range(1, 151):
+        last_epoch = 0
+        previous_best = self.best_iteration
+        if warm and has_val:
+            tracker.update(-1, validation_loss())
+            best_state = copy.deepcopy(model.state_dict())
+        for epoch in range(max_epochs):
+            last_epoch = epoch
             model.train()
-            optimizer.zero_grad()
-            logits = model(X_tensor)
-            loss = criterion(logits, y_tensor)
-            loss.backward()
-            optimizer.step()
-
-            if val_tensor is not None:
-                model.eval()
-                with torch.no_grad():
-                    val_loss = criterion(model(val_tensor), val_target)
-                if val_loss.item() < best_loss:
-                    best_loss = val_loss.item()
-                    best_state = model.state_dict()
+            for races in np.array_split(rng.permutation(train_index.n_races), max(1, train_index.n_races // self.batch_races)):
+                x, mask, target = self._batch(train_index, X_std, races, y_std, standardize=lazy)
+                optimizer.zero_grad()
+                logits = model(x, mask)
+                if w_std is None:
+                    loss = criterion(logits[mask], target[mask]) / mask.sum()
+                else:
+                    weight = torch.from_numpy(train_index.pad(w_std, races)[0]).to(self.device)[mask]
+                    loss = torch.nn.functional.binary_cross_entropy_with_logits(logits[mask], target[mask], weight=weight, reduction="sum") / weight.sum()
+                loss.backward()
+                optimizer.step()
+
+            if has_val:
+                exhausted = tracker.update(epoch, validation_loss())
+                if tracker.best_iteration == epoch:
+                    best_state = copy.deepcopy(model.state_dict())
+                if exhausted:
+                    break
+            if deadline.expired():
+                break
         if best_state is not None:
             model.load_state_dict(best_state)
+        if best_state is None:
+            self.best_iteration = last_epoch
+        elif tracker.best_iteration >= 0:
+            self.best_iteration = tracker.best_iteration
+        else:
+            # No fine-tuning epoch beat the incoming weights; they were restored unchanged.
+            self.best_iteration = previous_best
         self.model = model
 
-    def predict_proba(self, X: np.ndarray) -> np.ndarray:
-        if self.model is None:
+    def encoder_kwargs(self) -> Dict[str, Any]:
+        kwargs = dict(ENCODER_KWARGS)
+        kwargs.update({key: value for key, value in (self.params or {}).items() if key in ENCODER_KWARGS})
+        return kwargs
+
+    def predict_proba(self, X: np.ndarray, groups: Iterable[object] | None = None) -> np.ndarray:
+        if self.model is None and self.exported is None:
             raise RuntimeError("Model not trained")
-        if torch is None or not isinstance(self.model, nn.Module):
-            proba = self.model.predict_proba(X)
+        use_graph = self.runtime == "torchscript" and self.exported is not None
+        if not use_graph and not self.supports_export:
+            proba = self.resolved_model().predict_proba(X)
             if proba.ndim == 1:
                 proba = np.vstack([1 - proba, proba]).T
             return proba
-        self.model.eval()
+        torch = optional_import("torch")
+        index = RaceIndex.from_groups(groups, n_rows=len(X))
+        network = self._runtime_module()
         with torch.no_grad():
-            tensor = torch.tensor(X, dtype=torch.float32, device=self.device)
-            logits = self.model(tensor)
-            probs = torch.sigmoid(logits).cpu().numpy()
+            x, mask, _ = self._batch(index, self._standardize(X), np.arange(index.n_races))
+            logits = network(x, mask)
+            probs = index.unpad(torch.sigmoid(logits).cpu().numpy())
         return np.vstack([1 - probs, probs]).T
 
-    # TODO: TRT-FP16 export path for RTX 4060 deployment.
+    def dropout_variance(self, X: np.ndarray, groups: Iterable[object] | None = None, passes: int = 8, seed: int = 0) -> np.ndarray:
+        """Per-runner variance of the win probability over `passes` MC-dropout forward passes.
+
+        All passes run as one batch (the padded card repeated `passes` times), so the cost is one larger forward pass.
+        Dropout is active in the per-runner (phi) and head (rho) layers, not inside attention.
+        """
+        if not self.supports_export and not (self.runtime == "torchscript" and self.exported is not None):
+            return np.zeros(len(X))
+        torch = optional_import("torch")
+        index = RaceIndex.from_groups(groups, n_rows=len(X))
+        network = self._runtime_module()
+        x, mask, _ = self._batch(index, self._standardize(X), np.arange(index.n_races))
+        # Only the Dropout layers switch to training mode; attention stays on its fused inference path.
+        dropouts = [module for module in network.modules() if getattr(module, "original_name", type(module).__name__) == "Dropout"]
+        with torch.random.fork_rng(), torch.no_grad():
+            torch.manual_seed(seed)
+            for module in dropouts:
+                module.train()
+            try:
+                probs = torch.sigmoid(network(x.repeat(passes, 1, 1), mask.repeat(passes, 1)))
+            finally:
+                for module in dropouts:
+                    module.eval()
+        variance = probs.reshape(passes, *mask.shape).var(dim=0, unbiased=False)
+        return index.unpad(variance.cpu().numpy().astype(np.float64))
+
+    @property
+    def supports_export(self) -> bool:
+        torch = optional_import("torch")
+        return torch is not None and self.model is not None and isinstance(self.resolved_model(), torch.nn.Module)
+
+    def export_torchscript(self, quantize: bool = True, path: Path | None = None) -> bytes:
+        """Script the trained encoder for CPU serving, optionally with int8 dynamic quantization of Linear layers."""
+        if not self.supports_export:
+            raise RuntimeError("TorchScript export requires a trained PyTorch encoder")
+        torch = optional_import("torch")
+        module = copy.deepcopy(self.resolved_model()).cpu().eval()
+        quantized = False
+        buffer = io.BytesIO()
+        with warnings.catch_warnings():
+            # torch.ao.quantization and torch.jit emit deprecation notices but remain the CPU-only path here.
+            warnings.simplefilter("ignore")
+            quantization = getattr(getattr(torch, "ao", None), "quantization", None)
+            if quantize and quantization is not None and hasattr(quantization, "quantize_dynamic"):
+                module = quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8)
+                quantized = True
+            scripted = torch.jit.script(module)
+            torch.jit.save(scripted, buffer)
+        self.exported = buffer.getvalue()
+        self.export_meta = {"format": "torchscript", "quantized": quantized, "bytes": len(self.exported)}
+        self.runtime = "torchscript"
+        self._scripted = scripted
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(self.exported)
+        return self.exported
+
+    def _runtime_module(self):
+        torch = optional_import("torch")
+        if self.runtime == "torchscript" and self.exported is not None:
+            scripted = getattr(self, "_scripted", None)
+            if scripted is None:
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore")
+                    scripted = torch.jit.load(io.BytesIO(self.exported), map_location="cpu")
+                scripted.eval()
+                self._scripted = scripted
+            return scripted
+        model = self.resolved_model()
+        model.eval()
+        return model
+
+    def _standardize(self, X: np.ndarray) -> np.ndarray:
+        if self.feature_mean is None or self.feature_scale is None:
+            return np.asarray(X, dtype=np.float32)
+        return ((np.asarray(X, dtype=np.float32) - self.feature_mean) / self.feature_scale).astype(np.float32)
+
+    def _batch(self, index: RaceIndex, X: np.ndarray, races: np.ndarray, y: np.ndarray | None = None, standardize: bool = False):
+        torch = optional_import("torch")
+        padded, mask = index.pad(X, races)
+        if standardize:
+            padded = self._standardize(padded)
+            padded[~mask] = 0.0
+        x = torch.from_numpy(padded).to(self.device)
+        mask_t = torch.from_numpy(mask).to(self.device)
+        target = None
+        if y is not None:
+            target = torch.from_numpy(index.pad(y, races)[0]).to(self.device)
+        return x, mask_t, target
+
+    def save_native(self, directory: Path, stem: str) -> Dict[str, Any]:
+        files: Dict[str, str] = {}
+        if self.feature_mean is not None and self.feature_scale is not None:
+            np.save(directory / f"{stem}.mean.npy", np.asarray(self.feature_mean, dtype=np.float32))
+            np.save(directory / f"{stem}.scale.npy", np.asarray(self.feature_scale, dtype=np.float32))
+            files.update({"feature_mean": f"{stem}.mean.npy", "feature_scale": f"{stem}.scale.npy"})
+        if self.exported is not None:
+            (directory / f"{stem}.ts").write_bytes(self.exported)
+            files["torchscript"] = f"{stem}.ts"
+        if self.model is None:
+            return {"format": "torchscript", "files": files, "state": self.bundle_state()}
+        if not self.supports_export:
+            entry = self.save_pickle_component(self.resolved_model(), directory, stem)
+            entry["files"].update(files)
+            return entry
+        torch = optional_import("torch")
+        torch.save(self.resolved_model().state_dict(), directory / f"{stem}.pt")
+        files["model"] = f"{stem}.pt"
+        return {"format": "torch-state-dict", "files": files, "state": self.bundle_state(), "encoder": self.encoder_kwargs()}
+
+    @classmethod
+    def from_native(cls, directory: Path, entry: Dict[str, Any], runtime: str = "artifact") -> "SetMLPWrapper":
+        wrapper = cls(**entry["state"])
+        files = entry["files"]
+        if "feature_mean" in files:
+            wrapper.feature_mean = np.load(directory / files["feature_mean"], mmap_mode="r")
+            wrapper.feature_scale = np.load(directory / files["feature_scale"], mmap_mode="r")
+        if runtime != "artifact":
+            wrapper.runtime = runtime
+        if wrapper.runtime == "torchscript" and "torchscript" in files:
+            wrapper.exported = (directory / files["torchscript"]).read_bytes()
+            return wrapper
+        wrapper.runtime = "eager"
+        if entry["format"] == "torch-state-dict":
+            options = {"input_dim": wrapper.input_dim, "encoder_kwargs": entry.get("encoder", ENCODER_KWARGS)}
+            wrapper.model = DeferredFile(directory / files["model"], _load_encoder_state, options)
+        elif entry["format"] == "pickle":
+            wrapper.model = DeferredFile(directory / files["model"], load_pickle_file)
+        return wrapper
@@ -0,0 +1,68 @@
+"""Context-specialized model shards (per pist_tipi, hipodrom, ...) stored apart and loaded one at a time."""
+from __future__ import annotations
+
+import pickle
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+SHARD_KEYS: Tuple[str, ...] = ("pist_tipi", "hipodrom", "gate_context_key")
+
+
+@dataclass
+class ShardSet:
+    """Index of the shards trained for one context column; the shard artifacts themselves live in `root`.
+
+    `entries` maps a context value to a file (`<n>.pkl`) or sub-bundle directory name. Freshly trained shards are
+    held in `trained` until written; they are never pickled into the main artifact.
+    """
+
+    by: str
+    entries: Dict[str, str] = field(default_factory=dict)
+    report: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    root: Optional[Path] = None
+    trained: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        state["trained"] = {}
+        state["root"] = None
+        return state
+
+    def save_pickles(self, directory: Path) -> None:
+        directory.mkdir(parents=True, exist_ok=True)
+        for stale in directory.glob("*.pkl"):
+            stale.unlink()
+        self.entries = {}
+        for position, (value, artifact) in enumerate(sorted(self.trained.items())):
+            name = f"{position:03d}.pkl"
+            with open(directory / name, "wb") as f:
+                pickle.dump(artifact, f)
+            self.entries[value] = name
+        self.root = directory
+
+    def save_native(self, directory: Path) -> Dict[str, Any]:
+        """Write every trained shard as its own bundle under `directory/shards`."""
+        from .bundle import save_bundle
+
+        entries = {}
+        for position, (value, artifact) in enumerate(sorted(self.trained.items())):
+            name = f"{position:03d}"
+            save_bundle(directory / "shards" / name, artifact)
+            entries[value] = name
+        return {"by": self.by, "entries": entries, "report": self.report}
+
+    @classmethod
+    def from_native(cls, directory: Path, entry: Dict[str, Any]) -> "ShardSet":
+        return cls(by=entry["by"], entries=dict(entry["entries"]), report=dict(entry.get("report") or {}), root=directory / "shards")
+
+    def load(self, value: str) -> Dict[str, Any]:
+        if self.root is None:
+            raise RuntimeError("Shard dizini bağlanmamış")
+        path = self.root / self.entries[value]
+        if path.is_dir():
+            from .bundle import load_bundle
+
+            return load_bundle(path)
+        with open(path, "rb") as f:
+            return pickle.load(f)
@@ -0,0 +1,319 @@
+"""Time-ordered out-of-fold stacking: per-fold base models in a process pool, OOF matrix in shared memory."""
+from __future__ import annotations
+
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from multiprocessing import shared_memory
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from dataio.design_matrix import take_rows
+
+from .backends import optional_import
+from .budget import DEFAULT_MLP_PATIENCE, DEFAULT_PATIENCE
+from .catb import CatBoostWrapper
+from .ensemble import predict_member
+from .lgbm import LGBMWrapper
+from .ranking import CatBoostRankWrapper, LGBMRankWrapper, XGBRankWrapper
+from .set_mlp import SetMLPWrapper
+from .tuning import SINGLE_THREAD_PARAMS
+from .xgb import XGBWrapper
+
+MEMBER_NAMES: Tuple[str, ...] = ("xgb", "lgbm", "catboost", "set_mlp")
+# Optional race-grouped ranking members, trained next to the classifiers on the same matrix.
+RANKING_MEMBERS: Dict[str, str] = {"xgb": "xgb_rank", "lgbm": "lgbm_rank", "catboost": "catboost_rank"}
+
+_WORKER: Dict[str, Any] = {}
+
+
+def make_member(
+    name: str,
+    input_dim: int,
+    params: Optional[Dict[str, Any]] = None,
+    patience: int = DEFAULT_PATIENCE,
+    mlp_patience: int = DEFAULT_MLP_PATIENCE,
+    time_budget_s: Optional[float] = None,
+) -> Any:
+    if name == "xgb":
+        return XGBWrapper(params=params, early_stopping_rounds=patience, time_budget_s=time_budget_s)
+    if name == "lgbm":
+        return LGBMWrapper(params=params, early_stopping_rounds=patience, time_budget_s=time_budget_s)
+    if name == "catboost":
+        return CatBoostWrapper(params=params, early_stopping_rounds=patience, time_budget_s=time_budget_s)
+    if name == "set_mlp":
+        # cli.tune emits the epoch budget as a parameter; the wrapper takes it as a field.
+        params = dict(params or {})
+        max_epochs = int(params.pop("max_epochs", SetMLPWrapper.max_epochs))
+        return SetMLPWrapper(
+            input_dim=input_dim,
+            params=params or None,
+            max_epochs=max_epochs,
+            early_stopping_rounds=mlp_patience,
+            time_budget_s=time_budget_s,
+        )
+    if name == "xgb_rank":
+        return XGBRankWrapper(params=params, early_stopping_rounds=patience, time_budget_s=time_budget_s)
+    if name == "lgbm_rank":
+        return LGBMRankWrapper(params=params, early_stopping_rounds=patience, time_budget_s=time_budget_s)
+    if name == "catboost_rank":
+        return CatBoostRankWrapper(params=params, early_stopping_rounds=patience, time_budget_s=time_budget_s)
+    raise KeyError(f"Bilinmeyen model: {name}")
+
+
+def fit_member(
+    model: Any,
+    X_train: np.ndarray,
+    y_train: np.ndarray,
+    X_val: np.ndarray | None,
+    y_val: np.ndarray | None,
+    groups_train: np.ndarray | None,
+    groups_val: np.ndarray | None,
+    sample_weight: np.ndarray | None = None,
+) -> Any:
+    if getattr(model, "requires_groups", False):
+        model.fit(X_train, y_train, X_val, y_val, groups_train=groups_train, groups_val=groups_val, sample_weight=sample_weight)
+    else:
+        model.fit(X_train, y_train, X_val, y_val, sample_weight=sample_weight)
+    return model
+
+
+def continue_member(
+    model: Any,
+    X_train: np.ndarray,
+    y_train: np.ndarray,
+    X_val: np.ndarray | None,
+    y_val: np.ndarray | None,
+    groups_train: np.ndarray | None,
+    groups_val: np.ndarray | None,
+    rounds: int,
+) -> bool:
+    """Warm-start `model` on new rows; returns False (model untouched) when its backend cannot continue training."""
+    if not getattr(model, "supports_warm_start", False):
+        return False
+    if getattr(model, "requires_groups", False):
+        model.continue_fit(X_train, y_train, X_val, y_val, rounds, groups_train=groups_train, groups_val=groups_val)
+    else:
+        model.continue_fit(X_train, y_train, X_val, y_val, rounds)
+    return True
+
+
+def time_ordered_folds(dates: Sequence[object], n_folds: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """Expanding-window folds: race days are cut into n_folds + 1 blocks, fold k trains on blocks <= k and predicts block k + 1."""
+    parsed = pd.to_datetime(pd.Series(list(dates))).values
+    days = np.unique(parsed)
+    n_folds = min(n_folds, len(days) - 1)
+    if n_folds < 1:
+        raise ValueError("OOF stacking için en az iki farklı yarış günü gerekli")
+    blocks = np.array_split(days, n_folds + 1)
+    folds = []
+    for k in range(n_folds):
+        cutoff, end = blocks[k + 1][0], blocks[k + 1][-1]
+        train_idx = np.where(parsed < cutoff)[0]
+        predict_idx = np.where((parsed >= cutoff) & (parsed <= end))[0]
+        folds.append((train_idx, predict_idx))
+    return folds
+
+
+def inner_split(train_idx: np.ndarray, dates: np.ndarray, fraction: float = 0.15) -> Tuple[np.ndarray, np.ndarray]:
+    """Latest race days of a fold's training rows become its early-stopping set."""
+    fold_dates = dates[train_idx]
+    cutoff = np.quantile(fold_dates.astype("datetime64[ns]").astype(np.int64), 1 - fraction)
+    late = fold_dates.astype("datetime64[ns]").astype(np.int64) >= cutoff
+    if late.all() or not late.any():
+        return train_idx, train_idx[:0]
+    return train_idx[~late], train_idx[late]
+
+
+class SharedArray:
+    """NumPy array backed by a named shared-memory block, attachable from worker processes."""
+
+    def __init__(self, shm: shared_memory.SharedMemory, shape: Tuple[int, ...], dtype: str, owner: bool):
+        self.shm = shm
+        self.shape = shape
+        self.dtype = dtype
+        self.owner = owner
+        self.array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+    @classmethod
+    def create(cls, shape: Tuple[int, ...], dtype: str = "float64", fill: float | None = None) -> "SharedArray":
+        size = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        shared = cls(shared_memory.SharedMemory(create=True, size=size), shape, dtype, owner=True)
+        if fill is not None:
+            shared.array.fill(fill)
+        return shared
+
+    @classmethod
+    def attach(cls, spec: Tuple[str, Tuple[int, ...], str]) -> "SharedArray":
+        name, shape, dtype = spec
+        # Pool workers inherit the creator's resource tracker, so attaching re-registers a name it already holds;
+        # unregistering here would drop the creator's entry and make its unlink() fail in the tracker.
+        return cls(shared_memory.SharedMemory(name=name), shape, dtype, owner=False)
+
+    @property
+    def spec(self) -> Tuple[str, Tuple[int, ...], str]:
+        return self.shm.name, self.shape, self.dtype
+
+    def close(self) -> None:
+        del self.array
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def _set_worker(X: Any, oof: Any, y: np.ndarray, groups: np.ndarray, dates: np.ndarray, config: Dict[str, Any]) -> None:
+    _WORKER.update(X=X, oof=oof, y=y, groups=groups, dates=dates, config=config)
+    if config["single_thread"]:
+        torch = optional_import("torch") if "set_mlp" in config["members"] else None
+        if torch is not None:
+            torch.set_num_threads(1)
+
+
+def _init_worker(x_spec, oof_spec, *state: Any) -> None:
+    # Out-of-core features are reopened as a read-only memory map; in-memory ones live in one shared block.
+    X = np.load(x_spec[1], mmap_mode="r") if x_spec[0] == "memmap" else SharedArray.attach(x_spec)
+    _set_worker(X, SharedArray.attach(oof_spec), *state)
+
+
+def _shared(name: str) -> np.ndarray:
+    value = _WORKER[name]
+    return value.array if isinstance(value, SharedArray) else value
+
+
+def _release_threads(name: str, model: Any) -> None:
+    """Undo the pool's one-thread pinning on a final member so prediction uses every core again."""
+    if model.params:
+        model.params = {key: value for key, value in model.params.items() if key not in SINGLE_THREAD_PARAMS[name]} or None
+    if getattr(model, "backend", None) in ("xgboost", "lightgbm"):
+        model.resolved_model().set_params(n_jobs=None)
+    elif getattr(model, "backend", None) == "catboost":
+        # A fitted CatBoost refuses set_params; its stored init params are what get_params and pickles carry.
+        model.resolved_model()._init_params.pop("thread_count", None)
+
+
+def _run_task(task: Tuple[int, str, np.ndarray, np.ndarray]) -> Tuple[int, str, Any, float]:
+    """Fold task (fold >= 0): fit on the fold, write predictions into the shared OOF column.
+    Final task (fold == -1): fit on the full training rows and return the model."""
+    fold, name, train_idx, predict_idx = task
+    X, y, groups, config = _shared("X"), _WORKER["y"], _WORKER["groups"], _WORKER["config"]
+    started = time.perf_counter()
+    params = dict(config["params"].get(name) or {})
+    if config["single_thread"]:
+        params.update(SINGLE_THREAD_PARAMS[name])
+    model = make_member(name, X.shape[1], params or None, config["patience"], config["mlp_patience"], config["time_budgets"].get(name))
+    if fold >= 0:
+        fit_idx, stop_idx = inner_split(train_idx, _WORKER["dates"])
+    else:
+        fit_idx, stop_idx = train_idx, predict_idx
+    has_stop = len(stop_idx) > 0
+    # Contiguous row runs stay views, so a memory-mapped X is not copied into RAM per task.
+    fit_member(
+        model,
+        take_rows(X, fit_idx),
+        y[fit_idx],
+        take_rows(X, stop_idx) if has_stop else None,
+        y[stop_idx] if has_stop else None,
+        groups[fit_idx],
+        groups[stop_idx] if has_stop else None,
+    )
+    if fold < 0:
+        if config["single_thread"] and SINGLE_THREAD_PARAMS[name]:
+            _release_threads(name, model)
+        return fold, name, model, time.perf_counter() - started
+    column = config["members"].index(name)
+    _shared("oof")[predict_idx, column] = predict_member(model, take_rows(X, predict_idx), groups[predict_idx])
+    return fold, name, None, time.perf_counter() - started
+
+
+@dataclass
+class StackingResult:
+    models: Dict[str, Any]
+    oof: np.ndarray
+    oof_rows: np.ndarray
+    folds: List[Tuple[np.ndarray, np.ndarray]]
+    wall_s: float
+    cpu_s: float
+
+
+def fit_oof_stack(
+    X: np.ndarray,
+    y: np.ndarray,
+    groups: np.ndarray,
+    dates: Sequence[object],
+    train_idx: np.ndarray,
+    val_idx: np.ndarray,
+    n_folds: int = 4,
+    workers: int = 1,
+    members: Sequence[str] = MEMBER_NAMES,
+    params: Optional[Dict[str, Dict[str, Any]]] = None,
+    patience: int = DEFAULT_PATIENCE,
+    mlp_patience: int = DEFAULT_MLP_PATIENCE,
+    time_budgets: Optional[Dict[str, float]] = None,
+    memmap_path: Optional[Path] = None,
+) -> StackingResult:
+    """Train the final members on `train_idx` and, alongside them, per-fold members whose predictions on
+    their held-out block fill the OOF matrix. All (fold, member) fits are independent pool tasks.
+
+    With `memmap_path` (the .npy file behind a memory-mapped X) pool workers reopen the file instead of receiving
+    a shared float64 copy; with one worker X is used as given and nothing is copied.
+    """
+    members = list(members)
+    train_dates = np.asarray(pd.to_datetime(pd.Series(list(dates))).values)
+    folds = [(train_idx[fit], train_idx[held]) for fit, held in time_ordered_folds(train_dates[train_idx], n_folds)]
+    tasks = [(-1, name, train_idx, val_idx) for name in members]
+    tasks += [(k, name, fit, held) for k, (fit, held) in enumerate(folds) for name in members]
+    # Longest jobs first: full-data fits, then the later (larger) folds.
+    tasks.sort(key=lambda task: -len(task[2]))
+
+    config = {
+        "members": members,
+        "params": params or {},
+        "patience": patience,
+        "mlp_patience": mlp_patience,
+        "time_budgets": time_budgets or {},
+        "single_thread": workers > 1,
+    }
+    started = time.perf_counter()
+    state = (np.asarray(y), np.asarray(groups), train_dates, config)
+    models: Dict[str, Any] = {}
+    cpu_s = 0.0
+    if workers > 1:
+        shared_X = None
+        if memmap_path is not None:
+            x_spec: Tuple[Any, ...] = ("memmap", str(memmap_path))
+        else:
+            shared_X = SharedArray.create(X.shape, "float64")
+            shared_X.array[:] = X
+            x_spec = shared_X.spec
+        shared_oof = SharedArray.create((len(X), len(members)), "float64", fill=np.nan)
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(x_spec, shared_oof.spec, *state)) as executor:
+                results = list(executor.map(_run_task, tasks, chunksize=1))
+            oof = shared_oof.array.copy()
+        finally:
+            if shared_X is not None:
+                shared_X.close()
+            shared_oof.close()
+    else:
+        oof = np.full((len(X), len(members)), np.nan)
+        _set_worker(X, oof, *state)
+        try:
+            results = [_run_task(task) for task in tasks]
+        finally:
+            _WORKER.clear()
+    for fold, name, model, seconds in results:
+        cpu_s += seconds
+        if fold < 0:
+            models[name] = model
+    oof_rows = np.where(~np.isnan(oof).any(axis=1))[0]
+    return StackingResult(
+        models={name: models[name] for name in members},
+        oof=oof,
+        oof_rows=oof_rows,
+        folds=folds,
+        wall_s=time.perf_counter() - started,
+        cpu_s=cpu_s,
+    )
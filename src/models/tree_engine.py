@@ -0,0 +1,409 @@
+"""Framework-free inference for trained tree ensembles (XGBoost, LightGBM, CatBoost, sklearn forests)."""
+from __future__ import annotations
+
+import json
+import tempfile
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from .calibrate import sigmoid
+
+# LightGBM treats |x| <= kZeroThreshold as zero for missing_type "Zero".
+_LGBM_ZERO = 1e-35
+_MISSING_NONE, _MISSING_ZERO, _MISSING_NAN = 0, 1, 2
+
+
+class NotCompilable(ValueError):
+    """A trained model uses something the NumPy engine does not implement; callers keep the native model."""
+
+
+@dataclass
+class CompiledTrees:
+    """Flat node arrays for one ensemble.
+
+    layout "nodes": every tree is a node table; leaves point to themselves so traversal is branch-free.
+    layout "oblivious": CatBoost symmetric trees, one (feature, border) per depth level.
+    The margin is `base_score + scale * Σ leaf`; `link` maps it to a probability.
+    """
+
+    layout: str
+    decision: str
+    link: str
+    base_score: float
+    scale: float
+    input_dtype: str
+    arrays: Dict[str, np.ndarray] = field(default_factory=dict)
+    max_depth: int = 0
+    requires_groups = False
+
+    @property
+    def n_trees(self) -> int:
+        return int(len(self.arrays["roots"]) if self.layout == "nodes" else len(self.arrays["leaf_values"]))
+
+    def _leaf_values_nodes(self, X: np.ndarray) -> np.ndarray:
+        a = self.arrays
+        feature, threshold, left = a["feature"], a["threshold"], a["left"]
+        check_missing = bool(np.isnan(X).any()) or bool((a["missing"] == _MISSING_ZERO).any())
+        flat = X.ravel()
+        row_base = (np.arange(len(X)) * X.shape[1])[:, None]
+        idx = np.broadcast_to(a["roots"], (len(X), len(a["roots"]))).copy()
+        for _ in range(self.max_depth):
+            xv = flat[row_base + feature[idx]]
+            if check_missing:
+                nan = np.isnan(xv)
+                kind = a["missing"][idx]
+                xv = np.where(nan & (kind == _MISSING_NONE), 0.0, xv)
+                is_missing = (nan & (kind == _MISSING_NAN)) | ((kind == _MISSING_ZERO) & (nan | (np.abs(xv) <= _LGBM_ZERO)))
+            go_left = xv < threshold[idx] if self.decision == "lt" else xv <= threshold[idx]
+            if check_missing:
+                go_left = np.where(is_missing, a["default_left"][idx], go_left)
+            # Siblings are stored next to each other: right child == left child + 1.
+            idx = left[idx] + ~go_left
+        return a["value"][idx]
+
+    def _leaf_values_oblivious(self, X: np.ndarray) -> np.ndarray:
+        a = self.arrays
+        # Binarize every distinct (feature, border) once, then trees only gather bits.
+        bits = X[:, a["split_feature"]] > a["border"]
+        nan = np.isnan(X[:, a["split_feature"]])
+        if nan.any():
+            bits = np.where(nan, a["split_nan_true"], bits)
+        split_index, leaf_values = a["split_index"], a["leaf_values"]
+        dtype = np.uint8 if split_index.shape[1] <= 8 else np.uint16 if split_index.shape[1] <= 16 else np.uint32
+        bits = bits.astype(dtype)
+        leaf = np.zeros((len(X), split_index.shape[0]), dtype=dtype)
+        for depth in range(split_index.shape[1]):
+            leaf |= bits[:, split_index[:, depth]] << dtype(depth)
+        return leaf_values.ravel()[a["leaf_offsets"] + leaf]
+
+    def _leaf_values(self, X: np.ndarray) -> np.ndarray:
+        """`[rows, trees]` leaf value reached in every tree."""
+        return self._leaf_values_nodes(X) if self.layout == "nodes" else self._leaf_values_oblivious(X)
+
+    def _prepared(self, X: np.ndarray) -> np.ndarray:
+        # Inputs are rounded exactly as the native library does (float32 for XGBoost/CatBoost/sklearn)
+        # before being compared with the stored thresholds.
+        X = np.ascontiguousarray(X, dtype=self.input_dtype)
+        if self.layout == "nodes" and np.isposinf(X).any():
+            # Leaves carry a +inf threshold so that every row stays put; clamp +inf to keep that invariant.
+            X = np.minimum(X, np.finfo(X.dtype).max)
+        return X
+
+    def _chunk_rows(self, chunk_rows: int) -> int:
+        # Keep the per-chunk [rows, trees] temporaries around a million elements.
+        return max(1, min(chunk_rows, (1 << 20) // max(self.n_trees, 1)))
+
+    def margin(self, X: np.ndarray, chunk_rows: int = 4096) -> np.ndarray:
+        X = self._prepared(X)
+        out = np.empty(len(X), dtype=np.float64)
+        chunk_rows = self._chunk_rows(chunk_rows)
+        for start in range(0, len(X), chunk_rows):
+            out[start : start + chunk_rows] = self._leaf_values(X[start : start + chunk_rows]).sum(axis=1)
+        return self.base_score + self.scale * out
+
+    def staged_margin(self, X: np.ndarray, ends: np.ndarray, chunk_rows: int = 4096) -> np.ndarray:
+        """`[rows, stages]` margins of the first `ends[s]` trees; one traversal serves every stage."""
+        ends = np.asarray(ends, dtype=np.int64)
+        if len(ends) == 0 or np.any(np.diff(ends) <= 0) or ends[0] < 1 or ends[-1] > self.n_trees:
+            raise ValueError("Aşama sınırları artan ve 1..n_trees aralığında olmalı")
+        starts = np.concatenate([[0], ends[:-1]])
+        X = self._prepared(X)
+        out = np.empty((len(X), len(ends)), dtype=np.float64)
+        chunk_rows = self._chunk_rows(chunk_rows)
+        for start in range(0, len(X), chunk_rows):
+            values = self._leaf_values(X[start : start + chunk_rows])[:, : ends[-1]]
+            out[start : start + chunk_rows] = np.add.reduceat(values, starts, axis=1).cumsum(axis=1)
+        return self.base_score + self.scale * out
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        margin = self.margin(X)
+        positive = sigmoid(margin) if self.link == "sigmoid" else margin
+        return np.vstack([1 - positive, positive]).T
+
+    def save(self, path: Path) -> Dict[str, Any]:
+        np.savez(path, **self.arrays)
+        return {
+            "layout": self.layout,
+            "decision": self.decision,
+            "link": self.link,
+            "base_score": self.base_score,
+            "scale": self.scale,
+            "input_dtype": self.input_dtype,
+            "max_depth": self.max_depth,
+        }
+
+    @classmethod
+    def load(cls, path: Path, header: Dict[str, Any]) -> "CompiledTrees":
+        with np.load(path) as data:
+            arrays = {name: data[name] for name in data.files}
+        return cls(arrays=arrays, **header)
+
+
+class _NodeTableBuilder:
+    """Concatenates trees into one node table, renumbered breadth-first so siblings are adjacent."""
+
+    def __init__(self) -> None:
+        self.columns: Dict[str, List[Any]] = {name: [] for name in ("feature", "threshold", "left", "default_left", "missing", "value")}
+        self.roots: List[int] = []
+        self.max_depth = 0
+
+    def add_tree(self, feature, threshold, left, right, default_left, missing, value) -> None:
+        offset = len(self.columns["feature"])
+        order = [0]
+        depth = {0: 0}
+        new_left: Dict[int, int] = {}
+        position = 0
+        while position < len(order):
+            node = order[position]
+            position += 1
+            if left[node] >= 0:
+                new_left[node] = offset + len(order)
+                order.extend((int(left[node]), int(right[node])))
+                depth[int(left[node])] = depth[int(right[node])] = depth[node] + 1
+        c = self.columns
+        for new_id, node in enumerate(order):
+            if node in new_left:
+                c["feature"].append(int(feature[node]))
+                c["threshold"].append(threshold[node])
+                c["left"].append(new_left[node])
+                c["default_left"].append(bool(default_left[node]))
+                c["missing"].append(missing[node])
+                c["value"].append(0.0)
+            else:
+                # Leaf: +inf threshold sends every row (and NaN via default_left) back to itself.
+                c["feature"].append(0)
+                c["threshold"].append(np.inf)
+                c["left"].append(offset + new_id)
+                c["default_left"].append(True)
+                c["missing"].append(_MISSING_NAN)
+                c["value"].append(float(value[node]))
+        self.roots.append(offset)
+        self.max_depth = max(self.max_depth, max(depth.values()))
+
+    def arrays(self, threshold_dtype: str) -> Dict[str, np.ndarray]:
+        c = self.columns
+        return {
+            "feature": np.asarray(c["feature"], dtype=np.intp),
+            "threshold": np.asarray(c["threshold"], dtype=threshold_dtype),
+            "left": np.asarray(c["left"], dtype=np.intp),
+            "default_left": np.asarray(c["default_left"], dtype=bool),
+            "missing": np.asarray(c["missing"], dtype=np.int8),
+            "value": np.asarray(c["value"], dtype=np.float64),
+            "roots": np.asarray(self.roots, dtype=np.intp),
+        }
+
+
+def compile_xgboost(model: Any, n_rounds: Optional[int] = None) -> CompiledTrees:
+    booster = model.get_booster() if hasattr(model, "get_booster") else model
+    learner = json.loads(bytes(booster.save_raw("json")))["learner"]
+    gbtree = learner["gradient_booster"]["model"]
+    base = float(str(learner["learner_model_param"]["base_score"]).strip("[]"))
+    indptr = gbtree.get("iteration_indptr") or list(range(len(gbtree["trees"]) + 1))
+    n_rounds = len(indptr) - 1 if n_rounds is None else min(n_rounds, len(indptr) - 1)
+    builder = _NodeTableBuilder()
+    for tree in gbtree["trees"][: indptr[n_rounds]]:
+        if any(tree["split_type"]):
+            raise NotCompilable("Kategorik XGBoost split'leri derlenemez")
+        builder.add_tree(
+            tree["split_indices"],
+            tree["split_conditions"],
+            tree["left_children"],
+            tree["right_children"],
+            tree["default_left"],
+            [_MISSING_NAN] * len(tree["left_children"]),
+            tree["split_conditions"],  # leaves keep their weight in split_conditions
+        )
+    objective = learner.get("objective", {}).get("name", "binary:logistic")
+    if objective not in ("binary:logistic", "reg:logistic"):
+        raise NotCompilable(f"Desteklenmeyen XGBoost objective: {objective}")
+    return CompiledTrees(
+        layout="nodes",
+        decision="lt",
+        link="sigmoid",
+        base_score=float(np.log(base / (1.0 - base))),
+        scale=1.0,
+        input_dtype="float32",
+        arrays=builder.arrays("float32"),
+        max_depth=builder.max_depth,
+    )
+
+
+def _flatten_lgbm_tree(structure: Dict[str, Any]) -> Dict[str, List[Any]]:
+    nodes: Dict[str, List[Any]] = {name: [] for name in ("feature", "threshold", "left", "right", "default_left", "missing", "value")}
+    missing_codes = {"None": _MISSING_NONE, "Zero": _MISSING_ZERO, "NaN": _MISSING_NAN}
+    stack = [(structure, -1, False)]
+    while stack:
+        node, parent, is_left = stack.pop()
+        idx = len(nodes["feature"])
+        if parent >= 0:
+            nodes["left" if is_left else "right"][parent] = idx
+        if "leaf_value" in node:
+            for name, item in (("feature", 0), ("threshold", 0.0), ("left", -1), ("right", -1), ("default_left", False), ("missing", _MISSING_NONE), ("value", node["leaf_value"])):
+                nodes[name].append(item)
+            continue
+        if node.get("decision_type", "<=") != "<=":
+            raise NotCompilable("Kategorik LightGBM split'leri derlenemez")
+        for name, item in (
+            ("feature", node["split_feature"]),
+            ("threshold", node["threshold"]),
+            ("left", -1),
+            ("right", -1),
+            ("default_left", bool(node["default_left"])),
+            ("missing", missing_codes[node.get("missing_type", "None")]),
+            ("value", 0.0),
+        ):
+            nodes[name].append(item)
+        stack.append((node["right_child"], idx, False))
+        stack.append((node["left_child"], idx, True))
+    return nodes
+
+
+def compile_lightgbm(model: Any, num_iteration: Optional[int] = None) -> CompiledTrees:
+    booster = model.booster_ if hasattr(model, "booster_") else model
+    dump = booster.dump_model(num_iteration=num_iteration)
+    if dump.get("num_tree_per_iteration", 1) != 1 or not str(dump.get("objective", "binary")).startswith("binary"):
+        raise NotCompilable("Yalnızca binary LightGBM modelleri derlenebilir")
+    builder = _NodeTableBuilder()
+    for tree in dump["tree_info"]:
+        nodes = _flatten_lgbm_tree(tree["tree_structure"])
+        builder.add_tree(nodes["feature"], nodes["threshold"], nodes["left"], nodes["right"], nodes["default_left"], nodes["missing"], nodes["value"])
+    scale = 1.0
+    for token in str(dump.get("objective", "")).split():
+        if token.startswith("sigmoid:"):
+            scale = float(token.split(":", 1)[1])
+    return CompiledTrees(
+        layout="nodes",
+        decision="le",
+        link="sigmoid",
+        base_score=0.0,
+        scale=scale,
+        input_dtype="float64",
+        arrays=builder.arrays("float64"),
+        max_depth=builder.max_depth,
+    )
+
+
+def compile_catboost(model: Any, ntree_end: Optional[int] = None) -> CompiledTrees:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "model.json"
+        model.save_model(str(path), format="json")
+        dump = json.loads(path.read_text())
+    if "oblivious_trees" not in dump:
+        raise NotCompilable("Yalnızca simetrik (oblivious) CatBoost ağaçları derlenebilir")
+    float_features = {info["feature_index"]: info for info in dump["features_info"].get("float_features", [])}
+    trees = dump["oblivious_trees"][:ntree_end]
+    depth = max((len(tree["splits"]) for tree in trees), default=0)
+    # Distinct splits; index 0 is a padding split (+inf border) whose bit is always 0.
+    splits: Dict[Any, int] = {(0, np.inf, False): 0}
+    split_index = np.zeros((len(trees), depth), dtype=np.intp)
+    leaf_values = np.zeros((len(trees), 1 << depth), dtype=np.float64)
+    for t, tree in enumerate(trees):
+        for d, split in enumerate(tree["splits"]):
+            if split.get("split_type", "FloatFeature") != "FloatFeature":
+                raise NotCompilable("Yalnızca sayısal CatBoost split'leri derlenebilir")
+            info = float_features[split["float_feature_index"]]
+            key = (info["flat_feature_index"], float(np.float32(split["border"])), info.get("nan_value_treatment") == "AsTrue")
+            split_index[t, d] = splits.setdefault(key, len(splits))
+        leaf_values[t, : len(tree["leaf_values"])] = tree["leaf_values"]
+    keys = list(splits)
+    scale, bias = dump.get("scale_and_bias", [1.0, [0.0]])
+    bias = bias[0] if isinstance(bias, list) else bias
+    return CompiledTrees(
+        layout="oblivious",
+        decision="gt",
+        link="sigmoid",
+        base_score=float(bias),
+        scale=float(scale),
+        input_dtype="float32",
+        arrays={
+            "split_feature": np.asarray([key[0] for key in keys], dtype=np.intp),
+            "border": np.asarray([key[1] for key in keys], dtype=np.float32),
+            "split_nan_true": np.asarray([key[2] for key in keys], dtype=bool),
+            "split_index": split_index,
+            "leaf_values": leaf_values,
+            "leaf_offsets": (np.arange(len(trees)) << depth).astype(np.int32),
+        },
+        max_depth=depth,
+    )
+
+
+def compile_sklearn(model: Any) -> CompiledTrees:
+    builder = _NodeTableBuilder()
+    boosted = hasattr(model, "init_")
+    estimators = [row[0] for row in model.estimators_] if boosted else list(model.estimators_)
+    for estimator in estimators:
+        tree = estimator.tree_
+        left, right = tree.children_left, tree.children_right
+        if boosted:
+            value = tree.value[:, 0, 0]
+        else:
+            counts = tree.value[:, 0, :]
+            value = counts[:, 1] / counts.sum(axis=1)
+        default_left = getattr(tree, "missing_go_to_left", np.zeros(len(left), dtype=bool))
+        builder.add_tree(tree.feature, tree.threshold, left, right, np.asarray(default_left, dtype=bool), [_MISSING_NAN] * len(left), value)
+    if boosted:
+        if model.init_ == "zero":
+            base = 0.0
+        else:
+            prior = float(model.init_.class_prior_[1])
+            base = float(np.log(prior / (1.0 - prior)))
+        link, scale = "sigmoid", float(model.learning_rate)
+    else:
+        base, link, scale = 0.0, "identity", 1.0 / len(estimators)
+    return CompiledTrees(
+        layout="nodes",
+        decision="le",
+        link=link,
+        base_score=base,
+        scale=scale,
+        input_dtype="float32",
+        arrays=builder.arrays("float64"),
+        max_depth=builder.max_depth,
+    )
+
+
+def compile_wrapper(wrapper: Any) -> CompiledTrees:
+    """Compile a trained XGB/LGBM/CatBoost wrapper, honouring its early-stopped best_iteration."""
+    model = wrapper.resolved_model()
+    kept = wrapper.best_iteration + 1 if wrapper.best_iteration is not None else None
+    if wrapper.backend == "xgboost":
+        return compile_xgboost(model, kept)
+    if wrapper.backend == "lightgbm":
+        return compile_lightgbm(model, kept)
+    if wrapper.backend == "catboost":
+        return compile_catboost(model, kept)
+    if wrapper.backend == "sklearn" and hasattr(model, "estimators_"):
+        return compile_sklearn(model)
+    raise NotCompilable(f"Derlenemeyen backend: {wrapper.backend}")
+
+
+def compiled_view(wrapper: Any) -> CompiledTrees:
+    """compile_wrapper, cached on the wrapper until its model or best_iteration changes; the cache is not pickled."""
+    cached = getattr(wrapper, "_compiled", None)
+    if cached is None or cached[0] is not wrapper.model or cached[1] != wrapper.best_iteration:
+        model = wrapper.resolved_model()
+        cached = (model, wrapper.best_iteration, compile_wrapper(wrapper))
+        wrapper._compiled = cached
+    return cached[2]
+
+
+def compile_or_native(wrapper: Any) -> Any:
+    """The compiled trees of a compilable wrapper, or the wrapper itself when it is not compilable."""
+    if not is_compilable(wrapper):
+        return wrapper
+    try:
+        return compile_wrapper(wrapper)
+    except NotCompilable:
+        return wrapper
+
+
+def seed_compiled(wrapper: Any, compiled: CompiledTrees) -> None:
+    """Make `compiled` (trees saved with the wrapper's current model) the compiled_view cache, without loading the model."""
+    wrapper._compiled = (wrapper.model, wrapper.best_iteration, compiled)
+
+
+def is_compilable(wrapper: Any) -> bool:
+    return getattr(wrapper, "backend", None) in ("xgboost", "lightgbm", "catboost", "sklearn") and not getattr(wrapper, "requires_groups", False)
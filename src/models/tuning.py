@@ -0,0 +1,267 @@
+"""Successive-halving / Hyperband hyperparameter search over walk-forward folds."""
+from __future__ import annotations
+
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .backends import optional_import
+from .catb import CatBoostWrapper
+from .lgbm import LGBMWrapper
+from .set_mlp import SetMLPWrapper
+from .xgb import XGBWrapper
+
+# (kind, low, high): "int"/"float" are uniform, "log_int"/"log" are log-uniform, "choice" picks from low.
+SEARCH_SPACES: Dict[str, Dict[str, Tuple[Any, ...]]] = {
+    "xgb": {
+        "max_depth": ("int", 3, 10),
+        "eta": ("log", 0.01, 0.3),
+        "subsample": ("float", 0.5, 1.0),
+        "colsample_bytree": ("float", 0.5, 1.0),
+        "min_child_weight": ("log", 1.0, 20.0),
+        "reg_lambda": ("log", 0.1, 10.0),
+    },
+    "lgbm": {
+        "num_leaves": ("log_int", 8, 128),
+        "learning_rate": ("log", 0.01, 0.3),
+        "feature_fraction": ("float", 0.5, 1.0),
+        "bagging_fraction": ("float", 0.5, 1.0),
+        "bagging_freq": ("choice", (0, 1)),
+        "min_child_samples": ("log_int", 5, 100),
+        "reg_lambda": ("log", 0.01, 10.0),
+    },
+    "catboost": {
+        "depth": ("int", 4, 10),
+        "learning_rate": ("log", 0.01, 0.3),
+        "l2_leaf_reg": ("log", 1.0, 10.0),
+        "random_strength": ("log", 0.1, 10.0),
+        "bagging_temperature": ("float", 0.0, 1.0),
+    },
+    "set_mlp": {
+        "hidden_dim": ("choice", (64, 128, 256)),
+        "num_layers": ("int", 1, 3),
+        "dropout": ("float", 0.0, 0.3),
+        "lr": ("log", 1e-4, 3e-3),
+        "weight_decay": ("log", 1e-4, 0.1),
+    },
+}
+
+# Budget unit per model (boosting rounds or epochs) and the full-budget value used on the last rung.
+MAX_RESOURCE: Dict[str, int] = {"xgb": 600, "lgbm": 600, "catboost": 1000, "set_mlp": 150}
+# Wrapper parameter that carries the budget, both in trials and in the emitted best_params.json.
+RESOURCE_PARAMS: Dict[str, str] = {"xgb": "n_estimators", "lgbm": "n_estimators", "catboost": "iterations", "set_mlp": "max_epochs"}
+
+# Keep every worker single-threaded so the process pool, not the libraries, owns the cores.
+SINGLE_THREAD_PARAMS: Dict[str, Dict[str, Any]] = {
+    "xgb": {"n_jobs": 1},
+    "lgbm": {"n_jobs": 1},
+    "catboost": {"thread_count": 1},
+    "set_mlp": {},
+    "xgb_rank": {"n_jobs": 1},
+    "lgbm_rank": {"n_jobs": 1},
+    "catboost_rank": {"thread_count": 1},
+}
+
+_WORKER: Dict[str, Any] = {}
+
+
+def parse_resources(entries: Optional[Sequence[str]]) -> Dict[str, int]:
+    """`MODEL=N` round/epoch budgets; unlike time budgets these must be positive integers."""
+    resources: Dict[str, int] = {}
+    for entry in entries or []:
+        name, _, value = entry.partition("=")
+        if not name or not value.strip().isdigit() or int(value) < 1:
+            raise ValueError(f"Geçersiz kaynak bütçesi: {entry!r} (beklenen: model=pozitif tamsayı)")
+        if name.strip() not in MAX_RESOURCE:
+            raise ValueError(f"Bilinmeyen model: {name.strip()!r} (seçenekler: {sorted(MAX_RESOURCE)})")
+        resources[name.strip()] = int(value)
+    return resources
+
+
+def sample_config(space: Dict[str, Tuple[Any, ...]], rng: np.random.Generator) -> Dict[str, Any]:
+    config: Dict[str, Any] = {}
+    for name, (kind, *bounds) in space.items():
+        if kind == "choice":
+            options = bounds[0]
+            config[name] = options[int(rng.integers(len(options)))]
+        elif kind == "int":
+            config[name] = int(rng.integers(bounds[0], bounds[1] + 1))
+        elif kind == "log_int":
+            config[name] = int(round(math.exp(rng.uniform(math.log(bounds[0]), math.log(bounds[1])))))
+        elif kind == "log":
+            config[name] = float(math.exp(rng.uniform(math.log(bounds[0]), math.log(bounds[1]))))
+        else:
+            config[name] = float(rng.uniform(bounds[0], bounds[1]))
+    return config
+
+
+def build_wrapper(model: str, params: Dict[str, Any], resource: int, input_dim: int) -> Any:
+    """Wrapper for one trial; `resource` replaces the round/epoch count and no early stopping is used."""
+    if model == "xgb":
+        return XGBWrapper(params={**params, RESOURCE_PARAMS[model]: resource})
+    if model == "lgbm":
+        return LGBMWrapper(params={**params, RESOURCE_PARAMS[model]: resource})
+    if model == "catboost":
+        return CatBoostWrapper(params={**params, RESOURCE_PARAMS[model]: resource})
+    if model == "set_mlp":
+        return SetMLPWrapper(input_dim=input_dim, params=params, max_epochs=resource)
+    raise KeyError(f"Bilinmeyen model: {model}")
+
+
+def _binary_logloss(y_true: np.ndarray, y_prob: np.ndarray) -> float:
+    y_prob = np.clip(y_prob, 1e-7, 1 - 1e-7)
+    return float(-np.mean(y_true * np.log(y_prob) + (1 - y_true) * np.log(1 - y_prob)))
+
+
+def _init_worker(X: np.ndarray, y: np.ndarray, groups: np.ndarray, folds: List[Tuple[np.ndarray, np.ndarray]], single_thread: bool) -> None:
+    _WORKER.update(X=X, y=y, groups=groups, folds=folds, single_thread=single_thread)
+
+
+def _evaluate(task: Tuple[str, int, Dict[str, Any], int, int]) -> Tuple[int, int, float, float]:
+    model, trial_id, params, resource, fold = task
+    X, y, groups = _WORKER["X"], _WORKER["y"], _WORKER["groups"]
+    train_idx, val_idx = _WORKER["folds"][fold]
+    started = time.perf_counter()
+    if _WORKER["single_thread"]:
+        params = {**params, **SINGLE_THREAD_PARAMS[model]}
+        torch = optional_import("torch") if model == "set_mlp" else None
+        if torch is not None:
+            torch.set_num_threads(1)
+    wrapper = build_wrapper(model, params, resource, X.shape[1])
+    if model == "set_mlp":
+        wrapper.fit(X[train_idx], y[train_idx], groups_train=groups[train_idx])
+        probs = wrapper.predict_proba(X[val_idx], groups=groups[val_idx])[:, 1]
+    else:
+        wrapper.fit(X[train_idx], y[train_idx])
+        probs = wrapper.predict_proba(X[val_idx])[:, 1]
+    return trial_id, fold, _binary_logloss(y[val_idx], probs), time.perf_counter() - started
+
+
+@dataclass
+class Trial:
+    trial_id: int
+    params: Dict[str, Any]
+    scores: Dict[int, float] = field(default_factory=dict)
+    resource: int = 0
+    bracket: int = 0
+
+    @property
+    def score(self) -> float:
+        return float(np.mean(list(self.scores.values()))) if self.scores else float("inf")
+
+
+def hyperband_brackets(max_resource: int, min_resource: int, eta: int) -> List[Tuple[int, int]]:
+    """(n_configs, first_rung_resource) per Hyperband bracket, most exploratory first."""
+    s_max = int(math.floor(math.log(max_resource / min_resource, eta) + 1e-9))
+    brackets = []
+    for s in range(s_max, -1, -1):
+        n = int(math.ceil((s_max + 1) / (s + 1) * eta**s))
+        brackets.append((n, max(min_resource, int(round(max_resource * eta ** (-s))))))
+    return brackets
+
+
+def _rung_resources(first: int, max_resource: int, eta: int) -> List[int]:
+    resources = [first]
+    while resources[-1] < max_resource:
+        resources.append(min(max_resource, resources[-1] * eta))
+    return resources
+
+
+def successive_halving(
+    model: str,
+    trials: List[Trial],
+    first_resource: int,
+    max_resource: int,
+    eta: int,
+    n_folds: int,
+    run: Callable[[Sequence[Tuple[str, int, Dict[str, Any], int, int]]], List[Tuple[int, int, float, float]]],
+    log: Optional[List[Dict[str, Any]]] = None,
+) -> List[Trial]:
+    """Evaluate all live trials on every fold at the rung budget, keep the best 1/eta, grow the budget."""
+    alive = list(trials)
+    by_id = {trial.trial_id: trial for trial in trials}
+    for rung, resource in enumerate(_rung_resources(first_resource, max_resource, eta)):
+        for trial in alive:
+            trial.scores = {}
+            trial.resource = resource
+        tasks = [(model, trial.trial_id, trial.params, resource, fold) for trial in alive for fold in range(n_folds)]
+        elapsed = 0.0
+        for trial_id, fold, score, seconds in run(tasks):
+            by_id[trial_id].scores[fold] = score
+            elapsed += seconds
+        alive.sort(key=lambda trial: trial.score)
+        if log is not None:
+            log.append({"model": model, "bracket": alive[0].bracket, "rung": rung, "resource": resource, "configs": len(alive), "best_logloss": alive[0].score, "cpu_s": elapsed})
+        if resource >= max_resource:
+            break
+        alive = alive[: max(1, len(alive) // eta)]
+    return alive
+
+
+@dataclass
+class TuneResult:
+    model: str
+    best_params: Dict[str, Any]
+    best_logloss: float
+    best_resource: int
+    n_configs: int
+    rungs: List[Dict[str, Any]]
+    wall_s: float
+
+
+def tune_model(
+    model: str,
+    X: np.ndarray,
+    y: np.ndarray,
+    groups: np.ndarray,
+    folds: List[Tuple[np.ndarray, np.ndarray]],
+    n_configs: int = 81,
+    eta: int = 3,
+    min_resource: Optional[int] = None,
+    max_resource: Optional[int] = None,
+    strategy: str = "sh",
+    workers: int = 1,
+    seed: int = 42,
+) -> TuneResult:
+    max_resource = max_resource or MAX_RESOURCE[model]
+    min_resource = min_resource or max(1, max_resource // eta**4)
+    rng = np.random.default_rng((seed, sorted(SEARCH_SPACES).index(model)))
+    if strategy == "hyperband":
+        brackets = hyperband_brackets(max_resource, min_resource, eta)
+    else:
+        brackets = [(n_configs, min_resource)]
+
+    started = time.perf_counter()
+    rungs: List[Dict[str, Any]] = []
+    finalists: List[Trial] = []
+    next_id = 0
+    initargs = (X, y, groups, folds, workers > 1)
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs)
+        run = lambda tasks: list(executor.map(_evaluate, tasks, chunksize=1))  # noqa: E731
+    else:
+        executor = None
+        _init_worker(*initargs)
+        run = lambda tasks: [_evaluate(task) for task in tasks]  # noqa: E731
+    try:
+        for bracket, (n, first) in enumerate(brackets):
+            trials = [Trial(trial_id=next_id + i, params=sample_config(SEARCH_SPACES[model], rng), bracket=bracket) for i in range(n)]
+            next_id += n
+            finalists.extend(successive_halving(model, trials, first, max_resource, eta, len(folds), run, rungs))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    best = min(finalists, key=lambda trial: trial.score)
+    return TuneResult(
+        model=model,
+        best_params=best.params,
+        best_logloss=best.score,
+        best_resource=best.resource,
+        n_configs=next_id,
+        rungs=rungs,
+        wall_s=time.perf_counter() - started,
+    )
@@ -0,0 +1,136 @@
+"""Model-based uncertainty of the ensemble win probability from sources that reuse work already done."""
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+from .calibrate import sigmoid
+from .ensemble import ContextGatedEnsemble
+from .ranking import RankingWrapper
+from .tree_engine import CompiledTrees, NotCompilable, compiled_view
+
+# members: spread of the gate's answer when it follows each probability member in turn (already computed, free).
+# staged:  spread of each booster over its last half of trees (one extra traversal through the compiled engine).
+# dropout: MC-dropout passes of the Set MLP (one batched forward pass over the whole card).
+UNCERTAINTY_SOURCES: Tuple[str, ...] = ("members", "staged", "dropout")
+BOOSTER_BACKENDS: Tuple[str, ...] = ("xgboost", "lightgbm", "catboost")
+
+
+@dataclass
+class UncertaintyEstimate:
+    """Per-runner standard deviations by source, plus the wall time each source added."""
+
+    components: Dict[str, np.ndarray] = field(default_factory=dict)
+    seconds: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def win_std(self) -> np.ndarray:
+        return self.components["win_std"]
+
+
+def stage_ends(n_trees: int, n_stages: int = 5) -> np.ndarray:
+    """Tree counts from half of the ensemble to all of it."""
+    return np.unique(np.linspace(max(1, n_trees // 2), n_trees, n_stages).round().astype(np.int64))
+
+
+def staged_variance(model: Any, X: np.ndarray, n_stages: int = 5) -> np.ndarray | None:
+    """Variance of a booster's probability across truncations of its tree sequence; None for non-boosters and
+    for boosters the NumPy engine cannot compile."""
+    if isinstance(model, CompiledTrees):
+        compiled = model
+    elif getattr(model, "backend", None) in BOOSTER_BACKENDS and not getattr(model, "requires_groups", False):
+        try:
+            compiled = compiled_view(model)
+        except NotCompilable:
+            return None
+    else:
+        return None
+    if compiled.link != "sigmoid":
+        return None
+    staged = sigmoid(compiled.staged_margin(X, stage_ends(compiled.n_trees, n_stages)))
+    return staged.var(axis=1)
+
+
+def is_probability_member(model: Any) -> bool:
+    """Ranking members feed the gate a race softmax of raw scores, which is not on the win-probability scale."""
+    return not isinstance(model, RankingWrapper)
+
+
+def _half_width(z: np.ndarray, std: np.ndarray, calibrator: Any = None, keys: np.ndarray | None = None) -> np.ndarray:
+    """A gate-logit standard deviation expressed on the calibrated probability scale (secant over z ± std)."""
+    low, high = sigmoid(z - std), sigmoid(z + std)
+    if calibrator is not None:
+        low = np.clip(calibrator.apply(low, keys), 0.0, 1.0)
+        high = np.clip(calibrator.apply(high, keys), 0.0, 1.0)
+    return 0.5 * np.abs(high - low)
+
+
+def estimate_uncertainty(
+    models: Dict[str, Any],
+    ensemble: ContextGatedEnsemble,
+    base_preds: Sequence[np.ndarray],
+    combined: np.ndarray,
+    X: np.ndarray,
+    groups: Iterable[object] | None = None,
+    sources: Sequence[str] = ("members",),
+    n_stages: int = 5,
+    dropout_passes: int = 8,
+    calibrator: Any = None,
+    calibration_keys: np.ndarray | None = None,
+) -> UncertaintyEstimate:
+    """Combine the requested sources into a per-runner `win_std` of the calibrated win probability.
+
+    Every gate kind is linear in its inputs on the logit scale, z = gate_design(...) @ weights, so the sources
+    are added there as variances. `member_std` is the spread of z_k, the gate's logit when every probability
+    member agrees with member k; staged-tree and MC-dropout variances enter as sum_k w_k^2 var_k.
+    Each component is then mapped through the sigmoid and the calibrator as the half-width of z ± std.
+    """
+    estimate = UncertaintyEstimate()
+    base = np.column_stack(list(base_preds))
+    names: List[str] = list(models)
+    weights = ensemble.member_weights(base.shape[1])
+    z = np.log(np.clip(combined, 1e-12, 1.0)) - np.log(np.clip(1.0 - combined, 1e-12, 1.0))
+    logit_var: Dict[str, np.ndarray] = {}
+    if "members" in sources:
+        started = time.perf_counter()
+        members = [k for k, name in enumerate(names) if is_probability_member(models[name])]
+        if len(members) > 1:
+            w, outputs = weights[members], base[:, members]
+            # z_k - z = sum_j w_j (b_k - b_j) over the probability members; ranking inputs stay as they are.
+            shifts = w.sum() * outputs - (outputs @ w)[:, None]
+            logit_var["member_std"] = shifts.var(axis=1)
+        else:
+            logit_var["member_std"] = np.zeros(len(X))
+        estimate.seconds["members"] = time.perf_counter() - started
+
+    member_var = np.zeros_like(base)
+    if "staged" in sources:
+        started = time.perf_counter()
+        for k, name in enumerate(names):
+            variance = staged_variance(models[name], X, n_stages)
+            if variance is not None:
+                member_var[:, k] += variance
+        estimate.seconds["staged"] = time.perf_counter() - started
+    if "dropout" in sources:
+        started = time.perf_counter()
+        for k, name in enumerate(names):
+            if hasattr(models[name], "dropout_variance"):
+                member_var[:, k] += models[name].dropout_variance(X, groups, passes=dropout_passes)
+        estimate.seconds["dropout"] = time.perf_counter() - started
+    if "staged" in sources or "dropout" in sources:
+        logit_var["model_std"] = member_var @ weights**2
+    logit_var["win_std"] = sum(logit_var.values(), np.zeros(len(X)))
+    for name, variance in logit_var.items():
+        estimate.components[name] = _half_width(z, np.sqrt(variance), calibrator, calibration_keys)
+    return estimate
+
+
+def through_race_combiner(estimate: UncertaintyEstimate, calibrated: np.ndarray, race_probs: np.ndarray, model_coef: float) -> None:
+    """Carry calibrated-scale stds through the conditional logit, in place: dq/dc = |b| q(1-q) / (c(1-c))."""
+    c = np.clip(calibrated, 1e-6, 1 - 1e-6)
+    slope = abs(model_coef) * race_probs * (1 - race_probs) / (c * (1 - c))
+    for name in estimate.components:
+        estimate.components[name] = estimate.components[name] * slope
@@ -2,27 +2,49 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
+from pathlib import Path
 from typing import Any, Dict, Optional
 
 import numpy as np
 
-try:  # pragma: no cover - optional dependency
-    import xgboost as xgb  # type: ignore
-except ImportError:  # pragma: no cover
-    xgb = None  # type: ignore
+from .backends import DeferredFile, DeferredModelMixin, load_pickle_file, optional_attr, optional_import
+from .budget import DEFAULT_PATIENCE, Deadline
 
-try:  # pragma: no cover
-    from sklearn.ensemble import GradientBoostingClassifier
-except ImportError:  # pragma: no cover
-    GradientBoostingClassifier = None  # type: ignore
+
+def deadline_callback(xgb: Any, deadline: Deadline) -> Any:
+    class DeadlineCallback(xgb.callback.TrainingCallback):  # type: ignore[misc]
+        def after_iteration(self, model, epoch, evals_log) -> bool:  # type: ignore[override]
+            return deadline.expired()
+
+    return DeadlineCallback()
+
+
+def _load_xgb_file(path: str) -> Any:
+    xgb = optional_import("xgboost")
+    if xgb is None:
+        raise ImportError("xgboost modeli yüklemek için xgboost gerekli")
+    booster = xgb.XGBClassifier()
+    booster.load_model(path)
+    return booster
 
 
 @dataclass
-class XGBWrapper:
+class XGBWrapper(DeferredModelMixin):
     params: Optional[Dict[str, Any]] = None
     model: Any = None
+    early_stopping_rounds: int = DEFAULT_PATIENCE
+    time_budget_s: Optional[float] = None
+    best_iteration: Optional[int] = None
+    backend: Optional[str] = None
 
-    def fit(self, X_train: np.ndarray, y_train: np.ndarray, X_val: np.ndarray | None = None, y_val: np.ndarray | None = None) -> None:
+    def fit(
+        self,
+        X_train: np.ndarray,
+        y_train: np.ndarray,
+        X_val: np.ndarray | None = None,
+        y_val: np.ndarray | None = None,
+        sample_weight: np.ndarray | None = None,
+    ) -> None:
         params = {
             "tree_method": "hist",
             "max_depth": 7,
@@ -34,9 +56,13 @@ class XGBWrapper:
         }
         if self.params:
             params.update(self.params)
+        has_val = X_val is not None and y_val is not None
+        deadline = Deadline(self.time_budget_s)
+        xgb = optional_import("xgboost")
         if xgb is not None:
             booster_params = params.copy()
             n_estimators = booster_params.pop("n_estimators", 600)
+            callbacks = [deadline_callback(xgb, deadline)] if self.time_budget_s is not None else None
             booster = xgb.XGBClassifier(
                 n_estimators=n_estimators,
                 tree_method=booster_params.pop("tree_method", "hist"),
@@ -44,27 +70,90 @@ class XGBWrapper:
                 eta=booster_params.pop("eta", 0.05),
                 subsample=booster_params.pop("subsample", 0.8),
                 colsample_bytree=booster_params.pop("colsample_bytree", 0.8),
-                eval_metric="logloss",
+                eval_metric=booster_params.pop("eval_metric", "logloss"),
                 objective="binary:logistic",
                 random_state=42,
+                early_stopping_rounds=self.early_stopping_rounds if has_val else None,
+                callbacks=callbacks,
                 **booster_params,
             )
-            eval_set = [(X_train, y_train)]
-            if X_val is not None and y_val is not None:
-                eval_set.append((X_val, y_val))
-            booster.fit(X_train, y_train, eval_set=eval_set, verbose=False)
+            eval_set = [(X_val, y_val)] if has_val else None
+            booster.fit(X_train, y_train, sample_weight=sample_weight, eval_set=eval_set, verbose=False)
+            booster.set_params(callbacks=None)
             self.model = booster
+            self.backend = "xgboost"
+            if has_val:
+                self.best_iteration = int(booster.best_iteration)
+            else:
+                self.best_iteration = int(booster.get_booster().num_boosted_rounds()) - 1
         else:
+            GradientBoostingClassifier = optional_attr("sklearn.ensemble", "GradientBoostingClassifier")
             if GradientBoostingClassifier is None:
                 raise ImportError("Neither xgboost nor sklearn is available")
-            booster = GradientBoostingClassifier(random_state=42)
-            booster.fit(X_train, y_train)
+            booster = GradientBoostingClassifier(
+                random_state=42,
+                n_iter_no_change=self.early_stopping_rounds,
+                validation_fraction=0.1,
+            )
+            booster.fit(X_train, y_train, sample_weight=sample_weight)
             self.model = booster
+            self.backend = "sklearn"
+            self.best_iteration = int(booster.n_estimators_) - 1
+
+    @property
+    def supports_warm_start(self) -> bool:
+        return self.backend == "xgboost" and self.model is not None
+
+    def continue_fit(self, X_train: np.ndarray, y_train: np.ndarray, X_val: np.ndarray | None = None, y_val: np.ndarray | None = None, rounds: int = 50) -> None:
+        """Add up to `rounds` trees on top of the kept ensemble (trees past best_iteration are dropped first)."""
+        xgb = optional_import("xgboost")
+        if xgb is None:
+            raise ImportError("Artımlı eğitim için xgboost gerekli")
+        previous = self.resolved_model()
+        kept = previous.get_booster()
+        if self.best_iteration is not None:
+            kept = kept[: self.best_iteration + 1]
+        has_val = X_val is not None and y_val is not None
+        deadline = Deadline(self.time_budget_s)
+        params = {key: value for key, value in previous.get_params().items() if key not in ("n_estimators", "early_stopping_rounds", "callbacks")}
+        booster = xgb.XGBClassifier(
+            n_estimators=rounds,
+            early_stopping_rounds=self.early_stopping_rounds if has_val else None,
+            callbacks=[deadline_callback(xgb, deadline)] if self.time_budget_s is not None else None,
+            **params,
+        )
+        booster.fit(X_train, y_train, eval_set=[(X_val, y_val)] if has_val else None, verbose=False, xgb_model=kept)
+        booster.set_params(callbacks=None)
+        self.model = booster
+        # best_iteration counts the continued trees as well, so it stays an index into the whole ensemble.
+        if has_val:
+            self.best_iteration = int(booster.best_iteration)
+        else:
+            self.best_iteration = int(booster.get_booster().num_boosted_rounds()) - 1
 
     def predict_proba(self, X: np.ndarray) -> np.ndarray:
         if self.model is None:
             raise RuntimeError("Model not trained")
-        proba = self.model.predict_proba(X)
+        model = self.resolved_model()
+        if self.backend == "xgboost" and self.best_iteration is not None:
+            proba = model.predict_proba(X, iteration_range=(0, self.best_iteration + 1))
+        else:
+            proba = model.predict_proba(X)
         if proba.ndim == 1:
             proba = np.vstack([1 - proba, proba]).T
         return proba
+
+    def save_native(self, directory: Path, stem: str) -> Dict[str, Any]:
+        model = self.resolved_model()
+        if self.backend != "xgboost":
+            return self.save_pickle_component(model, directory, stem)
+        path = directory / f"{stem}.ubj"
+        model.save_model(path)
+        return {"format": "xgboost-ubj", "files": {"model": path.name}, "state": self.bundle_state()}
+
+    @classmethod
+    def from_native(cls, directory: Path, entry: Dict[str, Any]) -> "XGBWrapper":
+        wrapper = cls(**entry["state"])
+        loader = _load_xgb_file if entry["format"] == "xgboost-ubj" else load_pickle_file
+        wrapper.model = DeferredFile(directory / entry["files"]["model"], loader)
+        return wrapper